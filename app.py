@@ -3,14 +3,20 @@ import os
 import time
 import json
 import secrets
+import hashlib
+import queue
 import threading
 from datetime import datetime
 from dotenv import load_dotenv
 from mongodb_connector import MongoDBConnector
 
+# Startup is timed against a budget; NLP data is loaded lazily so it doesn't count
+STARTUP_STARTED = time.time()
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", 5))
+
 # Import WebSocket support
 try:
-    from websocket_server import init_socketio, socketio, broadcast_to_room
+    from websocket_server import init_socketio, socketio, broadcast_to_room, set_prediction_provider
     WEBSOCKET_ENABLED = True
     print("WebSocket support enabled")
 except ImportError:
@@ -41,6 +47,9 @@ try:
             db.migrate_from_files()
             # Set migration_completed flag
             db.ai_data.insert_one({"type": "migration_completed", "timestamp": datetime.now().isoformat()})
+
+        # Move a knowledge base stored as a single document to per-topic documents
+        db.migrate_knowledge_base()
     except Exception as e:
         print(f"Error during migration: {e}")
 
@@ -90,7 +99,23 @@ except Exception as e:
 
             def add_message_to_room(self, room_name, username, message, sentiment=None):
                 """Add a message to a room"""
-                return True
+                return secrets.token_hex(12)
+
+            def get_room_sentiment(self, room_name):
+                """Get room sentiment aggregates"""
+                return None
+
+            def get_sentiment_timeseries(self, room_name, start=None, end=None, points=200):
+                """Get room sentiment over time"""
+                return {"start": None, "end": None, "bucket_seconds": 0, "points": []}
+
+            def get_unscored_messages(self, room_name, limit=500):
+                """Get messages stored without a sentiment score"""
+                return []
+
+            def update_message_sentiment(self, message_id, room_name, username, message, sentiment):
+                """Store the score of an unscored message"""
+                return False
 
             def get_active_rooms(self, limit=50):
                 """Get active rooms"""
@@ -125,23 +150,66 @@ except Exception as e:
 
 # Import AI modules if available
 try:
-    from sentiment_analyzer import MessageSentimentAnalyzer
+    from sentiment_analyzer import MessageSentimentAnalyzer, SentimentScorer
     from recommendation_system import RoomRecommender
     from chatbot_assistant import ChatbotAssistant
-    from predictive_text import PredictiveText
+    from predictive_text import create_predictive_text
+    import nlp_resources
+
+    # Sentiment and categorization can't work without the NLP data, so don't start half-working
+    missing_resources = nlp_resources.missing()
+    if missing_resources and not nlp_resources.downloads_allowed():
+        raise RuntimeError(
+            f"NLP resources not provisioned in {nlp_resources.NLTK_DATA_DIR}: {', '.join(missing_resources)}. "
+            f"Run `python nlp_resources.py provision` (or set NLP_ALLOW_DOWNLOAD=1)"
+        )
 
     # Initialize AI components with database instance
     sentiment_analyzer = MessageSentimentAnalyzer()
     room_recommender = RoomRecommender(database=db)
     chatbot = ChatbotAssistant(name="AIBot", db=db if USING_MONGODB else None)
-    predictive_text = PredictiveText()
+    predictive_text = create_predictive_text()
+
+    def store_message_sentiment(score, message_id, room_name, username, message):
+        """Store a background-scored message sentiment and push it to the room"""
+        db.update_message_sentiment(message_id, room_name, username, message, score)
+        if WEBSOCKET_ENABLED:
+            broadcast_to_room(room_name, 'sentiment_update', {
+                'id': str(message_id),
+                'room': room_name,
+                'sentiment': score
+            })
+
+    # Messages are scored after they are stored and broadcast, off the request path
+    sentiment_scorer = SentimentScorer(
+        sentiment_analyzer,
+        store_message_sentiment,
+        workers=int(os.getenv("SENTIMENT_WORKERS", 2)),
+        max_pending=int(os.getenv("SENTIMENT_MAX_PENDING", 1000))
+    )
 
     AI_ENABLED = True
     print("AI features enabled! 🤖")
+
+    # Answer predictions over the chat's Socket.IO connection too
+    if WEBSOCKET_ENABLED:
+        set_prediction_provider(predictive_text.predict_next_word)
 except ImportError as e:
     print(f"Some AI features may not be available: {e}")
     AI_ENABLED = False
 
+startup_seconds = time.time() - STARTUP_STARTED
+if startup_seconds > STARTUP_BUDGET_SECONDS:
+    print(f"Warning: startup took {startup_seconds:.1f}s, over the {STARTUP_BUDGET_SECONDS:.0f}s budget")
+else:
+    print(f"Started in {startup_seconds:.1f}s")
+
+# Maximum number of legacy messages scored per /api/sentiment request
+SENTIMENT_BACKFILL_BATCH = int(os.getenv("SENTIMENT_BACKFILL_BATCH", 500))
+
+# Upper bound on the points a sentiment time series request may ask for
+MAX_TIMESERIES_POINTS = 2000
+
 # Ensure required directories exist for static files and backups
 os.makedirs('static/images', exist_ok=True)
 os.makedirs('backups', exist_ok=True)
@@ -150,6 +218,13 @@ os.makedirs('templates', exist_ok=True)
 # Background task for periodic operations
 def background_tasks():
     """Run periodic tasks in the background"""
+    # Warm up trending topics from stored messages once at startup
+    if AI_ENABLED and 'room_recommender' in globals():
+        try:
+            room_recommender.seed_trending_topics()
+        except Exception as e:
+            print(f"Error seeding trending topics: {e}")
+
     while True:
         try:
             # Create backup every 30 minutes if using MongoDB
@@ -160,16 +235,67 @@ def background_tasks():
             if AI_ENABLED and 'room_recommender' in globals():
                 room_recommender.update_room_content(force_refresh=True)
 
+                # Precompute recommendations for recently active users
+                room_recommender.batch_recommend(top_n=5)
+
             # Sleep for 30 minutes
             time.sleep(1800)
         except Exception as e:
             print(f"Error in background task: {e}")
             time.sleep(60)  # Sleep for a minute if there's an error
 
-# Start background thread
+def bot_worker():
+    """Answer queued chatbot mentions and broadcast the replies"""
+    while True:
+        room_name, username, bot_query = bot_queue.get()
+        try:
+            # Let the room see the bot typing while it works on the reply
+            if WEBSOCKET_ENABLED:
+                broadcast_to_room(room_name, 'user_typing', {
+                    'username': chatbot.name,
+                    'room': room_name,
+                    'typing': True
+                })
+
+            bot_response = chatbot.get_response(bot_query, room_name, username)
+            message_id = db.add_message_to_room(room_name, chatbot.name, bot_response)
+
+            # Broadcast bot response via WebSockets if enabled
+            if WEBSOCKET_ENABLED and message_id:
+                broadcast_to_room(room_name, 'chat_message', {
+                    'id': str(message_id),
+                    'username': chatbot.name,
+                    'room': room_name,
+                    'message': bot_response,
+                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    'sentiment': None
+                })
+        except Exception as e:
+            print(f"Error answering chatbot message: {e}")
+        finally:
+            if WEBSOCKET_ENABLED:
+                broadcast_to_room(room_name, 'user_typing', {
+                    'username': chatbot.name,
+                    'room': room_name,
+                    'typing': False
+                })
+            bot_queue.task_done()
+
+# Chatbot mentions waiting for a reply; when full, new mentions are turned away
+bot_queue = queue.Queue(maxsize=int(os.getenv("BOT_QUEUE_SIZE", 100)))
+
+# Start background threads
 background_thread = threading.Thread(target=background_tasks, daemon=True)
 background_thread.start()
 
+# The bot worker emits to rooms, so it runs as a task of Socket.IO's async mode when available
+if AI_ENABLED:
+    if WEBSOCKET_ENABLED:
+        socketio.start_background_task(bot_worker)
+    else:
+        bot_thread = threading.Thread(target=bot_worker, daemon=True)
+        bot_thread.start()
+
 # Routes
 @app.route('/')
 def index():
@@ -562,7 +688,10 @@ def rooms():
     # Get recommendations if AI is enabled
     recommendations = []
     if AI_ENABLED and 'username' in session:
-        recommendations = room_recommender.get_user_recommendations(session['username'], top_n=3)
+        # Prefer the precomputed batch results; fall back to computing on demand
+        recommendations = room_recommender.get_precomputed_recommendations(session['username'], top_n=3)
+        if not recommendations:
+            recommendations = room_recommender.get_user_recommendations(session['username'], top_n=3)
 
     return render_template('rooms.html',
                           rooms=active_rooms,
@@ -691,50 +820,45 @@ def send_message(room_name):
         return jsonify({'error': 'Empty message'}), 400
 
     # Process message with AI components
-    sentiment_score = None
     if AI_ENABLED:
-        # Analyze sentiment
-        sentiment = sentiment_analyzer.analyze_message(message)
-        sentiment_score = sentiment.get('compound', 0)
-
         # Update user models
         predictive_text.train_on_message(session['username'], message)
         room_recommender.update_user_interest(session['username'], message)
+        room_recommender.record_message(room_name, message)
 
-    # Save message using database
-    success = db.add_message_to_room(room_name, session['username'], message, sentiment_score)
+    # Save message using database; sentiment is filled in once it has been scored
+    message_id = db.add_message_to_room(room_name, session['username'], message)
 
-    if success:
+    if message_id:
         # Broadcast message via WebSockets if enabled
         if WEBSOCKET_ENABLED:
             broadcast_to_room(room_name, 'chat_message', {
+                'id': str(message_id),
                 'username': session['username'],
                 'room': room_name,
                 'message': message,
                 'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'sentiment': sentiment_score
+                'sentiment': None
             })
 
-        # Check if message is directed to the chatbot
-        if AI_ENABLED and (message.lower().startswith('@aibot') or message.lower().startswith('@ai')):
-            bot_query = message.split(' ', 1)[1] if ' ' in message else ""
-            bot_response = chatbot.get_response(bot_query, room_name, session['username'])
+        # Score sentiment in the background; if the pool is full the message
+        # stays unscored and is picked up later by /api/sentiment
+        if AI_ENABLED:
+            sentiment_scorer.submit(message, message_id, room_name, session['username'], message)
 
-            # Add bot response to chat
-            time.sleep(1)  # Simulate thinking
-            db.add_message_to_room(room_name, "AIBot", bot_response)
+        result = {'status': 'success', 'id': str(message_id)}
 
-            # Broadcast bot response via WebSockets if enabled
-            if WEBSOCKET_ENABLED:
-                broadcast_to_room(room_name, 'chat_message', {
-                    'username': "AIBot",
-                    'room': room_name,
-                    'message': bot_response,
-                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'sentiment': None
-                })
+        # Check if message is directed to the chatbot; the reply is generated
+        # by the bot worker and arrives later as a regular chat message
+        if AI_ENABLED and (message.lower().startswith('@aibot') or message.lower().startswith('@ai')):
+            bot_query = message.split(' ', 1)[1] if ' ' in message else ""
+            try:
+                bot_queue.put_nowait((room_name, session['username'], bot_query))
+                result['bot'] = 'queued'
+            except queue.Full:
+                result['bot'] = 'busy'
 
-        return jsonify({'status': 'success'})
+        return jsonify(result)
     else:
         return jsonify({'error': 'Failed to send message'}), 500
 
@@ -747,20 +871,20 @@ def get_sentiment(room_name):
     if not AI_ENABLED:
         return jsonify({'error': 'AI features not enabled'}), 400
 
-    # Get messages from database
-    messages = db.get_room_messages(room_name, limit=100)
-
-    if not messages:
-        return jsonify({'error': 'Not enough messages for analysis'}), 400
+    # Messages are scored when they are sent; only legacy messages stored
+    # without a score still need scoring, and once scored they count forever
+    unscored = db.get_unscored_messages(room_name, limit=SENTIMENT_BACKFILL_BATCH)
+    if unscored:
+        scores = sentiment_analyzer.analyze_conversation([msg["content"] for msg in unscored])
+        for msg, score in zip(unscored, scores):
+            db.update_message_sentiment(msg["_id"], room_name, msg["username"], msg["content"], score)
 
-    # Extract message content
-    message_texts = [msg["content"] for msg in messages]
+    stats = db.get_room_sentiment(room_name)
 
-    # Analyze sentiment
-    sentiment_scores = sentiment_analyzer.analyze_conversation(message_texts)
+    if not stats or not stats.get("count"):
+        return jsonify({'error': 'Not enough messages for analysis'}), 400
 
-    # Calculate average
-    avg_sentiment = sum(sentiment_scores) / len(sentiment_scores)
+    avg_sentiment = stats["sum"] / stats["count"]
 
     # Count sentiment categories
     categories = {
@@ -770,34 +894,37 @@ def get_sentiment(room_name):
         "Negative": 0,
         "Very Negative": 0
     }
-
-    for score in sentiment_scores:
-        label = get_sentiment_label(score)
-        categories[label] += 1
-
-    # Find most positive and negative messages
-    most_positive_idx = sentiment_scores.index(max(sentiment_scores))
-    most_negative_idx = sentiment_scores.index(min(sentiment_scores))
+    categories.update(stats.get("categories", {}))
 
     result = {
         'average_sentiment': avg_sentiment,
         'sentiment_label': get_sentiment_label(avg_sentiment),
-        'message_count': len(message_texts),
+        'message_count': stats["count"],
         'categories': categories,
-        'most_positive': {
-            'message': message_texts[most_positive_idx],
-            'score': sentiment_scores[most_positive_idx],
-            'author': messages[most_positive_idx]['username']
-        },
-        'most_negative': {
-            'message': message_texts[most_negative_idx],
-            'score': sentiment_scores[most_negative_idx],
-            'author': messages[most_negative_idx]['username']
-        }
+        'most_positive': stats.get("most_positive"),
+        'most_negative': stats.get("most_negative")
     }
 
     return jsonify(result)
 
+@app.route('/api/sentiment/<room_name>/timeseries')
+def get_sentiment_timeseries(room_name):
+    """API endpoint to get a room's sentiment over time, downsampled to at most `points` points"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+        points = min(max(int(request.args.get('points', 200)), 1), MAX_TIMESERIES_POINTS)
+    except ValueError:
+        return jsonify({'error': 'Invalid start, end or points'}), 400
+
+    if start and end and start > end:
+        return jsonify({'error': 'start must be before end'}), 400
+
+    return jsonify(db.get_sentiment_timeseries(room_name, start, end, points))
+
 @app.route('/api/recommendations/<username>')
 def get_recommendations(username):
     """API endpoint to get room recommendations"""
@@ -815,16 +942,24 @@ def get_recommendations(username):
     # Get recommendations
     recommendations = room_recommender.get_user_recommendations(username, algorithm=algorithm)
 
+    # Load interests once for all explanations
+    interests = db.load_user_data(username).get('interests', [])
+
     # Get metadata for each recommended room
     result = []
     for room_name in recommendations:
         metadata = db.get_room_metadata(room_name)
+        evidence = room_recommender.get_recommendation_evidence(username, room_name, interests)
         result.append({
             'name': room_name,
             'description': metadata.get('description', ''),
             'message_count': metadata.get('message_count', 0),
             'tags': metadata.get('tags', []),
-            'explanation': room_recommender.get_recommendation_explanation(username, room_name)
+            'explanation': room_recommender.get_recommendation_explanation(
+                username, room_name, interests=interests, room_metadata=metadata
+            ),
+            'evidence': [{'interest': interest, 'term': term, 'weight': weight}
+                         for interest, term, weight in evidence]
         })
 
     return jsonify(result)
@@ -888,6 +1023,29 @@ def get_predictions():
 
     return jsonify({'predictions': predictions})
 
+@app.route('/api/predict/bundle')
+def get_prediction_bundle():
+    """API endpoint exporting a prefix -> suggestions table for client-side predictive text"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    if not AI_ENABLED:
+        return jsonify({'error': 'AI features not enabled'}), 400
+
+    username = session['username']
+    user_tag = hashlib.sha1(username.encode('utf-8')).hexdigest()[:12]
+    etag = f"{user_tag}-{predictive_text.get_bundle_version(username)}"
+
+    # The bundle only changes every few trained messages; let clients revalidate cheaply
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(predictive_text.export_bundle(username))
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 def get_sentiment_label(score):
     """Convert sentiment score to human-readable label"""
     if score >= 0.5:
@@ -0,0 +1,458 @@
+"""
+Benchmarks for performance-sensitive parts of the chat application
+
+Usage:
+    python benchmarks.py predictive-memory --messages 1000000
+    python benchmarks.py predictive-latency --messages 200000
+    python benchmarks.py sentiment-cache --messages 200000
+    python benchmarks.py sentiment-bulk --messages 200000
+    python benchmarks.py chatbot-intents --messages 20000 --topics 5000
+"""
+import argparse
+import gc
+import random
+import re
+import string
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+
+from predictive_text import PredictiveText
+
+# Short messages that make up a large share of real chat traffic
+COMMON_MESSAGES = [
+    "ok", "lol", "thanks!", "yes", "no", "haha", "lmao", "nice", "same", "ty",
+    "thank you so much!", "good morning", "gn", "brb", "omg", "np", "sounds good",
+    "what?", "sure", "ok!", "😂", "👍", "😂😂😂", "❤️", "🔥", "see you", "wow", "agreed"
+]
+
+def synthetic_corpus(messages, users=1000, vocabulary_size=20000, seed=42):
+    """
+    Generate (username, message) pairs with Zipf-distributed word frequencies
+
+    Args:
+        messages (int): Number of messages to generate
+        users (int): Number of distinct authors
+        vocabulary_size (int): Number of distinct words
+        seed (int): Random seed for sampling messages; the vocabulary itself
+            only depends on vocabulary_size
+
+    Returns:
+        generator: (username, message) tuples
+    """
+    word_rng = random.Random(vocabulary_size)
+    words = set()
+    while len(words) < vocabulary_size:
+        words.add(''.join(word_rng.choices(string.ascii_lowercase, k=word_rng.randint(2, 9))))
+    words = sorted(words)
+    word_rng.shuffle(words)
+
+    rng = random.Random(seed)
+
+    cumulative = []
+    total = 0.0
+    for rank in range(1, vocabulary_size + 1):
+        total += 1.0 / rank
+        cumulative.append(total)
+
+    # Draw words in blocks to keep generation cheap
+    block = []
+    position = 0
+    for i in range(messages):
+        length = rng.randint(3, 15)
+        if position + length > len(block):
+            block = rng.choices(words, cum_weights=cumulative, k=100000)
+            position = 0
+        yield f"user{i % users}", ' '.join(block[position:position + length])
+        position += length
+
+def deep_sizeof(*objects):
+    """Approximate total memory of objects and everything they reference, counting shared objects once"""
+    seen = set()
+    stack = list(objects)
+    total = 0
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, int, float, array)):
+            continue
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, slot) for slot in obj.__slots__ if hasattr(obj, slot))
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+
+    return total
+
+class LegacyPredictiveText:
+    """
+    The previous nested defaultdict(Counter) predictive text models, kept for comparison
+
+    A lock is added around training and prediction: without it, most_common
+    on a Counter that is being trained concurrently raises RuntimeError.
+    """
+
+    def __init__(self):
+        self.user_models = {}
+        self.global_model = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def train_on_message(self, username, message):
+        with self._lock:
+            self._train(username, message)
+
+    def predict_next_word(self, username, current_text, max_suggestions=3):
+        with self._lock:
+            return self._predict(username, current_text, max_suggestions)
+
+    def _train(self, username, message):
+        words = re.sub(r'[^\w\s\']', ' ', message.lower()).split()
+        if len(words) < 2:
+            return
+
+        user_model = self.user_models.setdefault(username, defaultdict(Counter))
+        for i in range(len(words) - 1):
+            self.global_model[words[i]][words[i + 1]] += 1
+            user_model[words[i]][words[i + 1]] += 1
+        for i in range(len(words) - 2):
+            prefix = f"{words[i]} {words[i + 1]}"
+            self.global_model[prefix][words[i + 2]] += 1
+            user_model[prefix][words[i + 2]] += 1
+
+    def _predict(self, username, current_text, max_suggestions):
+        words = re.sub(r'[^\w\s\']', ' ', current_text.lower()).split()
+        suggestions = []
+        if len(words) >= 2:
+            suggestions = self._get_suggestions(username, f"{words[-2]} {words[-1]}", max_suggestions)
+        if len(suggestions) < max_suggestions and words:
+            additional = self._get_suggestions(username, words[-1], max_suggestions - len(suggestions))
+            suggestions.extend([s for s in additional if s not in suggestions])
+        return suggestions[:max_suggestions]
+
+    def _get_suggestions(self, username, prefix, max_count):
+        suggestions = []
+        if username in self.user_models and prefix in self.user_models[username]:
+            suggestions.extend(word for word, _ in self.user_models[username][prefix].most_common(max_count))
+        if prefix in self.global_model and len(suggestions) < max_count:
+            for word, _ in self.global_model[prefix].most_common(max_count * 2):
+                if word not in suggestions and len(suggestions) < max_count:
+                    suggestions.append(word)
+        return suggestions
+
+def train_legacy(corpus):
+    """Train the previous nested defaultdict(Counter) models on a corpus"""
+    predictor = LegacyPredictiveText()
+    for username, message in corpus:
+        predictor.train_on_message(username, message)
+    return predictor
+
+def train_compact(corpus, model_dir):
+    """Train the interned PredictiveText models on a corpus"""
+    predictor = PredictiveText(flush_interval=10 ** 9, model_dir=model_dir)
+    # Keep every model resident so the whole corpus is measured
+    predictor.user_models.max_bytes = sys.maxsize
+    for username, message in corpus:
+        predictor.train_on_message(username, message)
+    # Nothing here needs to reach disk
+    predictor.dirty.clear()
+    return predictor
+
+def bench_predictive_memory(args):
+    """Compare memory of legacy and interned predictive text models"""
+    print(f"Synthetic corpus: {args.messages:,} messages, {args.users:,} users, "
+          f"{args.vocabulary:,} words")
+
+    start = time.perf_counter()
+    legacy = train_legacy(synthetic_corpus(args.messages, args.users, args.vocabulary))
+    legacy_seconds = time.perf_counter() - start
+    legacy_bytes = deep_sizeof(legacy.global_model, legacy.user_models)
+    legacy_entries = sum(len(c) for c in legacy.global_model.values()) + sum(
+        len(c) for model in legacy.user_models.values() for c in model.values())
+    del legacy
+    gc.collect()
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        start = time.perf_counter()
+        predictor = train_compact(
+            synthetic_corpus(args.messages, args.users, args.vocabulary), model_dir)
+        compact_seconds = time.perf_counter() - start
+        compact_bytes = deep_sizeof(predictor.vocabulary, predictor.global_model, predictor.user_models)
+        compact_entries = predictor.global_model.entries + sum(
+            model.entries for model in predictor.user_models.values())
+
+    print(f"{'':10}{'entries':>14}{'MiB':>10}{'bytes/entry':>14}{'train s':>10}")
+    for name, size, entries, seconds in (("legacy", legacy_bytes, legacy_entries, legacy_seconds),
+                                         ("compact", compact_bytes, compact_entries, compact_seconds)):
+        print(f"{name:10}{entries:>14,}{size / 2 ** 20:>10.1f}{size / max(entries, 1):>14.1f}{seconds:>10.1f}")
+    print(f"Reduction: {legacy_bytes / max(compact_bytes, 1):.1f}x")
+
+def measure_predict_latency(predictor, queries, training):
+    """
+    Time predict_next_word for each query while another thread keeps training
+
+    Returns:
+        list: Per-call latencies in seconds
+    """
+    stop = threading.Event()
+
+    def train():
+        for username, message in training:
+            if stop.is_set():
+                break
+            predictor.train_on_message(username, message)
+
+    trainer = threading.Thread(target=train, daemon=True)
+    trainer.start()
+
+    latencies = []
+    for username, text in queries:
+        start = time.perf_counter()
+        predictor.predict_next_word(username, text, 5)
+        latencies.append(time.perf_counter() - start)
+
+    stop.set()
+    trainer.join()
+    return latencies
+
+def percentile(values, pct):
+    """Return the pct-th percentile of a list of values"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def bench_predictive_latency(args):
+    """Compare predict_next_word latency of legacy and top-k predictive text models under training load"""
+    print(f"Synthetic corpus: {args.messages:,} messages, {args.users:,} users, "
+          f"{args.vocabulary:,} words, {args.queries:,} predictions")
+
+    # Typing prefixes: the first few words of messages, so hot prefixes dominate like in real use
+    rng = random.Random(7)
+    queries = [
+        (username, ' '.join(message.split()[:rng.randint(1, 3)]))
+        for username, message in synthetic_corpus(args.queries, args.users, args.vocabulary, seed=7)
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as model_dir:
+        for name, train in (("legacy", train_legacy),
+                            ("top-k", lambda corpus: train_compact(corpus, model_dir))):
+            corpus = synthetic_corpus(args.messages * 2, args.users, args.vocabulary)
+            predictor = train(next(corpus) for _ in range(args.messages))
+            latencies = measure_predict_latency(predictor, queries, corpus)
+            results.append((name, latencies))
+            del predictor
+            gc.collect()
+
+    print(f"{'':10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}")
+    for name, latencies in results:
+        print(f"{name:10}{percentile(latencies, 50) * 1e6:>10.1f}{percentile(latencies, 99) * 1e6:>10.1f}"
+              f"{max(latencies) * 1e6:>10.1f}")
+
+def chat_messages(messages, repeated_share=0.6, vocabulary_size=20000, seed=42):
+    """
+    Generate chat messages where a share are Zipf-distributed repeats of common short messages
+
+    Returns:
+        list: Message texts
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / rank for rank in range(1, len(COMMON_MESSAGES) + 1)]
+    corpus = synthetic_corpus(messages, vocabulary_size=vocabulary_size, seed=seed)
+
+    texts = []
+    for _, message in corpus:
+        if rng.random() < repeated_share:
+            texts.append(rng.choices(COMMON_MESSAGES, weights)[0])
+        else:
+            texts.append(message)
+    return texts
+
+def bench_sentiment_cache(args):
+    """Compare sentiment scoring throughput with and without the score cache"""
+    from sentiment_analyzer import MessageSentimentAnalyzer
+
+    texts = chat_messages(args.messages, vocabulary_size=args.vocabulary)
+    print(f"Chat stream: {len(texts):,} messages, {len(set(texts)):,} distinct")
+
+    results = []
+    for name, cache_size in (("uncached", 0), ("cached", None)):
+        analyzer = MessageSentimentAnalyzer(cache_size=cache_size)
+        start = time.perf_counter()
+        for text in texts:
+            analyzer.analyze_message(text)
+        results.append((name, time.perf_counter() - start, analyzer.get_cache_stats()))
+
+    print(f"{'':10}{'msgs/s':>12}{'hit rate':>10}{'entries':>10}")
+    for name, seconds, stats in results:
+        print(f"{name:10}{len(texts) / seconds:>12,.0f}{stats['hit_rate']:>10.1%}{stats['size']:>10,}")
+    print(f"Speedup: {results[0][1] / results[1][1]:.1f}x")
+
+def sentiment_messages(messages, sia, vocabulary_size=20000, seed=42):
+    """
+    Generate chat messages mixing lexicon words with boosters, negations, capitals and punctuation
+
+    Returns:
+        list: Message texts
+    """
+    rng = random.Random(seed)
+    lexicon = sorted(sia.lexicon)
+    modifiers = sorted(sia.constants.BOOSTER_DICT) + sorted(sia.constants.NEGATE) + ["but", "so", "never", "least"]
+
+    texts = []
+    for _, message in synthetic_corpus(messages, vocabulary_size=vocabulary_size, seed=seed):
+        words = message.split()
+        for i in range(len(words)):
+            roll = rng.random()
+            if roll < 0.25:
+                words[i] = rng.choice(lexicon)
+            elif roll < 0.35:
+                words[i] = rng.choice(modifiers)
+            if rng.random() < 0.05:
+                words[i] = words[i].upper()
+        text = ' '.join(words)
+        if rng.random() < 0.3:
+            text += rng.choice(["!", "!!", "?", "??", "...", " :)", "!!!!!"])
+        texts.append(text)
+    return texts
+
+def bench_sentiment_bulk(args):
+    """Compare per-message VADER scoring with the vectorized bulk engine"""
+    import os
+    import numpy as np
+    from bulk_sentiment import BulkSentimentScorer, VectorSentimentEngine
+    from sentiment_analyzer import MessageSentimentAnalyzer
+
+    analyzer = MessageSentimentAnalyzer(cache_size=0)
+    texts = sentiment_messages(args.messages, analyzer.sia, args.vocabulary)
+    workers = os.cpu_count() or 1
+    print(f"Messages: {len(texts):,}, {workers} CPUs")
+
+    start = time.perf_counter()
+    expected = np.array([analyzer.analyze_message(text)['compound'] for text in texts])
+    per_message_seconds = time.perf_counter() - start
+
+    engine = VectorSentimentEngine(analyzer.sia)
+    start = time.perf_counter()
+    scores = np.concatenate([engine.score(texts[i:i + 10000]) for i in range(0, len(texts), 10000)])
+    vectorized_seconds = time.perf_counter() - start
+
+    scorer = BulkSentimentScorer(workers)
+    scorer.score(texts[:workers])  # Start the worker processes outside the timing
+    start = time.perf_counter()
+    pooled = scorer.score(texts)
+    pooled_seconds = time.perf_counter() - start
+    scorer.close()
+
+    print(f"{'':14}{'msgs/s':>12}{'msgs/s/core':>14}")
+    for name, seconds, cores in (("per-message", per_message_seconds, 1),
+                                 ("vectorized", vectorized_seconds, 1),
+                                 (f"pool x{workers}", pooled_seconds, workers)):
+        print(f"{name:14}{len(texts) / seconds:>12,.0f}{len(texts) / seconds / cores:>14,.0f}")
+
+    def labels(values):
+        return np.select([values >= 0.5, values > 0, values == 0, values > -0.5], [4, 3, 2, 1], default=0)
+
+    difference = np.abs(scores - expected)
+    print(f"Agreement with per-message scores: {np.mean(difference < 1e-3):.2%} identical, "
+          f"{np.mean(labels(scores) == labels(expected)):.2%} same category, "
+          f"max difference {difference.max():.3f}")
+    print(f"Pool matches single process: {np.array_equal(pooled, scores)}")
+
+def bench_chatbot_intents(args):
+    """Compare intent matching strategies over built-in intents plus many learned topics"""
+    from chatbot_assistant import INTENT_TRIGGERS, LEARNED_TOPIC_PRIORITY, WORD_PATTERN, build_intent_matcher
+
+    texts = [message for _, message in synthetic_corpus(args.messages, vocabulary_size=args.vocabulary)]
+    topic_rng = random.Random(args.topics)
+    topics = set()
+    while len(topics) < args.topics:
+        topics.add(''.join(topic_rng.choices(string.ascii_lowercase, k=topic_rng.randint(4, 10))))
+    topics = sorted(topics)
+    # Make sure a share of the messages mention learned topics
+    texts = [text + ' ' + topics[i % len(topics)] if i % 3 == 0 else text for i, text in enumerate(texts)]
+    print(f"Messages: {len(texts):,}, learned topics: {len(topics):,}")
+
+    def scan(text):
+        # The chain of substring checks, extended to learned topics
+        lower = text.lower()
+        for intent, triggers in INTENT_TRIGGERS:
+            if any(trigger in lower for trigger in triggers):
+                return intent
+        words = WORD_PATTERN.findall(lower)
+        for topic in topics:
+            if topic in words:
+                return topic
+        return None
+
+    def build_alternation():
+        phrases = [(trigger, intent) for intent, triggers in INTENT_TRIGGERS for trigger in triggers]
+        phrases += [(topic, topic) for topic in topics]
+        intents = {phrase: intent for phrase, intent in reversed(phrases)}
+        ranks = {intent: rank for rank, (intent, _) in enumerate(INTENT_TRIGGERS)}
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(phrase) for phrase, _ in phrases) + r")\b")
+        return pattern, intents, ranks
+
+    start = time.perf_counter()
+    pattern, intents, ranks = build_alternation()
+    alternation_build_seconds = time.perf_counter() - start
+
+    def alternation(text):
+        found = [intents[m.group(0)] for m in pattern.finditer(text.lower())]
+        return min(found, key=lambda intent: ranks.get(intent, LEARNED_TOPIC_PRIORITY)) if found else None
+
+    start = time.perf_counter()
+    matcher = build_intent_matcher(topics)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(1000):
+        matcher.add(f"learned{i}", f"learned{i}", LEARNED_TOPIC_PRIORITY)
+    insert_seconds = (time.perf_counter() - start) / 1000
+
+    strategies = (("scan", scan), ("alternation", alternation), ("trie", matcher.match))
+    results = []
+    for name, match in strategies:
+        start = time.perf_counter()
+        matched = [match(text) for text in texts]
+        results.append((name, time.perf_counter() - start, matched))
+
+    print(f"{'':12}{'msgs/s':>12}{'us/msg':>10}")
+    for name, seconds, _ in results:
+        print(f"{name:12}{len(texts) / seconds:>12,.0f}{seconds / len(texts) * 1e6:>10.1f}")
+    print(f"Build: trie {build_seconds * 1000:.1f} ms, alternation {alternation_build_seconds * 1000:.1f} ms; "
+          f"trie insert {insert_seconds * 1e6:.1f} us per learned topic")
+    print(f"Trie agrees with alternation: {results[2][2] == results[1][2]}")
+
+BENCHMARKS = {
+    'predictive-memory': bench_predictive_memory,
+    'predictive-latency': bench_predictive_latency,
+    'sentiment-cache': bench_sentiment_cache,
+    'sentiment-bulk': bench_sentiment_bulk,
+    'chatbot-intents': bench_chatbot_intents
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run chat application benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--messages', type=int, default=1000000, help="Synthetic corpus size")
+    parser.add_argument('--users', type=int, default=1000, help="Number of synthetic users")
+    parser.add_argument('--vocabulary', type=int, default=20000, help="Number of distinct words")
+    parser.add_argument('--queries', type=int, default=20000, help="Number of timed predictions")
+    parser.add_argument('--topics', type=int, default=5000, help="Number of learned chatbot topics")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+"""
+Bulk sentiment scoring for backfilling and re-scoring message history
+
+Messages are scored in batches: each batch is tokenized once, tokens are
+mapped to ids of an array-backed vocabulary, and VADER's valence rules
+(boosters, negation, capitals, "but", punctuation emphasis) are applied to
+the whole batch with numpy. Batches are spread over a process pool and
+read from and written to MongoDB in chunked bulk operations.
+
+The engine reproduces nltk's VADER compound score;
+`python benchmarks.py sentiment-bulk` reports its agreement with
+MessageSentimentAnalyzer.
+
+Usage:
+    python bulk_sentiment.py backfill
+    python bulk_sentiment.py rescore --batch-size 20000 --workers 8
+"""
+import os
+import re
+import string
+import time
+import uuid
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pymongo
+
+# Messages scored per worker task
+SCORE_CHUNK = 2000
+
+class VectorSentimentEngine:
+    """
+    Batch VADER compound scorer backed by numpy arrays
+
+    Every word the rules care about gets an id; per-id valence, booster,
+    negation and lexicon-membership values live in arrays indexed by id,
+    so a batch is scored with a handful of array operations instead of
+    per-word Python calls.
+    """
+
+    def __init__(self, sia=None):
+        if sia is None:
+            from sentiment_analyzer import MessageSentimentAnalyzer
+            sia = MessageSentimentAnalyzer(cache_size=0).sia
+
+        constants = sia.constants
+        self.n_scalar = constants.N_SCALAR
+        self.c_incr = constants.C_INCR
+        self.b_decr = constants.B_DECR
+        self.punctuation = sorted(constants.PUNC_LIST, key=len, reverse=True)
+        self.remove_punctuation = re.compile(f"[{re.escape(string.punctuation)}]")
+
+        # Id 0 is any other word; id 1 is an unknown word containing "n't"
+        words = ["", "n't"]
+        phrases = [phrase.split() for phrase in list(constants.SPECIAL_CASE_IDIOMS) + list(constants.BOOSTER_DICT)]
+        words.extend(sorted(set(sia.lexicon) | set(constants.BOOSTER_DICT) | set(constants.NEGATE) |
+                            {word for phrase in phrases for word in phrase} |
+                            {"kind", "of", "but", "least", "at", "very", "never", "so", "this"}))
+        self.ids = {word: i for i, word in enumerate(words)}
+
+        # Idioms replace the valence of a word next to them; two-word boosters dampen it
+        self.idioms = [
+            (tuple(self.ids[word] for word in phrase.split()), value)
+            for phrase, value in constants.SPECIAL_CASE_IDIOMS.items()
+        ]
+        self.booster_bigrams = [
+            tuple(self.ids[word] for word in phrase.split())
+            for phrase in constants.BOOSTER_DICT if len(phrase.split()) == 2
+        ]
+
+        self.valence = np.array([sia.lexicon.get(word, 0.0) for word in words])
+        self.in_lexicon = np.array([word in sia.lexicon for word in words])
+        self.booster = np.array([constants.BOOSTER_DICT.get(word, 0.0) for word in words])
+        self.negation = np.array([word in constants.NEGATE or "n't" in word for word in words])
+
+        for word in ("kind", "of", "but", "least", "at", "very", "never", "so", "this"):
+            setattr(self, f"_{word}", self.ids[word])
+
+    def tokenize(self, texts):
+        """
+        Turn a batch of texts into flat token arrays
+
+        Returns:
+            tuple: (ids, upper, lowercase, message, position, first, lengths,
+                cap_diff, exclamations, questions) numpy arrays
+        """
+        ids, upper, lowercase, message, position, first = [], [], [], [], [], []
+        lengths, cap_diff, exclamations, questions = [], [], [], []
+        vocabulary = self.ids
+
+        for index, text in enumerate(texts):
+            tokens = self._words(text)
+            first_index = {}
+            all_caps = 0
+
+            for i, token in enumerate(tokens):
+                first.append(first_index.setdefault(token, i))
+                lower = token.lower()
+                token_id = vocabulary.get(lower, 0)
+                if token_id == 0 and "n't" in lower:
+                    token_id = 1
+                ids.append(token_id)
+                lowercase.append(token == lower)
+                is_upper = token.isupper()
+                upper.append(is_upper)
+                all_caps += is_upper
+
+            message.extend([index] * len(tokens))
+            position.extend(range(len(tokens)))
+            lengths.append(len(tokens))
+            cap_diff.append(0 < len(tokens) - all_caps < len(tokens))
+            exclamations.append(text.count("!"))
+            questions.append(text.count("?"))
+
+        return (np.array(ids, dtype=np.int32), np.array(upper, dtype=bool), np.array(lowercase, dtype=bool),
+                np.array(message, dtype=np.int64), np.array(position, dtype=np.int64),
+                np.array(first, dtype=np.int64), np.array(lengths, dtype=np.int64),
+                np.array(cap_diff, dtype=bool), np.array(exclamations), np.array(questions))
+
+    def _words(self, text):
+        """Split a text into words the way VADER does, stripping one punctuation mark off words"""
+        words_only = {word for word in self.remove_punctuation.sub("", text).split() if len(word) > 1}
+        tokens = []
+        for token in text.split():
+            if len(token) <= 1:
+                continue
+            if token not in words_only:
+                for mark in self.punctuation:
+                    if token.startswith(mark) and token[len(mark):] in words_only:
+                        token = token[len(mark):]
+                        break
+                    if token.endswith(mark) and token[:-len(mark)] in words_only:
+                        token = token[:-len(mark)]
+                        break
+            tokens.append(token)
+        return tokens
+
+    def score(self, texts):
+        """
+        Compute VADER compound scores for a batch of texts
+
+        Returns:
+            numpy.ndarray: One compound score in [-1, 1] per text
+        """
+        (ids, upper, lowercase, message, position, first, lengths,
+         cap_diff, exclamations, questions) = self.tokenize(texts)
+        count = len(texts)
+        if len(ids) == 0:
+            return np.zeros(count)
+
+        # VADER looks at the context of a word's first occurrence in the message
+        start = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        context = start + first
+        caps = cap_diff[message]
+
+        def previous(k):
+            valid = first >= k
+            return valid, np.where(valid, ids[np.maximum(context - k, 0)], 0), valid & upper[np.maximum(context - k, 0)]
+
+        def nearby(offset):
+            # Id of the word at an offset from the context position, or -1 outside the
+            # message; idioms are matched case-sensitively, so capitalized words are -1 too
+            index = np.clip(context + offset, 0, len(ids) - 1)
+            inside = (first + offset >= 0) & (first + offset < lengths[message]) & lowercase[index]
+            return np.where(inside, ids[index], -1)
+
+        # Boosters and "kind of" carry no valence themselves
+        has_next = first < lengths[message] - 1
+        kind_of = (ids == self._kind) & has_next & (ids[np.minimum(context + 1, len(ids) - 1)] == self._of)
+        active = self.in_lexicon[ids] & (self.booster[ids] == 0) & ~kind_of
+
+        valence = np.where(active, self.valence[ids], 0.0)
+        valence += np.where(active & upper & caps, np.where(valence > 0, self.c_incr, -self.c_incr), 0.0)
+
+        valid1, prev1, _ = previous(1)
+        valid2, prev2, _ = previous(2)
+        exact1, exact2, exact3 = nearby(-1), nearby(-2), nearby(-3)
+        so_this1 = (exact1 == self._so) | (exact1 == self._this)
+        so_this2 = (exact2 == self._so) | (exact2 == self._this)
+
+        for k, damping in ((1, 1.0), (2, 0.95), (3, 0.9)):
+            valid, prev, prev_upper = previous(k)
+            applies = active & valid & ~self.in_lexicon[prev]
+
+            scalar = np.where(valence < 0, -self.booster[prev], self.booster[prev])
+            scalar += np.where((self.booster[prev] != 0) & prev_upper & caps,
+                               np.where(valence > 0, self.c_incr, -self.c_incr), 0.0)
+            valence = np.where(applies, valence + scalar * damping, valence)
+
+            negated = self.negation[prev]
+            if k == 1:
+                factor = np.where(negated, self.n_scalar, 1.0)
+            elif k == 2:
+                factor = np.where((exact2 == self._never) & so_this1, 1.5, np.where(negated, self.n_scalar, 1.0))
+            else:
+                emphasis = ((exact3 == self._never) & so_this2) | so_this1
+                factor = np.where(emphasis, 1.25, np.where(negated, self.n_scalar, 1.0))
+            valence = np.where(applies, valence * factor, valence)
+
+            if k == 3:
+                valence = np.where(applies, self._idiom_valence(valence, nearby), valence)
+
+        # "least" negates the next word, unless it is "at least" or "very least"
+        at_very = valid2 & ((prev2 == self._at) | (prev2 == self._very))
+        least = active & valid1 & (prev1 == self._least) & ~at_very
+        valence = np.where(least, valence * self.n_scalar, valence)
+
+        # Words before the first "but" count half, words after it one and a half
+        but_position = np.full(count, np.iinfo(np.int64).max)
+        is_but = ids == self._but
+        np.minimum.at(but_position, message[is_but], position[is_but])
+        but = but_position[message]
+        has_but = but != np.iinfo(np.int64).max
+        valence *= np.where(has_but & (position < but), 0.5, np.where(has_but & (position > but), 1.5, 1.0))
+
+        total = np.bincount(message, weights=valence, minlength=count)
+
+        # Punctuation emphasis strengthens the score in its existing direction
+        amplifier = np.minimum(exclamations, 4) * 0.292
+        amplifier += np.where(questions > 3, 0.96, np.where(questions > 1, questions * 0.18, 0.0))
+        total += np.sign(total) * amplifier
+
+        compound = total / np.sqrt(total * total + 15)
+        return np.round(np.where(lengths > 0, compound, 0.0), 4)
+
+    def _idiom_valence(self, valence, nearby):
+        """Apply VADER's idiom and two-word booster rules around each word"""
+        words = {offset: nearby(offset) for offset in range(-3, 3)}
+
+        def matches(offsets):
+            matched = np.zeros(len(valence), dtype=bool)
+            value = np.zeros(len(valence))
+            for phrase, phrase_value in self.idioms:
+                if len(phrase) == len(offsets):
+                    hit = np.logical_and.reduce([words[o] == w for o, w in zip(offsets, phrase)])
+                    value = np.where(hit & ~matched, phrase_value, value)
+                    matched |= hit
+            return matched, value
+
+        # The first matching sequence ending at or before the word wins...
+        replaced = np.zeros(len(valence), dtype=bool)
+        for offsets in ((-1, 0), (-2, -1, 0), (-2, -1), (-3, -2, -1), (-3, -2)):
+            matched, value = matches(offsets)
+            valence = np.where(matched & ~replaced, value, valence)
+            replaced |= matched
+
+        # ...but sequences starting at the word override it
+        for offsets in ((0, 1), (0, 1, 2)):
+            matched, value = matches(offsets)
+            valence = np.where(matched, value, valence)
+
+        dampened = np.zeros(len(valence), dtype=bool)
+        for first_word, second_word in self.booster_bigrams:
+            dampened |= (words[-3] == first_word) & (words[-2] == second_word)
+            dampened |= (words[-2] == first_word) & (words[-1] == second_word)
+        return np.where(dampened, valence + self.b_decr, valence)
+
+_worker_engine = None
+
+def _init_worker():
+    """Build the scoring engine once per worker process"""
+    global _worker_engine
+    _worker_engine = VectorSentimentEngine()
+
+def _score_in_worker(texts):
+    """Score a chunk of texts in a worker process"""
+    return _worker_engine.score(texts)
+
+class BulkSentimentScorer:
+    """
+    Scores large batches of texts across a process pool
+
+    Args:
+        workers (int): Number of worker processes (default: CPU count);
+            with 1, batches are scored in the calling process
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        if self.workers > 1:
+            self.engine = None
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        else:
+            self.engine = VectorSentimentEngine()
+            self._executor = None
+
+    def score(self, texts):
+        """Compute compound scores for a list of texts"""
+        if self._executor is None:
+            return self.engine.score(texts)
+
+        chunks = [texts[i:i + SCORE_CHUNK] for i in range(0, len(texts), SCORE_CHUNK)]
+        return np.concatenate(list(self._executor.map(_score_in_worker, chunks)) or [np.zeros(0)])
+
+    def close(self):
+        """Shut the worker processes down"""
+        if self._executor is not None:
+            self._executor.shutdown()
+
+class SentimentTotals:
+    """Per-user sentiment stats accumulated over scored messages"""
+
+    def __init__(self):
+        self.users = {}
+
+    def add(self, messages, scores):
+        """Add scored message documents (with username)"""
+        user_categories = np.where(scores > 0.1, "positive", np.where(scores < -0.1, "negative", "neutral"))
+
+        for msg, user_category in zip(messages, user_categories):
+            self.users.setdefault(msg["username"], Counter())[str(user_category)] += 1
+
+def iter_message_batches(messages, batch_size, rescore=False, until=None):
+    """
+    Read messages in _id order, one batch per query
+
+    Args:
+        messages (Collection): The messages collection
+        batch_size (int): Messages per batch
+        rescore (bool): Read every message instead of only unscored ones
+        until (ObjectId): Don't read messages with a higher _id
+
+    Returns:
+        generator: Lists of message documents
+    """
+    query = {} if rescore else {"sentiment": {"$type": "null"}}
+    last_id = None
+
+    while True:
+        page_query = dict(query)
+        id_range = {}
+        if last_id is not None:
+            id_range["$gt"] = last_id
+        if until is not None:
+            id_range["$lte"] = until
+        if id_range:
+            page_query["_id"] = id_range
+
+        batch = list(messages.find(
+            page_query,
+            {"_id": 1, "room_id": 1, "username": 1, "content": 1}
+        ).sort("_id", pymongo.ASCENDING).limit(batch_size))
+
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]["_id"]
+
+def write_scores(messages, batch, scores, rescore=False, run_id=None):
+    """
+    Store the scores of a batch with one bulk write
+
+    In backfill mode a message is only written if it is still unscored, and
+    is tagged with run_id so the messages this run actually scored can be
+    told apart from ones the live scorer got to first. Scores are stamped
+    with sentiment_at like live ones (see MongoDBConnector.seed_room_sentiment).
+
+    Returns:
+        np.ndarray: Boolean mask of the batch messages whose score was written
+    """
+    if rescore:
+        messages.bulk_write([
+            pymongo.UpdateOne({"_id": msg["_id"]},
+                              {"$set": {"sentiment": score}, "$currentDate": {"sentiment_at": True}})
+            for msg, score in zip(batch, scores.tolist())
+        ], ordered=False)
+        return np.ones(len(batch), dtype=bool)
+
+    messages.bulk_write([
+        pymongo.UpdateOne(
+            {"_id": msg["_id"], "sentiment": {"$type": "null"}},
+            {"$set": {"sentiment": score, "backfill_run": run_id}, "$currentDate": {"sentiment_at": True}}
+        )
+        for msg, score in zip(batch, scores.tolist())
+    ], ordered=False)
+
+    ids = [msg["_id"] for msg in batch]
+    claimed = {doc["_id"] for doc in messages.find({"_id": {"$in": ids}, "backfill_run": run_id}, {"_id": 1})}
+    if claimed:
+        messages.update_many({"_id": {"$in": list(claimed)}}, {"$unset": {"backfill_run": ""}})
+    return np.array([message_id in claimed for message_id in ids], dtype=bool)
+
+def add_user_stats(db, totals):
+    """Fold newly scored messages into the stored user sentiment stats"""
+    user_operations = [
+        pymongo.UpdateOne(
+            {"_id": username},
+            {"$inc": {f"sentiment_stats.{category}": n for category, n in counts.items()}},
+            upsert=True
+        )
+        for username, counts in totals.users.items()
+    ]
+
+    if user_operations:
+        db.users.bulk_write(user_operations, ordered=False)
+
+def replace_user_stats(db, totals):
+    """Replace the stored user sentiment stats with recomputed ones"""
+    user_operations = [
+        pymongo.UpdateOne(
+            {"_id": username},
+            {"$set": {"sentiment_stats": {
+                "positive": counts["positive"],
+                "neutral": counts["neutral"],
+                "negative": counts["negative"]
+            }}},
+            upsert=True
+        )
+        for username, counts in totals.users.items()
+    ]
+
+    for i in range(0, len(user_operations), 1000):
+        db.users.bulk_write(user_operations[i:i + 1000], ordered=False)
+
+def reseed_rooms(db, room_names):
+    """Rebuild the sentiment aggregates of rooms from their stored scores"""
+    from mongodb_connector import MongoDBConnector
+    for room_name in room_names:
+        MongoDBConnector.seed_room_sentiment(db.messages, db.room_sentiment, room_name, force=True)
+
+def run(db, rescore=False, batch_size=10000, workers=None):
+    """
+    Score message history in MongoDB
+
+    In backfill mode only messages without a score that existed when the run
+    started are scored. Only the scores this run wrote are added to the user
+    stats; messages the live scorer scored meanwhile already counted
+    themselves. In rescore mode every message is scored again and the user
+    stats are rebuilt from scratch; messages sent while it runs are not
+    reflected in them, so run it during a quiet period.
+
+    Afterwards the aggregates of every room with newly written scores are
+    reseeded from the stored scores, which is safe while the app is running.
+
+    Args:
+        db (pymongo.database.Database): The chat database
+        rescore (bool): Re-score every message instead of only unscored ones
+        batch_size (int): Messages read and written per bulk operation
+        workers (int): Scoring processes (default: CPU count)
+
+    Returns:
+        int: Number of messages scored
+    """
+    scorer = BulkSentimentScorer(workers)
+    all_totals = SentimentTotals()
+    usernames = set()
+    room_names = set()
+    scored_rooms = set()
+    scored = 0
+    started = time.time()
+
+    # New messages are scored by the app as they arrive; leave them to it
+    newest = None if rescore else db.messages.find_one({}, {"_id": 1}, sort=[("_id", pymongo.DESCENDING)])
+    until = newest["_id"] if newest else None
+    run_id = uuid.uuid4().hex
+
+    try:
+        for batch in iter_message_batches(db.messages, batch_size, rescore, until):
+            scores = scorer.score([msg.get("content") or "" for msg in batch])
+            written = write_scores(db.messages, batch, scores, rescore, run_id)
+
+            if rescore:
+                all_totals.add(batch, scores)
+            elif written.any():
+                totals = SentimentTotals()
+                totals.add([msg for msg, mine in zip(batch, written) if mine], scores[written])
+                add_user_stats(db, totals)
+
+            usernames.update(msg["username"] for msg in batch)
+            room_names.update(msg["room_id"] for msg in batch)
+            scored_rooms.update(msg["room_id"] for msg, mine in zip(batch, written) if mine)
+            scored += int(written.sum())
+            print(f"Scored {scored:,} messages ({scored / max(time.time() - started, 1e-9):,.0f}/s)")
+
+        if rescore:
+            replace_user_stats(db, all_totals)
+    finally:
+        scorer.close()
+        # Also after a failed run, so the scores written so far are counted
+        reseed_rooms(db, scored_rooms)
+
+    # Cached user data and message lists hold the old sentiment
+    from mongodb_connector import cache
+    if cache and cache.enabled:
+        for username in usernames:
+            cache.invalidate_user_data(username)
+        for room_name in room_names:
+            cache.invalidate_room_messages(room_name)
+
+    return scored
+
+def main():
+    parser = argparse.ArgumentParser(description="Score message sentiment in bulk")
+    parser.add_argument('mode', choices=['backfill', 'rescore'],
+                        help="backfill scores unscored messages; rescore re-scores all of them")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Messages per bulk read/write")
+    parser.add_argument('--workers', type=int, default=None, help="Scoring processes (default: CPU count)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    db = client[os.getenv("DB_NAME", "ai_chat_app")]
+
+    run(db, rescore=args.mode == 'rescore', batch_size=args.batch_size, workers=args.workers)
+
+if __name__ == '__main__':
+    main()
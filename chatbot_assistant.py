@@ -2,7 +2,166 @@ import random
 import re
 import json
 import os
+import time
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
+from itertools import islice
+
+# Built-in intents and their trigger phrases, highest priority first
+INTENT_TRIGGERS = [
+    ("greeting", ["hello", "hi", "hey", "greetings"]),
+    ("farewell", ["bye", "goodbye", "see you", "later"]),
+    ("thanks", ["thanks", "thank you", "appreciate"]),
+    ("help", ["help", "assist", "support"]),
+    ("about", ["who are you", "what are you", "about you"]),
+    ("weather", ["weather", "temperature", "forecast"]),
+    ("joke", ["joke", "funny", "laugh"])
+]
+
+BUILTIN_INTENTS = {intent for intent, _ in INTENT_TRIGGERS}
+
+# Learned topics rank below every built-in intent
+LEARNED_TOPIC_PRIORITY = len(INTENT_TRIGGERS)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Bot queries kept per room, rooms kept in memory, and terms and users tracked per room
+HISTORY_SIZE = int(os.getenv("CHATBOT_HISTORY_SIZE", 100))
+MAX_ROOMS = int(os.getenv("CHATBOT_MAX_ROOMS", 1000))
+MAX_TERMS = int(os.getenv("CHATBOT_MAX_TERMS", 100))
+MAX_USERS = int(os.getenv("CHATBOT_MAX_USERS", 100))
+
+# How often to check MongoDB for topics learned by other workers
+KNOWLEDGE_REFRESH_SECONDS = float(os.getenv("KNOWLEDGE_REFRESH_SECONDS", 5))
+
+class IntentMatcher:
+    """Word-level trie over intent trigger phrases, matched in one pass over the input"""
+
+    def __init__(self):
+        # Nested dicts keyed by word; the None key holds (priority, intent) of a phrase ending there
+        self.root = {}
+        self.phrases = 0
+
+    def add(self, phrase, intent, priority):
+        """
+        Add a trigger phrase for an intent
+
+        Args:
+            phrase (str): One or more words
+            intent (str): Knowledge base topic to answer from
+            priority (int): Lower wins when several intents match
+        """
+        words = WORD_PATTERN.findall(phrase.lower())
+        if not words:
+            return
+
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+
+        existing = node.get(None)
+        if existing is None:
+            self.phrases += 1
+        if existing is None or priority < existing[0]:
+            node[None] = (priority, intent)
+
+    def match(self, text):
+        """
+        Find the best intent triggered by a text
+
+        Args:
+            text (str): User input
+
+        Returns:
+            str: The highest priority intent (earliest in the text on ties), or None
+        """
+        words = WORD_PATTERN.findall(text.lower())
+        best = None
+
+        for start in range(len(words)):
+            node = self.root
+            for position in range(start, len(words)):
+                node = node.get(words[position])
+                if node is None:
+                    break
+                found = node.get(None)
+                if found is not None and (best is None or found[0] < best[0]):
+                    best = found
+
+        return best[1] if best else None
+
+def build_intent_matcher(topics=()):
+    """
+    Compile the built-in intents and learned topics into a matcher
+
+    Args:
+        topics (iterable): Knowledge base topics, each triggered by its own name;
+            built-in intents only answer to their trigger phrases
+
+    Returns:
+        IntentMatcher: The compiled matcher
+    """
+    matcher = IntentMatcher()
+    for priority, (intent, triggers) in enumerate(INTENT_TRIGGERS):
+        for trigger in triggers:
+            matcher.add(trigger, intent, priority)
+    for topic in topics:
+        if topic not in BUILTIN_INTENTS:
+            matcher.add(topic, topic, LEARNED_TOPIC_PRIORITY)
+    return matcher
+
+class RoomHistory:
+    """Recent bot queries of a room plus running statistics over all of them"""
+
+    def __init__(self, max_messages=HISTORY_SIZE, max_terms=MAX_TERMS, max_users=MAX_USERS):
+        self.messages = deque(maxlen=max_messages)
+        self.total_messages = 0
+        self.total_length = 0
+        # Misra-Gries sketches of active users and frequent terms, each
+        # holding at most max_users / max_terms counters
+        self.user_counts = Counter()
+        self.max_users = max_users
+        self.terms = Counter()
+        self.max_terms = max_terms
+
+    def add(self, username, message):
+        """Record a message and update the running statistics"""
+        self.messages.append({
+            "user": username,
+            "message": message,
+            "timestamp": datetime.now().isoformat()
+        })
+        self.total_messages += 1
+        self.total_length += len(message)
+        self._count(self.user_counts, username, self.max_users)
+
+        for word in WORD_PATTERN.findall(message.lower()):
+            if len(word) > 3:  # Skip short words
+                self._count(self.terms, word, self.max_terms)
+
+    @staticmethod
+    def _count(sketch, key, max_keys):
+        """Add a key to a sketch, evicting rare keys when it is full"""
+        if key in sketch or len(sketch) < max_keys:
+            sketch[key] += 1
+            return
+
+        for known in list(sketch):
+            sketch[known] -= 1
+            if sketch[known] <= 0:
+                del sketch[known]
+
+    def recent(self, count):
+        """Get the latest messages, oldest first"""
+        return list(islice(self.messages, max(len(self.messages) - count, 0), None))
+
+    def participants(self):
+        """Get the distinct users among the recent messages"""
+        return {msg["user"] for msg in self.messages}
+
+    def top_terms(self, count):
+        """Get the most frequent terms seen in the room"""
+        return [term for term, _ in self.terms.most_common(count)]
 
 class ChatbotAssistant:
     """Simple rule-based chatbot assistant for the chat application"""
@@ -10,17 +169,32 @@ class ChatbotAssistant:
     def __init__(self, name="AIBot", db=None):
         self.name = name
         self.db = db  # MongoDB connector instance
-        self.knowledge_base = self._load_knowledge_base()
-        self.conversation_history = {}
+        # Knowledge base version, topic revisions and when MongoDB was last checked for changes
+        self.knowledge_version = 0
+        self.knowledge_revisions = {}
+        self.knowledge_checked = time.time()
+        # Topic -> responses; with MongoDB only the topics used so far are loaded
+        self.knowledge_base, topics = self._load_knowledge_base()
+        self.intent_matcher = build_intent_matcher(topics)
+        # Room name -> RoomHistory, least recently active first
+        self.conversation_history = OrderedDict()
 
     def _load_knowledge_base(self):
-        """Load or initialize knowledge base"""
-        # Try to load from MongoDB if available
+        """
+        Load or initialize knowledge base
+
+        Returns:
+            tuple: (knowledge base dict, list of topics)
+        """
+        # Try to load from MongoDB if available; responses are fetched per topic when first needed
         if self.db:
             try:
-                kb = self.db.load_ai_data("knowledge_base")
-                if kb:
-                    return kb
+                self.knowledge_version = self.db.get_knowledge_version()
+                self.knowledge_revisions = self.db.get_knowledge_topics()
+                if not self.knowledge_revisions:
+                    self.db.import_knowledge_base(self._default_knowledge_base())
+                    self.knowledge_revisions = self.db.get_knowledge_topics()
+                return {}, list(self.knowledge_revisions)
             except Exception as e:
                 print(f"Error loading knowledge base from MongoDB: {e}")
 
@@ -30,102 +204,115 @@ class ChatbotAssistant:
             knowledge_base_path = 'chatbot_data/knowledge_base.json'
 
             with open(knowledge_base_path, 'r') as f:
-                return json.load(f)
+                knowledge_base = json.load(f)
+                return knowledge_base, list(knowledge_base)
         except (FileNotFoundError, json.JSONDecodeError):
-            # Initialize with some basic QA pairs
-            basic_knowledge = {
-                "greeting": [
-                    "Hello! How can I help you today?",
-                    "Hi there! I'm your chat assistant.",
-                    "Greetings! How's your day going?"
-                ],
-                "farewell": [
-                    "Goodbye! Have a great day!",
-                    "See you later!",
-                    "Bye! Come back soon!"
-                ],
-                "thanks": [
-                    "You're welcome!",
-                    "Happy to help!",
-                    "No problem at all!"
-                ],
-                "help": [
-                    "I can help with: \n- Answering questions\n- Providing room recommendations\n- Summarizing conversations\nJust ask me anything!",
-                    "Need help? I can answer questions, recommend rooms, or just chat!"
-                ],
-                "about": [
-                    f"I'm {self.name}, an AI assistant for this chat application. I'm here to help make your chat experience better!"
-                ],
-                "weather": [
-                    "I don't have real-time weather data, but I can pretend! It's sunny with a chance of AI."
-                ],
-                "joke": [
-                    "Why don't scientists trust atoms? Because they make up everything!",
-                    "What do you call fake spaghetti? An impasta!",
-                    "Why did the chatbot go to therapy? It had too many issues to process!"
-                ]
-            }
+            basic_knowledge = self._default_knowledge_base()
 
             # Save the knowledge base
             try:
-                # Save to MongoDB if available
-                if self.db:
-                    self.db.save_ai_data("knowledge_base", basic_knowledge)
-                else:
-                    # Fallback to file-based storage
-                    with open(knowledge_base_path, 'w') as f:
-                        json.dump(basic_knowledge, f, indent=2)
+                with open(knowledge_base_path, 'w') as f:
+                    json.dump(basic_knowledge, f, indent=2)
             except Exception as e:
                 print(f"Warning: Could not save knowledge base: {e}")
 
-            return basic_knowledge
+            return basic_knowledge, list(basic_knowledge)
+
+    def _default_knowledge_base(self):
+        """Initialize with some basic QA pairs"""
+        return {
+            "greeting": [
+                "Hello! How can I help you today?",
+                "Hi there! I'm your chat assistant.",
+                "Greetings! How's your day going?"
+            ],
+            "farewell": [
+                "Goodbye! Have a great day!",
+                "See you later!",
+                "Bye! Come back soon!"
+            ],
+            "thanks": [
+                "You're welcome!",
+                "Happy to help!",
+                "No problem at all!"
+            ],
+            "help": [
+                "I can help with: \n- Answering questions\n- Providing room recommendations\n- Summarizing conversations\nJust ask me anything!",
+                "Need help? I can answer questions, recommend rooms, or just chat!"
+            ],
+            "about": [
+                f"I'm {self.name}, an AI assistant for this chat application. I'm here to help make your chat experience better!"
+            ],
+            "weather": [
+                "I don't have real-time weather data, but I can pretend! It's sunny with a chance of AI."
+            ],
+            "joke": [
+                "Why don't scientists trust atoms? Because they make up everything!",
+                "What do you call fake spaghetti? An impasta!",
+                "Why did the chatbot go to therapy? It had too many issues to process!"
+            ]
+        }
+
+    def _get_topic_responses(self, topic):
+        """Get the responses for a topic, loading them from MongoDB on first use"""
+        if topic not in self.knowledge_base and self.db:
+            try:
+                responses = self.db.get_knowledge_responses(topic)
+            except Exception as e:
+                print(f"Error loading knowledge base topic {topic}: {e}")
+                return None
+            if responses:
+                self.knowledge_base[topic] = responses
+
+        return self.knowledge_base.get(topic)
+
+    def _refresh_knowledge_base(self):
+        """Pick up topics learned by other workers, checking MongoDB at most every few seconds"""
+        if not self.db or time.time() - self.knowledge_checked < KNOWLEDGE_REFRESH_SECONDS:
+            return
+        self.knowledge_checked = time.time()
+
+        try:
+            # The version is bumped after content is stored, so reading it first
+            # means every change it counts is visible in the topics below
+            version = self.db.get_knowledge_version()
+            if version <= self.knowledge_version:
+                return
+
+            for topic, revision in self.db.get_knowledge_topics().items():
+                if self.knowledge_revisions.get(topic) == revision:
+                    continue
+                # Reload changed topics on next use and make new ones matchable
+                self.knowledge_revisions[topic] = revision
+                self.knowledge_base.pop(topic, None)
+                if topic not in BUILTIN_INTENTS:
+                    self.intent_matcher.add(topic, topic, LEARNED_TOPIC_PRIORITY)
+            self.knowledge_version = version
+        except Exception as e:
+            print(f"Error refreshing knowledge base: {e}")
 
     def get_response(self, user_input, room_name, username):
         """Generate a response to user input"""
-        # Track conversation history
-        if room_name not in self.conversation_history:
-            self.conversation_history[room_name] = []
+        # Track conversation history, forgetting the least recently active rooms
+        if room_name in self.conversation_history:
+            self.conversation_history.move_to_end(room_name)
+        else:
+            self.conversation_history[room_name] = RoomHistory()
+            if len(self.conversation_history) > MAX_ROOMS:
+                self.conversation_history.popitem(last=False)
 
-        self.conversation_history[room_name].append({
-            "user": username,
-            "message": user_input,
-            "timestamp": datetime.now().isoformat()
-        })
+        self.conversation_history[room_name].add(username, user_input)
 
         # Process commands
         if user_input.startswith("/"):
             return self._process_command(user_input, room_name, username)
 
-        # Process regular messages
-        user_input_lower = user_input.lower()
-
-        # Check for greetings
-        if any(word in user_input_lower for word in ["hello", "hi", "hey", "greetings"]):
-            return random.choice(self.knowledge_base["greeting"])
-
-        # Check for farewells
-        if any(word in user_input_lower for word in ["bye", "goodbye", "see you", "later"]):
-            return random.choice(self.knowledge_base["farewell"])
-
-        # Check for thanks
-        if any(word in user_input_lower for word in ["thanks", "thank you", "appreciate"]):
-            return random.choice(self.knowledge_base["thanks"])
-
-        # Check for help request
-        if any(word in user_input_lower for word in ["help", "assist", "support"]):
-            return random.choice(self.knowledge_base["help"])
-
-        # Check for questions about the bot
-        if any(phrase in user_input_lower for phrase in ["who are you", "what are you", "about you"]):
-            return random.choice(self.knowledge_base["about"])
-
-        # Check for weather questions
-        if any(word in user_input_lower for word in ["weather", "temperature", "forecast"]):
-            return random.choice(self.knowledge_base["weather"])
-
-        # Check for joke requests
-        if any(word in user_input_lower for word in ["joke", "funny", "laugh"]):
-            return random.choice(self.knowledge_base["joke"])
+        # Match built-in intents and learned topics in one pass
+        self._refresh_knowledge_base()
+        intent = self.intent_matcher.match(user_input)
+        responses = self._get_topic_responses(intent) if intent else None
+        if responses:
+            return random.choice(responses)
 
         # Default responses if nothing matches
         default_responses = [
@@ -153,7 +340,7 @@ class ChatbotAssistant:
 
         # Joke command
         if command.lower() == "/joke":
-            return random.choice(self.knowledge_base["joke"])
+            return random.choice(self._get_topic_responses("joke") or self._default_knowledge_base()["joke"])
 
         # Summary command
         if command.lower() == "/summary":
@@ -175,38 +362,29 @@ class ChatbotAssistant:
 
     def _generate_summary(self, room_name):
         """Generate a simple summary of recent conversation"""
-        if room_name not in self.conversation_history or len(self.conversation_history[room_name]) < 3:
+        history = self.conversation_history.get(room_name)
+        if history is None or len(history.messages) < 3:
             return "Not enough conversation to summarize yet."
 
         # Get recent messages
-        recent_messages = self.conversation_history[room_name][-10:]
+        recent_messages = history.recent(10)
 
         # Count messages per user
-        user_counts = {}
-        for msg in recent_messages:
-            user = msg["user"]
-            if user not in user_counts:
-                user_counts[user] = 0
-            user_counts[user] += 1
+        user_counts = Counter(msg["user"] for msg in recent_messages)
 
         # Generate summary
         summary = f"Summary of recent conversation in {room_name}:\n"
         summary += f"- {len(recent_messages)} messages in the recent discussion\n"
         summary += f"- Participants: {', '.join(user_counts.keys())}\n"
-        summary += f"- Most active: {max(user_counts.items(), key=lambda x: x[1])[0]}\n"
+        summary += f"- Most active: {user_counts.most_common(1)[0][0]}\n"
 
         # Add topic detection (very simple version)
         all_text = " ".join([msg["message"] for msg in recent_messages])
         words = re.findall(r'\b\w+\b', all_text.lower())
-        word_counts = {}
-        for word in words:
-            if len(word) > 3:  # Skip short words
-                if word not in word_counts:
-                    word_counts[word] = 0
-                word_counts[word] += 1
+        word_counts = Counter(word for word in words if len(word) > 3)  # Skip short words
 
         # Get top words
-        top_words = sorted(word_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_words = word_counts.most_common(5)
         if top_words:
             summary += f"- Main topics: {', '.join(word[0] for word in top_words)}\n"
 
@@ -216,14 +394,17 @@ class ChatbotAssistant:
         """Add new information to the knowledge base"""
         if topic in self.knowledge_base:
             self.knowledge_base[topic].append(information)
-        else:
+        elif not self.db:
             self.knowledge_base[topic] = [information]
 
+        if topic not in BUILTIN_INTENTS:
+            self.intent_matcher.add(topic, topic, LEARNED_TOPIC_PRIORITY)
+
         # Save updated knowledge base
         try:
-            # Save to MongoDB if available
+            # Save to MongoDB if available, touching only this topic
             if self.db:
-                self.db.save_ai_data("knowledge_base", self.knowledge_base)
+                self.db.add_knowledge(topic, information)
             else:
                 # Fallback to file-based storage
                 with open('chatbot_data/knowledge_base.json', 'w') as f:
@@ -235,30 +416,27 @@ class ChatbotAssistant:
 
     def _generate_stats(self, room_name):
         """Generate simple statistics about the chat room"""
-        if room_name not in self.conversation_history or not self.conversation_history[room_name]:
+        history = self.conversation_history.get(room_name)
+        if history is None or not history.total_messages:
             return "No chat statistics available for this room yet."
 
-        messages = self.conversation_history[room_name]
-
-        # Count messages per user
-        user_counts = {}
-        for msg in messages:
-            user = msg["user"]
-            if user not in user_counts:
-                user_counts[user] = 0
-            user_counts[user] += 1
-
         # Calculate average message length
-        avg_length = sum(len(msg["message"]) for msg in messages) / len(messages)
+        avg_length = history.total_length / history.total_messages
 
         # Generate stats
         stats = f"Chat Statistics for {room_name}:\n"
-        stats += f"- Total messages: {len(messages)}\n"
+        stats += f"- Total messages: {history.total_messages}\n"
         stats += f"- Average message length: {avg_length:.1f} characters\n"
-        stats += f"- Participants: {len(user_counts)}\n"
-        stats += "- Messages per user:\n"
+        stats += f"- Recent participants: {len(history.participants())}\n"
+
+        top_terms = history.top_terms(5)
+        if top_terms:
+            stats += f"- Frequent terms: {', '.join(top_terms)}\n"
+
+        # Counts come from the bounded sketch, so they are lower bounds
+        stats += "- Messages per active user (approximate):\n"
 
-        for user, count in sorted(user_counts.items(), key=lambda x: x[1], reverse=True):
+        for user, count in history.user_counts.most_common():
             stats += f"  - {user}: {count} messages\n"
 
         return stats
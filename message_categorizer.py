@@ -1,21 +1,30 @@
 # Create a new file: message_categorizer.py
-import nltk
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import KMeans
+import nlp_resources
 
 class MessageCategorizer:
     def __init__(self):
-        nltk.download('punkt')
-        nltk.download('stopwords')
-        self.stop_words = set(stopwords.words('english'))
+        # Tokenizer and stopword data are loaded on first use, not at startup
+        self._stop_words = None
         self.vectorizer = TfidfVectorizer(stop_words='english')
+
+    @property
+    def stop_words(self):
+        """English stopwords, loading the tokenizer and stopword data on first use"""
+        if self._stop_words is None:
+            nlp_resources.require('punkt_tab')
+            nlp_resources.require('stopwords')
+            self._stop_words = set(stopwords.words('english'))
+        return self._stop_words
         
     def preprocess_text(self, text):
         """Tokenize and remove stopwords"""
+        stop_words = self.stop_words
         tokens = word_tokenize(text.lower())
-        filtered_tokens = [w for w in tokens if w not in self.stop_words]
+        filtered_tokens = [w for w in tokens if w not in stop_words]
         return " ".join(filtered_tokens)
     
     def categorize_messages(self, messages, num_categories=5):
@@ -2,6 +2,7 @@ import pymongo
 from datetime import datetime, timedelta
 import hashlib
 import os
+import time
 import re
 import uuid
 import bcrypt
@@ -20,6 +21,12 @@ except ImportError:
 # Load environment variables
 load_dotenv()
 
+# A room whose sentiment seeding hasn't finished after this long is seeded again
+ROOM_SENTIMENT_SEED_TIMEOUT = timedelta(seconds=int(os.getenv("ROOM_SENTIMENT_SEED_TIMEOUT_SECONDS", 600)))
+
+# How long seeding waits after claiming a room, so score writes stamped before the claim have landed
+ROOM_SENTIMENT_SEED_SETTLE_SECONDS = 0.1
+
 class MongoDBConnector:
     def __init__(self):
         # Get MongoDB connection string from environment variable
@@ -37,9 +44,26 @@ class MongoDBConnector:
         self.ai_data = self.db.ai_data
         self.sessions = self.db.sessions
 
+        # Recommendation history is trimmed per user and expires after RECOMMENDATION_HISTORY_DAYS
+        self.recommendation_history = self.db.recommendation_history
+        self.recommendations = self.db.recommendations
+
+        # Running per-room sentiment aggregates, maintained as messages are scored
+        self.room_sentiment = self.db.room_sentiment
+
+        # Chatbot knowledge base, one document per topic
+        self.knowledge_base = self.db.knowledge_base
+
         # Create indexes for better performance
         self.messages.create_index([("room_id", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)])
 
+        # Only unscored (legacy) messages are indexed, so finding them doesn't scan the whole room
+        self.messages.create_index(
+            [("room_id", pymongo.ASCENDING)],
+            name="unscored_messages",
+            partialFilterExpression={"sentiment": {"$type": "null"}}
+        )
+
         # Create email index with partial filter to exclude null values
         self.users.create_index(
             [("email", pymongo.ASCENDING)],
@@ -49,6 +73,13 @@ class MongoDBConnector:
 
         self.sessions.create_index("expires", expireAfterSeconds=0)  # TTL index for auto-expiry
 
+        self.recommendation_history.create_index([("username", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)])
+        self.recommendation_history.create_index(
+            "created_at",
+            expireAfterSeconds=int(os.getenv("RECOMMENDATION_HISTORY_DAYS", 90)) * 24 * 3600
+        )
+        self.users.create_index("last_active")
+
     # User Authentication Methods
     def register_user(self, username, email, password):
         """Register a new user with email and password"""
@@ -290,6 +321,10 @@ class MongoDBConnector:
         if "password" in data:
             del data["password"]
 
+        # Sentiment stats are only changed with $inc, since messages are
+        # scored in the background while this copy may already be stale
+        data = {key: value for key, value in data.items() if key != "sentiment_stats"}
+
         # Update in database
         self.users.update_one(
             {"_id": username},
@@ -340,18 +375,6 @@ class MongoDBConnector:
             # Extract potential interests from message
             self._update_user_interests(user_data, message)
 
-            # Update sentiment stats if provided
-            if sentiment:
-                if "sentiment_stats" not in user_data:
-                    user_data["sentiment_stats"] = {"positive": 0, "neutral": 0, "negative": 0}
-
-                if sentiment > 0.1:
-                    user_data["sentiment_stats"]["positive"] += 1
-                elif sentiment < -0.1:
-                    user_data["sentiment_stats"]["negative"] += 1
-                else:
-                    user_data["sentiment_stats"]["neutral"] += 1
-
             # Update room message count
             self._update_room_message_count(room_name, username)
 
@@ -368,6 +391,10 @@ class MongoDBConnector:
         # Save updated data
         self.save_user_data(username, user_data)
 
+        # Update sentiment stats if provided
+        if action == "message" and sentiment is not None:
+            self._update_user_sentiment_stats(username, sentiment)
+
         return True
 
     def get_user_interests(self, username):
@@ -893,11 +920,13 @@ class MongoDBConnector:
         # Get from database
         messages = list(self.messages.find(
             {"room_id": room_name},
-            {"_id": 0, "timestamp": 1, "username": 1, "content": 1}
+            {"timestamp": 1, "username": 1, "content": 1, "sentiment": 1}
         ).sort("timestamp", pymongo.DESCENDING).limit(limit))
 
-        # Reverse to get chronological order
+        # Reverse to get chronological order; ids let clients match live updates to messages
         messages.reverse()
+        for message in messages:
+            message["id"] = str(message.pop("_id"))
 
         # Cache the result
         if cache and cache.enabled:
@@ -906,7 +935,12 @@ class MongoDBConnector:
         return messages
 
     def add_message_to_room(self, room_name, username, message, sentiment=None):
-        """Add a message to a room and update metadata"""
+        """
+        Add a message to a room and update metadata
+
+        Returns:
+            ObjectId: The id of the stored message, or None if it couldn't be stored
+        """
         try:
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -916,24 +950,322 @@ class MongoDBConnector:
                 "username": username,
                 "content": message,
                 "timestamp": timestamp,
-                "sentiment": sentiment
+                "sentiment": None
             }
 
             # Insert message
-            self.messages.insert_one(message_data)
+            message_id = self.messages.insert_one(message_data).inserted_id
 
             # Update user activity
             self.update_user_activity(username, room_name, "message", message, sentiment)
 
+            # Store the score like a background score, so it is stamped for the room aggregates
+            if sentiment is not None:
+                sentiment_at = self._store_message_sentiment(message_id, sentiment)
+                if sentiment_at is not None:
+                    self._update_room_sentiment(room_name, username, message, sentiment, sentiment_at)
+
             # Invalidate cache for this room's messages
             if cache and cache.enabled:
                 cache.invalidate_room_messages(room_name)
 
-            return True
+            return message_id
         except Exception as e:
             print(f"Error adding message: {e}")
+            return None
+
+    def get_room_sentiment(self, room_name):
+        """
+        Get the running sentiment aggregates of a room
+
+        Returns:
+            dict: count, sum, categories, most_positive and most_negative
+        """
+        stats = self.room_sentiment.find_one({"_id": room_name})
+
+        # Rooms are seeded from their stored scores once, and again if the
+        # worker seeding them died before finishing
+        if stats is None or "seeded_at" not in stats:
+            stats = self.seed_room_sentiment(self.messages, self.room_sentiment, room_name)
+        elif not stats.get("seeded") and datetime.utcnow() - stats["seeded_at"] > ROOM_SENTIMENT_SEED_TIMEOUT:
+            stats = self.seed_room_sentiment(self.messages, self.room_sentiment, room_name,
+                                             abandoned=stats["seeded_at"])
+        return stats
+
+    @staticmethod
+    def seed_room_sentiment(messages, room_sentiment, room_name, abandoned=None, force=False):
+        """
+        Rebuild a room's sentiment aggregates from the scores stored on its messages
+
+        The room is claimed by resetting its aggregates and stamping
+        seeded_at with the server's time. Scores stored up to then
+        (sentiment_at) are counted here and later ones by the live updates,
+        so each score is counted exactly once however the two interleave.
+
+        Args:
+            messages (Collection): The messages collection
+            room_sentiment (Collection): The room aggregates collection
+            room_name (str): Room to seed
+            abandoned (datetime): seeded_at of an unfinished seeding to take over
+            force (bool): Reseed a room even if it was seeded already
+
+        Returns:
+            dict: The room's aggregates
+        """
+        if force:
+            claim = {"_id": room_name}
+        elif abandoned is not None:
+            claim = {"_id": room_name, "seeded_at": abandoned}
+        else:
+            claim = {"_id": room_name, "seeded_at": {"$exists": False}}
+
+        try:
+            claimed = room_sentiment.find_one_and_update(claim, {
+                "$set": {"count": 0, "sum": 0, "categories": {}, "seeded": False},
+                "$unset": {"most_positive": "", "most_negative": ""},
+                "$currentDate": {"seeded_at": True}
+            }, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+        except pymongo.errors.DuplicateKeyError:
+            # Another worker claimed it first
+            return room_sentiment.find_one({"_id": room_name})
+
+        seeded_at = claimed["seeded_at"]
+        time.sleep(ROOM_SENTIMENT_SEED_SETTLE_SECONDS)
+
+        scored = {
+            "room_id": room_name,
+            "sentiment": {"$type": "number"},
+            "$or": [{"sentiment_at": {"$lte": seeded_at}}, {"sentiment_at": {"$exists": False}}]
+        }
+
+        increments = {"count": 0, "sum": 0}
+        for group in messages.aggregate([
+            {"$match": scored},
+            {"$group": {
+                "_id": {"$switch": {
+                    "branches": [
+                        {"case": {"$gte": ["$sentiment", 0.5]}, "then": "Very Positive"},
+                        {"case": {"$gt": ["$sentiment", 0]}, "then": "Positive"},
+                        {"case": {"$eq": ["$sentiment", 0]}, "then": "Neutral"},
+                        {"case": {"$gt": ["$sentiment", -0.5]}, "then": "Negative"}
+                    ],
+                    "default": "Very Negative"
+                }},
+                "count": {"$sum": 1},
+                "sum": {"$sum": "$sentiment"}
+            }}
+        ]):
+            increments[f"categories.{group['_id']}"] = group["count"]
+            increments["count"] += group["count"]
+            increments["sum"] += group["sum"]
+
+        # Every write is conditional on the claim, so nothing lands if another worker took it over
+        if increments["count"]:
+            for field, direction, beaten_by in (("most_positive", pymongo.DESCENDING, "$lt"),
+                                                ("most_negative", pymongo.ASCENDING, "$gt")):
+                doc = messages.find_one(scored, {"content": 1, "sentiment": 1, "username": 1},
+                                        sort=[("sentiment", direction)])
+                room_sentiment.update_one(
+                    {"_id": room_name, "seeded_at": seeded_at, "$or": [
+                        {field: {"$exists": False}},
+                        {f"{field}.score": {beaten_by: doc["sentiment"]}}
+                    ]},
+                    {"$set": {field: {"message": doc["content"], "score": doc["sentiment"],
+                                      "author": doc["username"]}}}
+                )
+
+        room_sentiment.update_one(
+            {"_id": room_name, "seeded_at": seeded_at},
+            {"$inc": increments, "$set": {"seeded": True}}
+        )
+        return room_sentiment.find_one({"_id": room_name})
+
+    def get_sentiment_timeseries(self, room_name, start=None, end=None, points=200):
+        """
+        Get a room's message sentiment over time, averaged into equal time buckets
+
+        The bucketing runs inside MongoDB, so only one document per bucket
+        leaves the server however many messages the range holds.
+
+        Args:
+            room_name (str): Room to read
+            start (datetime): Start of the range (default: first scored message)
+            end (datetime): End of the range (default: last scored message)
+            points (int): Number of buckets
+
+        Returns:
+            dict: start, end, bucket_seconds and a list of points, each with
+                the bucket start timestamp, average sentiment and message count
+        """
+        scored = {"room_id": room_name, "sentiment": {"$type": "number"}}
+        timestamp_format = "%Y-%m-%d %H:%M:%S"
+
+        # Default to the range actually covered by scored messages
+        if start is None or end is None:
+            first = self.messages.find_one(scored, {"timestamp": 1}, sort=[("timestamp", pymongo.ASCENDING)])
+            last = self.messages.find_one(scored, {"timestamp": 1}, sort=[("timestamp", pymongo.DESCENDING)])
+            if not first or not last:
+                return {"start": None, "end": None, "bucket_seconds": 0, "points": []}
+            try:
+                start = start or datetime.strptime(first["timestamp"], timestamp_format)
+                end = end or datetime.strptime(last["timestamp"], timestamp_format)
+            except ValueError:
+                return {"start": None, "end": None, "bucket_seconds": 0, "points": []}
+
+        bucket_ms = max(1000, int((end - start).total_seconds() * 1000 / points) + 1)
+
+        pipeline = [
+            {"$match": dict(scored, timestamp={
+                "$gte": start.strftime(timestamp_format),
+                "$lte": end.strftime(timestamp_format)
+            })},
+            {"$group": {
+                "_id": {"$floor": {"$divide": [
+                    {"$subtract": [
+                        {"$dateFromString": {
+                            "dateString": "$timestamp",
+                            "format": timestamp_format,
+                            "onError": start
+                        }},
+                        start
+                    ]},
+                    bucket_ms
+                ]}},
+                "sentiment": {"$avg": "$sentiment"},
+                "count": {"$sum": 1}
+            }},
+            {"$sort": {"_id": 1}}
+        ]
+
+        series = []
+        for bucket in self.messages.aggregate(pipeline):
+            bucket_start = start + timedelta(milliseconds=bucket["_id"] * bucket_ms)
+            series.append({
+                "timestamp": bucket_start.strftime(timestamp_format),
+                "sentiment": round(bucket["sentiment"], 4),
+                "count": bucket["count"]
+            })
+
+        return {
+            "start": start.strftime(timestamp_format),
+            "end": end.strftime(timestamp_format),
+            "bucket_seconds": bucket_ms / 1000,
+            "points": series
+        }
+
+    def get_unscored_messages(self, room_name, limit=500):
+        """Get messages of a room that were stored without a sentiment score"""
+        return list(self.messages.find(
+            {"room_id": room_name, "sentiment": {"$type": "null"}},
+            {"_id": 1, "username": 1, "content": 1}
+        ).limit(limit))
+
+    def update_message_sentiment(self, message_id, room_name, username, message, sentiment):
+        """
+        Store the score of a message that was saved without one
+
+        The score is only written, and only counted in the room aggregates
+        and the author's sentiment stats, if the message is still unscored,
+        so concurrent scorers can't count a message twice.
+
+        Returns:
+            bool: True if the score was stored
+        """
+        sentiment_at = self._store_message_sentiment(message_id, sentiment)
+        if sentiment_at is None:
             return False
 
+        # Cached message lists still show the message as unscored
+        if cache and cache.enabled:
+            cache.invalidate_room_messages(room_name)
+
+        self._update_room_sentiment(room_name, username, message, sentiment, sentiment_at)
+        self._update_user_sentiment_stats(username, sentiment)
+        return True
+
+    def _store_message_sentiment(self, message_id, sentiment):
+        """
+        Score a message if it is still unscored
+
+        Returns:
+            datetime: When the score was stored (server time), or None if the
+                message was already scored
+        """
+        scored = self.messages.find_one_and_update(
+            {"_id": message_id, "sentiment": {"$type": "null"}},
+            {"$set": {"sentiment": sentiment}, "$currentDate": {"sentiment_at": True}},
+            projection={"sentiment_at": 1},
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return scored["sentiment_at"] if scored else None
+
+    def _update_user_sentiment_stats(self, username, sentiment):
+        """Count one scored message in a user's positive/neutral/negative stats"""
+        if sentiment > 0.1:
+            category = "positive"
+        elif sentiment < -0.1:
+            category = "negative"
+        else:
+            category = "neutral"
+
+        self.users.update_one(
+            {"_id": username},
+            {"$inc": {f"sentiment_stats.{category}": 1}},
+            upsert=True
+        )
+
+        if cache and cache.enabled:
+            cache.invalidate_user_data(username)
+
+    def _update_room_sentiment(self, room_name, username, message, sentiment, sentiment_at):
+        """Add one scored message to the running sentiment aggregates of a room"""
+        # Only scores stored after the room was seeded; earlier ones are counted by the seeding
+        stats = self.room_sentiment.find_one_and_update(
+            {"_id": room_name, "seeded_at": {"$lt": sentiment_at}},
+            {"$inc": {
+                "count": 1,
+                "sum": sentiment,
+                f"categories.{self._sentiment_category(sentiment)}": 1
+            }},
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        if stats is None:
+            return
+
+        # The extremes only change when this message beats them; the score
+        # condition in the filter keeps concurrent updates from regressing them
+        extreme = {"message": message, "score": sentiment, "author": username}
+        most_positive = stats.get("most_positive")
+        if most_positive is None or sentiment > most_positive["score"]:
+            self._replace_room_sentiment_extreme(room_name, "most_positive", "$lt", extreme)
+
+        most_negative = stats.get("most_negative")
+        if most_negative is None or sentiment < most_negative["score"]:
+            self._replace_room_sentiment_extreme(room_name, "most_negative", "$gt", extreme)
+
+    def _replace_room_sentiment_extreme(self, room_name, field, beaten_by, extreme):
+        """Set an extreme message of a room if the stored one is missing or beaten"""
+        self.room_sentiment.update_one(
+            {"_id": room_name, "$or": [
+                {field: {"$exists": False}},
+                {f"{field}.score": {beaten_by: extreme["score"]}}
+            ]},
+            {"$set": {field: extreme}}
+        )
+
+    def _sentiment_category(self, score):
+        """Bucket a compound score the same way as the analytics pipelines"""
+        if score >= 0.5:
+            return "Very Positive"
+        elif score > 0:
+            return "Positive"
+        elif score == 0:
+            return "Neutral"
+        elif score > -0.5:
+            return "Negative"
+        else:
+            return "Very Negative"
+
     # AI data methods
     def load_ai_data(self, data_type):
         """Load AI data from database"""
@@ -952,6 +1284,157 @@ class MongoDBConnector:
             upsert=True
         )
 
+    # Knowledge base methods
+    def get_knowledge_topics(self):
+        """
+        Get chatbot knowledge base topics
+
+        Returns:
+            dict: Topic -> revision, bumped whenever the topic's responses change
+        """
+        return {doc["_id"]: doc.get("revision", 0) for doc in self.knowledge_base.find({}, {"revision": 1})}
+
+    def get_knowledge_responses(self, topic):
+        """Get the responses stored for a knowledge base topic, or None"""
+        doc = self.knowledge_base.find_one({"_id": topic}, {"responses": 1})
+        return doc.get("responses") if doc else None
+
+    def get_knowledge_version(self):
+        """Get the knowledge base version, bumped after every change is stored"""
+        doc = self.ai_data.find_one({"type": "knowledge_base_version"})
+        return doc.get("version", 0) if doc else 0
+
+    def add_knowledge(self, topic, information):
+        """
+        Append a response to a knowledge base topic
+
+        Only the topic's own document is touched, so concurrent additions
+        don't overwrite each other. The topic's revision changes in the same
+        update as its responses, and the knowledge base version is only
+        bumped afterwards, so a worker that sees the new version also sees
+        the new content.
+
+        Returns:
+            int: The knowledge base version after this change
+        """
+        self.knowledge_base.update_one(
+            {"_id": topic},
+            {"$push": {"responses": information}, "$inc": {"revision": 1}, "$set": {"updated": datetime.now()}},
+            upsert=True
+        )
+
+        return self.ai_data.find_one_and_update(
+            {"type": "knowledge_base_version"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )["version"]
+
+    def import_knowledge_base(self, knowledge_base):
+        """Insert knowledge base topics that don't exist yet, leaving existing ones untouched"""
+        if not knowledge_base:
+            return
+
+        self.knowledge_base.bulk_write([
+            pymongo.UpdateOne(
+                {"_id": topic},
+                {"$setOnInsert": {"responses": list(responses), "revision": 0}},
+                upsert=True
+            )
+            for topic, responses in knowledge_base.items()
+        ], ordered=False)
+
+    def migrate_knowledge_base(self):
+        """Split a legacy single-document knowledge base in ai_data into per-topic documents"""
+        legacy = self.load_ai_data("knowledge_base")
+        if legacy is None:
+            return
+
+        self.import_knowledge_base(legacy)
+        self.ai_data.delete_one({"type": "knowledge_base"})
+        print(f"Migrated knowledge base: {len(legacy)} topics")
+
+    # Recommendation history methods
+    def log_recommendation_events(self, events):
+        """Append a batch of recommendation events to the history collection"""
+        if not events:
+            return 0
+
+        # created_at is the date the TTL index expires events by
+        created_at = datetime.utcnow()
+        self.recommendation_history.insert_many([dict(event, created_at=created_at) for event in events],
+                                                ordered=False)
+        return len(events)
+
+    def get_recommendation_history(self, username, limit=50):
+        """Get the most recent recommendation events for a user (newest first)"""
+        return list(self.recommendation_history.find(
+            {"username": username},
+            {"_id": 0, "created_at": 0}
+        ).sort("timestamp", pymongo.DESCENDING).limit(limit))
+
+    def trim_recommendation_history(self, username, keep=100):
+        """Delete all but the most recent `keep` recommendation events for a user"""
+        cutoff = list(self.recommendation_history.find(
+            {"username": username},
+            {"_id": 0, "timestamp": 1}
+        ).sort("timestamp", pymongo.DESCENDING).skip(keep).limit(1))
+
+        if not cutoff:
+            return 0
+
+        result = self.recommendation_history.delete_many({
+            "username": username,
+            "timestamp": {"$lte": cutoff[0]["timestamp"]}
+        })
+        return result.deleted_count
+
+    def iter_recommendation_profiles(self, usernames=None, active_since=None, batch_size=1000):
+        """Stream the interests and joined rooms of users, optionally only recently active ones"""
+        query = {}
+        if usernames is not None:
+            query["_id"] = {"$in": list(usernames)}
+        if active_since:
+            query["last_active"] = {"$gte": active_since}
+
+        cursor = self.users.find(
+            query,
+            {"_id": 1, "interests": 1, "joined_rooms": 1}
+        ).batch_size(batch_size)
+
+        for user in cursor:
+            yield {
+                "username": user["_id"],
+                "interests": user.get("interests", []),
+                "joined_rooms": user.get("joined_rooms", [])
+            }
+
+    def save_batch_recommendations(self, recommendations, model_version=None):
+        """Store precomputed recommendation lists keyed by username"""
+        if not recommendations:
+            return 0
+
+        generated_at = datetime.now().isoformat()
+        operations = [
+            pymongo.ReplaceOne(
+                {"_id": username},
+                {"_id": username, "rooms": rooms, "model_version": model_version, "generated_at": generated_at},
+                upsert=True
+            )
+            for username, rooms in recommendations.items()
+        ]
+
+        # Write in chunks to keep each bulk request reasonably sized
+        for i in range(0, len(operations), 1000):
+            self.recommendations.bulk_write(operations[i:i + 1000], ordered=False)
+
+        return len(operations)
+
+    def get_batch_recommendations(self, username):
+        """Get the precomputed recommendation list for a user, or None"""
+        doc = self.recommendations.find_one({"_id": username}, {"rooms": 1})
+        return doc["rooms"] if doc else None
+
     # Helper methods
     def _update_user_interests(self, user_data, message):
         """Extract potential interests from user messages"""
@@ -1169,6 +1652,12 @@ class MongoDBConnector:
                 import json
                 json.dump(ai_data, f, default=str, indent=2)
 
+            # Backup chatbot knowledge base
+            knowledge_base = list(self.knowledge_base.find())
+            with open(os.path.join(backup_dir, 'knowledge_base.json'), 'w') as f:
+                import json
+                json.dump(knowledge_base, f, default=str, indent=2)
+
             return backup_dir
         except Exception as e:
             print(f"Error creating backup: {e}")
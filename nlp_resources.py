@@ -0,0 +1,227 @@
+"""
+Offline NLTK resources for the chat application
+
+NLTK data is provisioned once into NLTK_DATA_DIR (at image build time) and
+loaded lazily on first use, so the app never touches the network when it
+starts. The expected checksum of every resource is pinned in
+nlp_resources.lock.json, which is committed with the code; downloads are
+checked against it, and each resource is checked again before it is first
+used.
+
+Usage:
+    python nlp_resources.py provision
+    python nlp_resources.py verify
+    python nlp_resources.py pin    # maintainers: record checksums of a trusted download
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import nltk
+
+# Directory holding the provisioned NLTK data and its manifest
+NLTK_DATA_DIR = os.getenv("NLTK_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nltk_data'))
+
+# Pinned name -> sha256 of every resource, committed with the code
+PINS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nlp_resources.lock.json')
+
+# NLTK package id -> path of the resource inside the data directory
+RESOURCES = {
+    'vader_lexicon': 'sentiment/vader_lexicon.zip',
+    'stopwords': 'corpora/stopwords',
+    'punkt_tab': 'tokenizers/punkt_tab'
+}
+
+_verified = set()
+_lock = threading.Lock()
+
+def downloads_allowed():
+    """Whether missing resources may be downloaded at runtime (off by default)"""
+    return os.getenv("NLP_ALLOW_DOWNLOAD", "").lower() in ("1", "true", "yes")
+
+def require(name):
+    """
+    Make sure an NLTK resource is available locally before it is first used
+
+    The first call for a resource checks it against its pinned checksum;
+    later calls return immediately.
+
+    Args:
+        name (str): NLTK package id, one of RESOURCES
+
+    Raises:
+        LookupError: If the resource isn't provisioned (and downloads are
+            not allowed) or doesn't match its pinned checksum
+    """
+    if name in _verified:
+        return
+
+    with _lock:
+        if name in _verified:
+            return
+
+        if NLTK_DATA_DIR not in nltk.data.path:
+            nltk.data.path.insert(0, NLTK_DATA_DIR)
+
+        start = time.perf_counter()
+        path = os.path.join(NLTK_DATA_DIR, RESOURCES[name])
+
+        if not os.path.exists(path):
+            if not downloads_allowed():
+                raise LookupError(
+                    f"NLP resource '{name}' is not provisioned in {NLTK_DATA_DIR}; "
+                    f"run `python nlp_resources.py provision` or set NLP_ALLOW_DOWNLOAD=1"
+                )
+            provision([name])
+
+        problem = check(name, path)
+        if problem:
+            raise LookupError(f"NLP resource '{name}' in {NLTK_DATA_DIR} {problem}")
+
+        _verified.add(name)
+        print(f"NLP resource '{name}' ready in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+def missing(data_dir=None):
+    """Names of resources that aren't provisioned in the data directory"""
+    data_dir = data_dir or NLTK_DATA_DIR
+    return [name for name, path in RESOURCES.items() if not os.path.exists(os.path.join(data_dir, path))]
+
+def checksum(path):
+    """SHA-256 of a resource file, or of every file below a resource directory"""
+    digest = hashlib.sha256()
+
+    if os.path.isfile(path):
+        files = [(os.path.basename(path), path)]
+    else:
+        files = sorted(
+            (os.path.relpath(os.path.join(root, filename), path), os.path.join(root, filename))
+            for root, _, filenames in os.walk(path)
+            for filename in filenames
+        )
+
+    for relative_path, full_path in files:
+        digest.update(relative_path.replace(os.sep, '/').encode('utf-8') + b'\0')
+        with open(full_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+def load_pins():
+    """Load the pinned name -> sha256 checksums"""
+    try:
+        with open(PINS_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def check(name, path):
+    """Compare a resource with its pinned checksum, returning a description of the problem or None"""
+    expected = load_pins().get(name)
+    if expected is None:
+        return f"has no pinned checksum in {os.path.basename(PINS_FILE)}"
+    if checksum(path) != expected:
+        return "doesn't match its pinned checksum"
+    return None
+
+def _download(name, data_dir):
+    """Download one NLTK package into a data directory"""
+    try:
+        downloaded = nltk.download(name, download_dir=data_dir, quiet=True, raise_on_error=True)
+    except ValueError as e:
+        raise LookupError(f"Could not download NLP resource '{name}': {e}") from e
+    if not downloaded:
+        raise LookupError(f"Could not download NLP resource '{name}'")
+
+def _remove(path):
+    """Delete a downloaded resource along with the archive NLTK unpacked it from"""
+    for target in (path, path + '.zip'):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.remove(target)
+
+def provision(names=None, data_dir=None):
+    """
+    Download NLTK resources into the data directory and check them against their pins
+
+    A resource that doesn't match its pinned checksum is deleted again.
+
+    Args:
+        names (list): Package ids to provision (default: all of RESOURCES)
+        data_dir (str): Target directory (default: NLTK_DATA_DIR)
+
+    Raises:
+        LookupError: If a resource could not be downloaded or doesn't match its pin
+    """
+    data_dir = data_dir or NLTK_DATA_DIR
+    os.makedirs(data_dir, exist_ok=True)
+
+    for name in names or RESOURCES:
+        _download(name, data_dir)
+
+        path = os.path.join(data_dir, RESOURCES[name])
+        problem = check(name, path)
+        if problem:
+            _remove(path)
+            raise LookupError(f"Downloaded NLP resource '{name}' {problem}")
+        print(f"Provisioned {name}")
+
+def pin(names=None):
+    """
+    Download NLTK resources into a scratch directory and pin their checksums
+
+    For maintainers adding or upgrading a resource: review the printed
+    checksums and commit the updated PINS_FILE.
+    """
+    pins = load_pins()
+    with tempfile.TemporaryDirectory() as data_dir:
+        for name in names or RESOURCES:
+            _download(name, data_dir)
+            pins[name] = checksum(os.path.join(data_dir, RESOURCES[name]))
+            print(f"Pinned {name}: {pins[name]}")
+
+    with open(PINS_FILE, 'w') as f:
+        json.dump(pins, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def verify(data_dir=None):
+    """
+    Check every resource against its pinned checksum
+
+    Returns:
+        list: Names of missing or mismatching resources
+    """
+    data_dir = data_dir or NLTK_DATA_DIR
+
+    problems = []
+    for name, path in RESOURCES.items():
+        full_path = os.path.join(data_dir, path)
+        problem = "is missing" if not os.path.exists(full_path) else check(name, full_path)
+        if problem:
+            problems.append(name)
+            print(f"{name}: {problem}")
+        else:
+            print(f"{name}: ok")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision or verify offline NLTK resources")
+    parser.add_argument('command', choices=['provision', 'verify', 'pin'])
+    parser.add_argument('--dir', default=NLTK_DATA_DIR, help="NLTK data directory")
+    args = parser.parse_args()
+
+    if args.command == 'provision':
+        provision(data_dir=args.dir)
+    elif args.command == 'pin':
+        pin()
+    elif verify(args.dir):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
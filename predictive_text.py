@@ -1,141 +1,947 @@
 import os
+import sys
 import json
 import re
-from collections import Counter, defaultdict
+import heapq
+import random
+import sqlite3
+import threading
+import time
+import atexit
+from array import array
+from collections import OrderedDict
+
+# Redis is only needed for the shared PREDICTIVE_BACKEND=redis model
+try:
+    import redis
+except ImportError:
+    redis = None
+
+class ModelStore:
+    """Single-file SQLite store holding every predictive model as one row
+
+    Replaces the one-JSON-file-per-user layout so directory fan-out stays
+    bounded. Each save runs in a transaction, so a model row is always either
+    the old or the new version, never a partially written one.
+    """
+
+    # Storage formats of the `data` column
+    FORMAT_JSON = 1
+    FORMAT_PACKED = 2
+
+    def __init__(self, path='predictive_models/models.db'):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS models ("
+                "name TEXT PRIMARY KEY, format INTEGER NOT NULL, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+            )
+            # Word ids are allocated here, so every worker sharing the file maps words the same way
+            self._conn.execute("CREATE TABLE IF NOT EXISTS vocabulary (id INTEGER PRIMARY KEY, word TEXT NOT NULL)")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS vocabulary_word ON vocabulary (word)")
+
+    def names(self):
+        """List the names of all stored models"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM models")]
+
+    def load(self, name):
+        """Load one model's (format, data), or None if it isn't stored"""
+        with self._lock:
+            row = self._conn.execute("SELECT format, data FROM models WHERE name = ?", (name,)).fetchone()
+        return row
+
+    def word_ids(self, words):
+        """
+        Get the ids of words, allocating ids for new ones
+
+        Ids are assigned by SQLite in one transaction and never change or get
+        reused, so concurrent workers always agree on them.
+
+        Returns:
+            dict: word -> id
+        """
+        words = list(dict.fromkeys(words))
+        ids = {}
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO vocabulary (word) VALUES (?)",
+                                   [(word,) for word in words])
+            for start in range(0, len(words), 500):
+                chunk = words[start:start + 500]
+                ids.update((word, word_id) for word_id, word in self._conn.execute(
+                    f"SELECT id, word FROM vocabulary WHERE word IN ({','.join('?' * len(chunk))})", chunk))
+        return ids
+
+    def words_for_ids(self, word_ids):
+        """Get the words of allocated ids as a dict id -> word"""
+        word_ids = list(word_ids)
+        words = {}
+        with self._lock:
+            for start in range(0, len(word_ids), 500):
+                chunk = word_ids[start:start + 500]
+                words.update(self._conn.execute(
+                    f"SELECT id, word FROM vocabulary WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+        return words
+
+    def save_many(self, rows):
+        """Atomically write several (name, format, data) rows in one transaction"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO models (name, format, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(name, fmt, data, now) for name, fmt, data in rows]
+            )
+
+    def is_empty(self):
+        """Check whether the store has no models yet"""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM models LIMIT 1").fetchone() is None
+
+class Vocabulary:
+    """
+    In-memory part of the vocabulary interning tokens to integer ids
+
+    Ids are allocated by the store, which holds every word ever seen, so all
+    workers sharing it map words to the same ids. Only words the loaded
+    models refer to are kept here; released words are looked up again when
+    a model using them is loaded or they are seen again.
+    """
+
+    __slots__ = ('ids', 'words', 'store')
+
+    def __init__(self, store):
+        self.store = store
+        self.ids = {}
+        # id -> word
+        self.words = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, words):
+        """Return the ids of a list of words, allocating ids for new ones in one store call"""
+        missing = [word for word in words if word not in self.ids]
+        if missing:
+            for word, word_id in self.store.word_ids(missing).items():
+                self.ids[word] = word_id
+                self.words[word_id] = word
+        return [self.ids[word] for word in words]
+
+    def load(self, word_ids):
+        """Make sure the words of ids referred to by a loaded model are known"""
+        missing = [word_id for word_id in word_ids if word_id not in self.words]
+        if missing:
+            for word_id, word in self.store.words_for_ids(missing).items():
+                self.ids[word] = word_id
+                self.words[word_id] = word
+
+    def lookup(self, word):
+        """Return the id of a known word, or None"""
+        return self.ids.get(word)
+
+    def release(self, word_ids):
+        """Forget words that no loaded model refers to any more; their ids stay allocated in the store"""
+        for word_id in word_ids:
+            word = self.words.pop(word_id, None)
+            if word is not None:
+                del self.ids[word]
+
+def prefix_key(*word_ids):
+    """
+    Pack a one- or two-word prefix into a single integer key
+
+    Bigram prefixes are the word id itself; trigram prefixes put the first
+    word (offset by one) in the high 32 bits, so the two never collide.
+    """
+    if len(word_ids) == 1:
+        return word_ids[0]
+    return ((word_ids[0] + 1) << 32) | word_ids[1]
+
+def prefix_ids(key):
+    """Unpack a prefix key into its word ids"""
+    if key < 1 << 32:
+        return (key,)
+    return ((key >> 32) - 1, key & 0xFFFFFFFF)
+
+class NGramModel:
+    """
+    Compact n-gram count table
+
+    Each prefix key maps to one array('I') of interleaved (word id, count)
+    pairs, about 8 bytes per continuation instead of a Counter entry with its
+    own string. Most prefixes only ever see one continuation, so those are
+    stored as a single packed int (count << 32 | word id) until a second one
+    appears. Prefixes with many continuations additionally get a
+    word id -> slot index so updates don't scan the array.
+
+    Prefixes with more than TOP_K continuations keep their TOP_K most
+    frequent ones in a small list sorted by count, updated whenever a count
+    reaches it, so reads never have to look at the full table.
+    """
+
+    __slots__ = ('tables', 'index', 'top', 'entries', 'updates')
+
+    # Continuation count at which a prefix gets a slot index
+    INDEX_THRESHOLD = 32
+
+    # Number of most frequent continuations tracked per prefix
+    TOP_K = 10
+
+    # Rough per-prefix overhead (dict slot, key, packed int or array header) in bytes
+    PREFIX_OVERHEAD = 100
+
+    # Rough fixed overhead of an empty model in bytes
+    MODEL_OVERHEAD = 500
+
+    def __init__(self):
+        self.tables = {}
+        self.index = {}
+        # prefix key -> [[count, word id], ...], highest count first
+        self.top = {}
+        # Number of (prefix, continuation) pairs stored
+        self.entries = 0
+        # Number of messages trained into the model
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.tables)
+
+    @property
+    def nbytes(self):
+        """Estimated memory used by the model"""
+        return self.MODEL_OVERHEAD + self.PREFIX_OVERHEAD * len(self.tables) + 8 * self.entries
+
+    def add(self, key, word_id, amount=1):
+        """Add to the count of word_id following the prefix key"""
+        pairs = self.tables.get(key)
+        if pairs is None:
+            self.tables[key] = (amount << 32) | word_id
+            self.entries += 1
+            return
+
+        if pairs.__class__ is int:
+            if pairs & 0xFFFFFFFF == word_id:
+                self.tables[key] = pairs + (amount << 32)
+            else:
+                self.tables[key] = array('I', (pairs & 0xFFFFFFFF, pairs >> 32, word_id, amount))
+                self.entries += 1
+            return
+
+        slots = self.index.get(key)
+        if slots is not None:
+            slot = slots.get(word_id)
+        else:
+            try:
+                slot = pairs[0::2].index(word_id)
+            except ValueError:
+                slot = None
+
+        if slot is not None:
+            pairs[2 * slot + 1] += amount
+            count = pairs[2 * slot + 1]
+        else:
+            slot = len(pairs) >> 1
+            pairs.append(word_id)
+            pairs.append(amount)
+            count = amount
+            self.entries += 1
+
+            if slots is not None:
+                slots[word_id] = slot
+            elif slot + 1 >= self.INDEX_THRESHOLD:
+                self.index[key] = {w: i for i, w in enumerate(pairs[0::2])}
+
+            if slot == self.TOP_K:
+                # Prefix just outgrew TOP_K continuations; start tracking its top list
+                self.top[key] = self._top_from_pairs(pairs)
+                return
+
+        top = self.top.get(key)
+        if top is not None:
+            self._update_top(top, word_id, count)
+
+    def most_common(self, key, n):
+        """
+        Return up to n (word id, count) pairs for a prefix, highest count first
+
+        Runs in O(TOP_K) regardless of how many continuations the prefix has;
+        at most TOP_K pairs are returned.
+        """
+        top = self.top.get(key)
+        if top is not None:
+            return [(word_id, count) for count, word_id in top[:n]]
+
+        pairs = self.tables.get(key)
+        if pairs is None:
+            return []
+        if pairs.__class__ is int:
+            return [(pairs & 0xFFFFFFFF, pairs >> 32)]
+        return heapq.nlargest(n, zip(pairs[0::2], pairs[1::2]), key=lambda x: x[1])
+
+    def prefix_weight(self, key):
+        """Total count of a prefix's most frequent continuations (all of them if it has few)"""
+        top = self.top.get(key)
+        if top is not None:
+            return sum(count for count, _ in top)
+
+        pairs = self.tables.get(key)
+        if pairs is None:
+            return 0
+        if pairs.__class__ is int:
+            return pairs >> 32
+        return sum(pairs[1::2])
+
+    def top_prefixes(self, n, keys=None):
+        """Return the n prefix keys (among keys, default all) with the highest weight"""
+        if keys is None:
+            keys = list(self.tables)
+        return heapq.nlargest(n, keys, key=self.prefix_weight)
+
+    def compact_prefix(self, key, decay=1.0, min_count=1, tie_cutoff=None):
+        """
+        Scale a prefix's counts by decay and drop continuations left below min_count
+
+        Scaled counts are rounded up or down at random in proportion to their
+        fractional part, so counts shrink by decay on average and a word seen
+        once survives each compaction with probability decay.
+
+        Args:
+            tie_cutoff (tuple): If given, continuations left at exactly
+                min_count are only kept when their (word id, prefix key) is
+                at most this value (see eviction_cutoff)
+
+        Returns:
+            int: Number of continuations removed
+        """
+        pairs = self.tables.get(key)
+        if pairs is None:
+            return 0
+        pairs = self._unpack(pairs)
+
+        kept = []
+        for word_id, count in zip(pairs[0::2], pairs[1::2]):
+            if decay != 1.0:
+                scaled = count * decay
+                count = int(scaled)
+                if random.random() < scaled - count:
+                    count += 1
+            if count > min_count or (count == min_count and (tie_cutoff is None or (word_id, key) <= tie_cutoff)):
+                kept.append((word_id, count))
+
+        removed = (len(pairs) >> 1) - len(kept)
+        if decay == 1.0 and not removed:
+            return 0
+
+        self._set_prefix(key, kept)
+        self.entries -= removed
+        return removed
+
+    def eviction_cutoff(self, max_entries):
+        """
+        Find what to evict so that exactly max_entries continuations remain
+
+        The lowest counts go first. Continuations tied at the boundary count
+        are kept in (word id, prefix key) order until the cap is reached, so
+        the result doesn't depend on dict or chunk order.
+
+        Returns:
+            tuple: (min_count, tie_cutoff) to pass to compact_prefix, or None
+                if the model already fits
+        """
+        counts = array('I')
+        for pairs in list(self.tables.values()):
+            if pairs.__class__ is int:
+                counts.append(pairs >> 32)
+            else:
+                counts.extend(pairs[1::2])
+
+        if len(counts) <= max_entries:
+            return None
+        if max_entries <= 0:
+            return (max(counts) + 1, None)
+
+        # The max_entries-th largest count is the boundary; everything above it stays
+        boundary = heapq.nlargest(max_entries, counts)[-1]
+        quota = max_entries - sum(1 for count in counts if count > boundary)
+
+        tied = ((word_id, key)
+                for key, pairs in list(self.tables.items())
+                for word_id, count in self._pairs(pairs)
+                if count == boundary)
+        return (boundary, heapq.nsmallest(quota, tied)[-1])
+
+    def _pairs(self, pairs):
+        """Iterate over the (word id, count) pairs of a stored prefix"""
+        pairs = self._unpack(pairs)
+        return zip(pairs[0::2], pairs[1::2])
+
+    def word_ids(self):
+        """Set of vocabulary ids the model refers to"""
+        ids = set()
+        for key, pairs in list(self.tables.items()):
+            ids.update(prefix_ids(key))
+            if pairs.__class__ is int:
+                ids.add(pairs & 0xFFFFFFFF)
+            else:
+                ids.update(pairs[0::2])
+        return ids
+
+    def _set_prefix(self, key, continuations):
+        """Replace a prefix's continuations with a list of (word id, count) pairs"""
+        self.index.pop(key, None)
+        self.top.pop(key, None)
+
+        if not continuations:
+            self.tables.pop(key, None)
+            return
+        if len(continuations) == 1:
+            word_id, count = continuations[0]
+            self.tables[key] = (count << 32) | word_id
+            return
+
+        pairs = array('I')
+        for word_id, count in continuations:
+            pairs.append(word_id)
+            pairs.append(count)
+        self.tables[key] = pairs
+
+        if len(continuations) >= self.INDEX_THRESHOLD:
+            self.index[key] = {w: i for i, w in enumerate(pairs[0::2])}
+        if len(continuations) > self.TOP_K:
+            self.top[key] = self._top_from_pairs(pairs)
+
+    def _top_from_pairs(self, pairs):
+        """Build the top list of a prefix from its full table"""
+        return [[count, word_id] for word_id, count in
+                heapq.nlargest(self.TOP_K, zip(pairs[0::2], pairs[1::2]), key=lambda x: x[1])]
+
+    def _update_top(self, top, word_id, count):
+        """Move word_id into or up the top list after its count increased to count"""
+        for i, entry in enumerate(top):
+            if entry[1] == word_id:
+                entry[0] = count
+                break
+        else:
+            # Not in the list; it only enters once it passes the current k-th count
+            if count <= top[-1][0]:
+                return
+            i = len(top) - 1
+            top[i] = [count, word_id]
+
+        # Bubble the updated entry up to keep the list sorted
+        while i > 0 and top[i - 1][0] < count:
+            top[i - 1], top[i] = top[i], top[i - 1]
+            i -= 1
+
+    def _unpack(self, pairs):
+        """Return the stored continuations of a prefix as interleaved pairs"""
+        if pairs.__class__ is int:
+            return (pairs & 0xFFFFFFFF, pairs >> 32)
+        return pairs
+
+    def to_bytes(self):
+        """Serialize the model into a compact binary blob"""
+        keys = array('Q', self.tables.keys())
+        lengths = array('I')
+        data = array('I')
+        for pairs in self.tables.values():
+            pairs = self._unpack(pairs)
+            lengths.append(len(pairs))
+            data.extend(pairs)
+
+        header = array('Q', (len(keys), len(data), self.updates))
+        if sys.byteorder == 'big':
+            for part in (header, keys, lengths, data):
+                part.byteswap()
+
+        return header.tobytes() + keys.tobytes() + lengths.tobytes() + data.tobytes()
+
+    @staticmethod
+    def _parse_bytes(blob):
+        """Split a blob created by to_bytes into (updates, keys, lengths, data)"""
+        header = array('Q')
+        header.frombytes(blob[:24])
+        if sys.byteorder == 'big':
+            header.byteswap()
+        num_keys, num_data, updates = header
+
+        offset = 24
+        keys = array('Q')
+        keys.frombytes(blob[offset:offset + 8 * num_keys])
+        offset += 8 * num_keys
+        lengths = array('I')
+        lengths.frombytes(blob[offset:offset + 4 * num_keys])
+        offset += 4 * num_keys
+        data = array('I')
+        data.frombytes(blob[offset:offset + 4 * num_data])
+        if sys.byteorder == 'big':
+            for part in (keys, lengths, data):
+                part.byteswap()
+
+        return updates, keys, lengths, data
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """Rebuild a model from a blob created by to_bytes"""
+        updates, keys, lengths, data = cls._parse_bytes(blob)
+
+        model = cls()
+        model.updates = updates
+        position = 0
+        for key, length in zip(keys, lengths):
+            if length == 2:
+                pairs = (data[position + 1] << 32) | data[position]
+            else:
+                pairs = data[position:position + length]
+            position += length
+            model.tables[key] = pairs
+            model.entries += length >> 1
+            if length >> 1 >= cls.INDEX_THRESHOLD:
+                model.index[key] = {w: i for i, w in enumerate(pairs[0::2])}
+            if length >> 1 > cls.TOP_K:
+                model.top[key] = model._top_from_pairs(pairs)
+
+        return model
+
+
+class ModelCache:
+    """
+    LRU cache of loaded user models bounded by an estimated memory budget
+
+    The cache doesn't evict on its own: models may hold unsaved counts, so
+    the owner pops the least recently used ones with pop_over_budget and
+    saves them first if needed.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def get(self, name):
+        """Get a loaded model and mark it recently used, or None if it isn't loaded"""
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                self.misses += 1
+                return None
+            self._models.move_to_end(name)
+            self.hits += 1
+            return model
+
+    def peek(self, name):
+        """Get a loaded model without affecting LRU order or counters"""
+        return self._models.get(name)
+
+    def values(self):
+        """List the loaded models"""
+        with self._lock:
+            return list(self._models.values())
+
+    def items(self):
+        """List (name, model) pairs of the loaded models"""
+        with self._lock:
+            return list(self._models.items())
+
+    def put(self, name, model):
+        """Add a loaded model as the most recently used one"""
+        with self._lock:
+            self._models[name] = model
+            self._models.move_to_end(name)
+            self.bytes_used += model.nbytes - self._sizes.get(name, 0)
+            self._sizes[name] = model.nbytes
+
+    def resize(self, name):
+        """Update the size accounting of a model after it grew"""
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self.bytes_used += model.nbytes - self._sizes[name]
+                self._sizes[name] = model.nbytes
+
+    def pop_over_budget(self, keep=None):
+        """Remove and return (name, model) pairs, least recently used first, until within budget"""
+        evicted = []
+        with self._lock:
+            while self.bytes_used > self.max_bytes and len(self._models) > 1:
+                name, model = self._models.popitem(last=False)
+                if name == keep:
+                    # Never evict the model currently in use; make it most recent instead
+                    self._models[name] = model
+                    continue
+                self.bytes_used -= self._sizes.pop(name)
+                self.evictions += 1
+                evicted.append((name, model))
+        return evicted
+
+    def stats(self):
+        """Report size, hit/miss and eviction counters"""
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._models),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
 
 class PredictiveText:
     """Simple predictive text system based on n-grams"""
-    
-    def __init__(self):
-        self.user_models = {}
-        self.global_model = defaultdict(Counter)
-        self.load_models()
-        
+
+    # Store key of the global model (not a valid username)
+    GLOBAL_MODEL = "__global__"
+
+    # Messages trained between prediction bundle versions, so clients only
+    # re-download the bundle after the models changed meaningfully
+    BUNDLE_GLOBAL_UPDATES = 1000
+    BUNDLE_USER_UPDATES = 20
+
+    def __init__(self, flush_interval=None, model_dir='predictive_models'):
+        self.global_model = NGramModel()
+
+        # User models are loaded on first use and evicted least recently used first
+        self.user_models = ModelCache(
+            max_bytes=int(os.getenv("PREDICTIVE_USER_MODEL_BYTES", 128 * 1024 * 1024))
+        )
+
+        # Names of models changed since they were last written
+        self.dirty = set()
+        self._lock = threading.RLock()
+
         # Create directory if it doesn't exist
-        os.makedirs('predictive_models', exist_ok=True)
-    
+        os.makedirs(model_dir, exist_ok=True)
+        self.model_dir = model_dir
+
+        self.store = ModelStore(os.path.join(model_dir, 'models.db'))
+        self.load_models()
+
+        # (global version, global prefix keys) of the last exported bundle
+        self._bundle_keys = (None, [])
+        self._bundle_lock = threading.Lock()
+
+        # Counts decay periodically and rare continuations are pruned, with a
+        # hard cap on the number of (prefix, continuation) entries per model
+        self.decay = float(os.getenv("PREDICTIVE_DECAY", 0.9))
+        self.min_count = int(os.getenv("PREDICTIVE_MIN_COUNT", 1))
+        self.max_user_entries = int(os.getenv("PREDICTIVE_MAX_USER_ENTRIES", 50000))
+        self.max_global_entries = int(os.getenv("PREDICTIVE_MAX_GLOBAL_ENTRIES", 2000000))
+        self.compaction_interval = float(os.getenv("PREDICTIVE_COMPACTION_HOURS", 24)) * 3600
+        self.compaction_stats = {}
+        self._last_compaction = time.time()
+        self._global_over_cap = False
+
+        # Write changed models in the background instead of on every message
+        self.flush_interval = flush_interval or int(os.getenv("PREDICTIVE_FLUSH_SECONDS", 30))
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.save_models)
+
     def load_models(self):
-        """Load existing predictive models"""
-        # Load global model
-        try:
-            with open('predictive_models/global_model.json', 'r') as f:
-                model_data = json.load(f)
-                for prefix, continuations in model_data.items():
-                    self.global_model[prefix] = Counter(continuations)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.global_model = defaultdict(Counter)
-        
-        # Load user-specific models
-        try:
-            user_files = [f for f in os.listdir('predictive_models') 
-                         if f.endswith('_model.json') and not f.startswith('global')]
-            
-            for user_file in user_files:
-                username = user_file.replace('_model.json', '')
-                with open(f'predictive_models/{user_file}', 'r') as f:
-                    model_data = json.load(f)
-                    user_model = defaultdict(Counter)
-                    for prefix, continuations in model_data.items():
-                        user_model[prefix] = Counter(continuations)
-                    self.user_models[username] = user_model
-        except (FileNotFoundError, OSError):
-            pass
-    
+        """Load the global model; user models are loaded on first use"""
+        self.vocabulary = Vocabulary(self.store)
+
+        # Import models from the old one-JSON-file-per-user layout on first run
+        if self.store.is_empty():
+            self._import_legacy_files()
+
+        self.global_model = self._load_model(self.GLOBAL_MODEL) or NGramModel()
+
+    def get_cache_stats(self):
+        """Report user model cache usage"""
+        return self.user_models.stats()
+
     def save_models(self):
-        """Save predictive models to disk"""
-        # Save global model
-        with open('predictive_models/global_model.json', 'w') as f:
-            # Convert defaultdict and Counter to regular dict for JSON serialization
-            model_data = {prefix: dict(counter) for prefix, counter in self.global_model.items()}
-            json.dump(model_data, f, indent=2)
-        
-        # Save user-specific models
-        for username, model in self.user_models.items():
-            with open(f'predictive_models/{username}_model.json', 'w') as f:
-                model_data = {prefix: dict(counter) for prefix, counter in model.items()}
-                json.dump(model_data, f, indent=2)
-    
+        """Write models changed since the last save to the store"""
+        with self._lock:
+            names = list(self.dirty)
+            self.dirty.clear()
+
+            models = [(name, self._resident_model(name)) for name in names]
+            return self._write_models([(name, model) for name, model in models if model is not None])
+
+    def _write_models(self, models):
+        """Write (name, model) pairs in one transaction; call with the lock held"""
+        rows = [(name, ModelStore.FORMAT_PACKED, model.to_bytes()) for name, model in models]
+        if not rows:
+            return 0
+
+        try:
+            self.store.save_many(rows)
+        except sqlite3.Error as e:
+            print(f"Error saving predictive models: {e}")
+            # Keep them dirty so the next flush retries
+            self.dirty.update(name for name, _ in models)
+            return 0
+
+        return len(rows)
+
     def train_on_message(self, username, message):
         """Update models with new message data"""
-        # Ensure user has a model
-        if username not in self.user_models:
-            self.user_models[username] = defaultdict(Counter)
-        
         # Clean and tokenize the message
         words = self._tokenize_message(message)
-        
+
         # Skip if too few words
         if len(words) < 2:
             return
-        
-        # Update models with n-grams (using bigrams and trigrams)
-        # Bigrams (pairs of words)
-        for i in range(len(words) - 1):
-            prefix = words[i]
-            next_word = words[i + 1]
-            
-            # Update global model
-            self.global_model[prefix][next_word] += 1
-            
-            # Update user model
-            self.user_models[username][prefix][next_word] += 1
-        
-        # Trigrams (three words)
-        for i in range(len(words) - 2):
-            prefix = f"{words[i]} {words[i + 1]}"
-            next_word = words[i + 2]
-            
-            # Update global model
-            self.global_model[prefix][next_word] += 1
-            
-            # Update user model
-            self.user_models[username][prefix][next_word] += 1
-        
-        # Save models periodically (could be optimized to save less frequently)
+
+        with self._lock:
+            user_model = self._get_user_model(username)
+            global_model = self.global_model
+
+            try:
+                ids = self.vocabulary.intern(words)
+            except sqlite3.Error as e:
+                print(f"Error allocating predictive text word ids: {e}")
+                return
+
+            # Update models with n-grams (using bigrams and trigrams)
+            # Bigrams (pairs of words)
+            for i in range(len(ids) - 1):
+                key = ids[i]
+                global_model.add(key, ids[i + 1])
+                user_model.add(key, ids[i + 1])
+
+            # Trigrams (three words)
+            for i in range(len(ids) - 2):
+                key = prefix_key(ids[i], ids[i + 1])
+                global_model.add(key, ids[i + 2])
+                user_model.add(key, ids[i + 2])
+
+            global_model.updates += 1
+            user_model.updates += 1
+
+            # Mark both models for the next background flush
+            self.dirty.add(self.GLOBAL_MODEL)
+            self.dirty.add(username)
+
+            # Enforce the size caps between compactions; the global model is
+            # large, so it is pruned by the background thread instead
+            if user_model.entries > self.max_user_entries * 1.1:
+                self._compact_model(username, user_model, 1.0, self.max_user_entries)
+            if global_model.entries > self.max_global_entries * 1.1:
+                self._global_over_cap = True
+
+            self.user_models.resize(username)
+            self._evict_over_budget(keep=username)
+
+    def compact_models(self, decay=None):
+        """
+        Decay counts, prune rare continuations and enforce size caps on all loaded models
+
+        User models that aren't loaded aren't trained either; they are
+        compacted the next time they are loaded and active. Afterwards,
+        words no loaded model refers to are dropped from memory.
+
+        Args:
+            decay (float): Factor counts are scaled by (defaults to PREDICTIVE_DECAY)
+
+        Returns:
+            dict: Compaction statistics
+        """
+        decay = self.decay if decay is None else decay
+        start = time.time()
+        stats = {
+            "models": 0,
+            "entries_before": 0,
+            "entries_after": 0,
+            "bytes_before": 0,
+            "bytes_after": 0
+        }
+
+        with self._lock:
+            models = [(self.GLOBAL_MODEL, self.global_model, self.max_global_entries)]
+            models += [(name, model, self.max_user_entries) for name, model in self.user_models.items()]
+
+        for name, model, max_entries in models:
+            stats["models"] += 1
+            stats["entries_before"] += model.entries
+            stats["bytes_before"] += model.nbytes
+            self._compact_model(name, model, decay, max_entries)
+            stats["entries_after"] += model.entries
+            stats["bytes_after"] += model.nbytes
+
+        # Write the compacted models first so the stored copies no longer hold the pruned words
         self.save_models()
-    
+        stats["words_released"] = self._release_unused_words()
+        stats["vocabulary_size"] = len(self.vocabulary)
+        stats["seconds"] = round(time.time() - start, 3)
+        stats["timestamp"] = time.time()
+
+        self.compaction_stats = stats
+        print(f"Compacted {stats['models']} predictive models: "
+              f"{stats['entries_before']} -> {stats['entries_after']} entries, "
+              f"{stats['words_released']} words released in {stats['seconds']}s")
+        return stats
+
+    def get_compaction_stats(self):
+        """Report the statistics of the last compaction"""
+        return self.compaction_stats
+
+    def _compact_model(self, name, model, decay, max_entries, chunk_size=5000):
+        """Compact one model a chunk of prefixes at a time, so training isn't blocked for long"""
+        with self._lock:
+            keys = list(model.tables)
+
+        for start in range(0, len(keys), chunk_size):
+            with self._lock:
+                for key in keys[start:start + chunk_size]:
+                    model.compact_prefix(key, decay, self.min_count)
+
+        if max_entries and model.entries > max_entries:
+            with self._lock:
+                cutoff = model.eviction_cutoff(max_entries)
+                keys = list(model.tables)
+            if cutoff is not None:
+                min_count, tie_cutoff = cutoff
+                for start in range(0, len(keys), chunk_size):
+                    with self._lock:
+                        for key in keys[start:start + chunk_size]:
+                            model.compact_prefix(key, 1.0, min_count, tie_cutoff)
+
+        with self._lock:
+            self.dirty.add(name)
+            if name != self.GLOBAL_MODEL:
+                self.user_models.resize(name)
+
+    def _release_unused_words(self):
+        """Drop words that no loaded model refers to from the in-memory vocabulary"""
+        with self._lock:
+            referenced = self.global_model.word_ids()
+            for model in self.user_models.values():
+                referenced.update(model.word_ids())
+
+            unused = [word_id for word_id in self.vocabulary.words if word_id not in referenced]
+            self.vocabulary.release(unused)
+            return len(unused)
+
     def predict_next_word(self, username, current_text, max_suggestions=3):
         """Predict the next word based on current text"""
         if not current_text:
             return []
-        
+
         # Get the last word or phrase to use as prefix
         words = self._tokenize_message(current_text)
-        
+
         suggestions = []
-        
+
         # Try to match the last two words (trigram)
         if len(words) >= 2:
-            prefix = f"{words[-2]} {words[-1]}"
-            suggestions = self._get_suggestions(username, prefix, max_suggestions)
-        
+            suggestions = self._get_suggestions(username, words[-2:], max_suggestions)
+
         # If we don't have enough suggestions, try with just the last word (bigram)
         if len(suggestions) < max_suggestions and words:
-            prefix = words[-1]
-            additional_suggestions = self._get_suggestions(username, prefix, 
-                                                         max_suggestions - len(suggestions))
+            additional_suggestions = self._get_suggestions(username, words[-1:],
+                                                           max_suggestions - len(suggestions))
             suggestions.extend([s for s in additional_suggestions if s not in suggestions])
-        
+
         return suggestions[:max_suggestions]
-    
-    def _get_suggestions(self, username, prefix, max_count):
-        """Get word suggestions for a prefix from user and global models"""
+
+    def _get_suggestions(self, username, prefix_words, max_count):
+        """Get word suggestions for a one- or two-word prefix from user and global models"""
+        # Loading the user's model first makes the words it refers to known
+        self._get_user_model(username)
+        ids = [self.vocabulary.lookup(word) for word in prefix_words]
+        if None in ids:
+            return []
+        return self._get_key_suggestions(username, prefix_key(*ids), max_count)
+
+    def _get_key_suggestions(self, username, key, max_count):
+        """Get word suggestions for a prefix key from user and global models"""
         suggestions = []
-        
+
+        # Reads only touch the precomputed top lists, so they don't take the training lock
         # First check user-specific model (higher priority)
-        if username in self.user_models and prefix in self.user_models[username]:
-            user_suggestions = self.user_models[username][prefix].most_common(max_count)
-            suggestions.extend([word for word, _ in user_suggestions])
-        
+        user_model = self._get_user_model(username)
+        if len(user_model):
+            suggestions.extend(word_id for word_id, _ in user_model.most_common(key, max_count))
+
         # Then check global model for additional suggestions
-        if prefix in self.global_model and len(suggestions) < max_count:
-            global_suggestions = self.global_model[prefix].most_common(max_count * 2)  # Get more for filtering
-            for word, _ in global_suggestions:
-                if word not in suggestions and len(suggestions) < max_count:
-                    suggestions.append(word)
-        
-        return suggestions
-    
+        if len(suggestions) < max_count:
+            for word_id, _ in self.global_model.most_common(key, max_count * 2):  # Get more for filtering
+                if word_id not in suggestions and len(suggestions) < max_count:
+                    suggestions.append(word_id)
+
+        return [self.vocabulary.words[word_id] for word_id in suggestions]
+
+    def get_bundle_version(self, username):
+        """Version of a user's prediction bundle; changes every few trained messages"""
+        user_model = self._get_user_model(username)
+        return (f"{self.global_model.updates // self.BUNDLE_GLOBAL_UPDATES}."
+                f"{user_model.updates // self.BUNDLE_USER_UPDATES}")
+
+    def export_bundle(self, username, max_prefixes=2000, max_user_prefixes=500, max_suggestions=5):
+        """
+        Export a prefix -> suggestions table so clients can predict without a request per keystroke
+
+        Suggestions are merged from the user and global models exactly like
+        predict_next_word does, for the highest-weighted prefixes of both.
+
+        Args:
+            username (str): User the bundle is built for
+            max_prefixes (int): Number of global prefixes to include
+            max_user_prefixes (int): Number of the user's own prefixes to include
+            max_suggestions (int): Suggestions per prefix
+
+        Returns:
+            dict: {"version", "max_suggestions", "prefixes": {prefix text: [words]}}
+        """
+        version = self.get_bundle_version(username)
+        user_model = self._get_user_model(username)
+
+        # Only the key snapshot needs the training lock; weights are read from live tables
+        with self._lock:
+            user_keys = list(user_model.tables)
+        user_keys = user_model.top_prefixes(max_user_prefixes, user_keys)
+
+        keys = dict.fromkeys(user_keys)
+        keys.update(dict.fromkeys(self._global_bundle_keys(max_prefixes)))
+
+        prefixes = {}
+        for key in keys:
+            suggestions = self._get_key_suggestions(username, key, max_suggestions)
+            if suggestions:
+                prefixes[self._prefix_text(key)] = suggestions
+
+        return {
+            "version": version,
+            "max_suggestions": max_suggestions,
+            "prefixes": prefixes
+        }
+
+    def _global_bundle_keys(self, max_prefixes):
+        """Highest-weighted global prefixes, recomputed once per global bundle version"""
+        generation = self.global_model.updates // self.BUNDLE_GLOBAL_UPDATES
+        with self._bundle_lock:
+            cached_generation, keys = self._bundle_keys
+            if cached_generation != generation or len(keys) < max_prefixes <= len(self.global_model):
+                with self._lock:
+                    keys = list(self.global_model.tables)
+                keys = self.global_model.top_prefixes(max_prefixes, keys)
+                self._bundle_keys = (generation, keys)
+            return keys[:max_prefixes]
+
+    def _prefix_text(self, key):
+        """Turn a prefix key back into its space-separated words"""
+        return ' '.join(self.vocabulary.words[word_id] for word_id in prefix_ids(key))
+
     def _tokenize_message(self, message):
         """Clean and tokenize a message into words"""
         # Convert to lowercase and split into words
@@ -145,3 +951,459 @@ class PredictiveText:
         # Split on whitespace
         words = message.split()
         return words
+
+    def _get_user_model(self, username):
+        """Get a user's model, loading it from the store (or starting an empty one) on a cache miss"""
+        model = self.user_models.get(username)
+        if model is not None:
+            return model
+
+        with self._lock:
+            # Another thread may have loaded it while we waited for the lock
+            model = self.user_models.peek(username)
+            if model is None:
+                model = self._load_model(username) or NGramModel()
+                self.user_models.put(username, model)
+                self._evict_over_budget(keep=username)
+            return model
+
+    def _resident_model(self, name):
+        """Get the global model or a loaded user model without loading anything"""
+        if name == self.GLOBAL_MODEL:
+            return self.global_model
+        return self.user_models.peek(name)
+
+    def _load_model(self, name):
+        """Load one model from the store, or None if it isn't stored"""
+        row = self.store.load(name)
+        if row is None:
+            return None
+
+        fmt, data = row
+        if fmt != ModelStore.FORMAT_PACKED:
+            # Rewrite imported models in the packed format on the next flush
+            self.dirty.add(name)
+        model = self._decode(fmt, data)
+        self.vocabulary.load(model.word_ids())
+        return model
+
+    def _evict_over_budget(self, keep=None):
+        """Evict least recently used user models over the memory budget, saving unsaved ones first"""
+        with self._lock:
+            evicted = self.user_models.pop_over_budget(keep=keep)
+            unsaved = [(name, model) for name, model in evicted if name in self.dirty]
+            if unsaved:
+                self.dirty.difference_update(name for name, _ in unsaved)
+                if not self._write_models(unsaved):
+                    # Couldn't save them; keep them loaded rather than lose their counts
+                    for name, model in unsaved:
+                        self.user_models.put(name, model)
+
+    def _decode(self, fmt, data):
+        """Deserialize a stored model"""
+        if fmt == ModelStore.FORMAT_PACKED:
+            return NGramModel.from_bytes(data)
+
+        # Word-keyed JSON from the legacy files, interned into the shared vocabulary
+        model = NGramModel()
+        for prefix, continuations in json.loads(data).items():
+            prefix_ids = self.vocabulary.intern(prefix.split())
+            if not 1 <= len(prefix_ids) <= 2:
+                continue
+            key = prefix_key(*prefix_ids)
+            for word_id, count in zip(self.vocabulary.intern(list(continuations)), continuations.values()):
+                model.add(key, word_id, int(count))
+        return model
+
+    def _import_legacy_files(self):
+        """Copy models from the old predictive_models/*_model.json files into the store"""
+        rows = []
+        try:
+            for filename in os.listdir(self.model_dir):
+                if not filename.endswith('_model.json'):
+                    continue
+
+                name = filename[:-len('_model.json')]
+                if name == 'global':
+                    name = self.GLOBAL_MODEL
+
+                try:
+                    with open(os.path.join(self.model_dir, filename), 'r') as f:
+                        data = json.load(f)
+                    rows.append((name, ModelStore.FORMAT_JSON, json.dumps(data, separators=(',', ':'))))
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"Skipping unreadable predictive model {filename}: {e}")
+        except OSError:
+            return
+
+        if rows:
+            self.store.save_many(rows)
+            print(f"Imported {len(rows)} predictive models into {self.store.path}")
+
+    def _flush_loop(self):
+        """Periodically write changed models in the background, compacting them when due"""
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                if time.time() - self._last_compaction >= self.compaction_interval:
+                    self._last_compaction = time.time()
+                    self._global_over_cap = False
+                    self.compact_models()
+                elif self._global_over_cap:
+                    self._global_over_cap = False
+                    self._compact_model(self.GLOBAL_MODEL, self.global_model, 1.0, self.max_global_entries)
+
+                self.save_models()
+            except Exception as e:
+                print(f"Error flushing predictive models: {e}")
+
+class RedisPredictiveText(PredictiveText):
+    """
+    PredictiveText variant keeping the n-gram models in Redis, shared by all workers
+
+    Every prefix is a sorted set of next words scored by count. Training
+    sends all of a message's ZINCRBY updates in one pipeline, and reads use
+    ZREVRANGE for the top continuations behind a short-lived local cache.
+    Per-model sorted sets of prefix weights let the bundle export find the
+    most used prefixes without scanning the keyspace.
+    """
+
+    def __init__(self, redis_client=None, namespace=None, read_cache_seconds=None, read_cache_size=10000):
+        if redis_client is None:
+            if redis is None:
+                raise ImportError("The redis package is required for the Redis predictive text backend")
+            redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        self.redis = redis_client
+        # Fail early so the caller can fall back to the in-process model
+        self.redis.ping()
+
+        self.namespace = namespace or os.getenv("PREDICTIVE_REDIS_NAMESPACE", "ptext")
+        self.read_cache_seconds = (read_cache_seconds if read_cache_seconds is not None
+                                   else float(os.getenv("PREDICTIVE_REDIS_CACHE_SECONDS", 5)))
+        self.read_cache_size = read_cache_size
+
+        # key -> (expires_at, value), least recently used first
+        self._read_cache = OrderedDict()
+        self._read_cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # Same decay and size limits as the in-process models. Scores are
+        # floats here, so continuations decayed below half of min_count are pruned.
+        self.decay = float(os.getenv("PREDICTIVE_DECAY", 0.9))
+        self.min_count = int(os.getenv("PREDICTIVE_MIN_COUNT", 1))
+        self.max_user_entries = int(os.getenv("PREDICTIVE_MAX_USER_ENTRIES", 50000))
+        self.max_global_entries = int(os.getenv("PREDICTIVE_MAX_GLOBAL_ENTRIES", 2000000))
+        self.compaction_interval = float(os.getenv("PREDICTIVE_COMPACTION_HOURS", 24)) * 3600
+
+        # Every worker runs the scheduler; a Redis lock lets one of them compact per interval
+        self._compactor = threading.Thread(target=self._compaction_loop, daemon=True)
+        self._compactor.start()
+
+    def load_models(self):
+        """Models live in Redis; nothing to load"""
+
+    def save_models(self):
+        """Every update is written to Redis as it happens; nothing to flush"""
+        return 0
+
+    def get_cache_stats(self):
+        """Report local read cache usage"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "entries": len(self._read_cache),
+            "max_entries": self.read_cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def train_on_message(self, username, message):
+        """Update the shared models with one pipelined batch of increments"""
+        words = self._tokenize_message(message)
+        if len(words) < 2:
+            return
+
+        ngrams = [(words[i], words[i + 1]) for i in range(len(words) - 1)]
+        ngrams += [(f"{words[i]} {words[i + 1]}", words[i + 2]) for i in range(len(words) - 2)]
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for prefix, next_word in ngrams:
+                pipe.zincrby(self._model_key(self.GLOBAL_MODEL, prefix), 1, next_word)
+                pipe.zincrby(self._model_key(username, prefix), 1, next_word)
+                pipe.zincrby(self._prefixes_key(self.GLOBAL_MODEL), 1, prefix)
+                pipe.zincrby(self._prefixes_key(username), 1, prefix)
+            pipe.hincrby(self._updates_key(), self.GLOBAL_MODEL, 1)
+            pipe.hincrby(self._updates_key(), username, 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"Error training Redis predictive model: {e}")
+
+    def compact_models(self, decay=None):
+        """
+        Decay scores, prune rare continuations and enforce size caps on every shared model
+
+        Returns:
+            dict: Compaction statistics
+        """
+        decay = self.decay if decay is None else decay
+        start = time.time()
+        stats = {"models": 0, "entries_before": 0, "entries_after": 0, "prefixes_removed": 0}
+
+        models_prefix = self._prefixes_key('')
+        for key in self.redis.scan_iter(match=f"{models_prefix}*", count=1000):
+            name = key.decode('utf-8') if isinstance(key, bytes) else key
+            name = name[len(models_prefix):]
+            max_entries = self.max_global_entries if name == self.GLOBAL_MODEL else self.max_user_entries
+
+            before, after, removed = self._compact_model(name, decay, max_entries)
+            stats["models"] += 1
+            stats["entries_before"] += before
+            stats["entries_after"] += after
+            stats["prefixes_removed"] += removed
+
+        stats["seconds"] = round(time.time() - start, 3)
+        stats["timestamp"] = time.time()
+
+        self.redis.set(f"{self.namespace}:compaction_stats", json.dumps(stats))
+        print(f"Compacted {stats['models']} shared predictive models: "
+              f"{stats['entries_before']} -> {stats['entries_after']} entries in {stats['seconds']}s")
+        return stats
+
+    def get_compaction_stats(self):
+        """Report the statistics of the last compaction, run by any worker"""
+        try:
+            stats = self.redis.get(f"{self.namespace}:compaction_stats")
+            return json.loads(stats) if stats else {}
+        except Exception as e:
+            print(f"Error reading predictive compaction stats: {e}")
+            return {}
+
+    def _compact_model(self, name, decay, max_entries, chunk_size=1000):
+        """
+        Compact one shared model
+
+        Returns:
+            tuple: (entries before, entries after, prefixes removed)
+        """
+        prefixes_key = self._prefixes_key(name)
+        min_score = self.min_count / 2
+
+        # Prefixes by weight, heaviest first, so the size cap keeps the most used ones
+        prefixes = [p.decode('utf-8') if isinstance(p, bytes) else p
+                    for p in self.redis.zrevrange(prefixes_key, 0, -1)]
+
+        before = after = 0
+        keep = []
+        for start in range(0, len(prefixes), chunk_size):
+            chunk = prefixes[start:start + chunk_size]
+            pipe = self.redis.pipeline(transaction=False)
+            for prefix in chunk:
+                key = self._model_key(name, prefix)
+                pipe.zcard(key)
+                if decay != 1.0:
+                    pipe.zunionstore(key, {key: decay})
+                pipe.zremrangebyscore(key, '-inf', f"({min_score}")
+                pipe.zcard(key)
+            results = pipe.execute()
+
+            step = 4 if decay != 1.0 else 3
+            for i, prefix in enumerate(chunk):
+                card_before, card_after = results[i * step], results[i * step + step - 1]
+                before += card_before
+                if card_after:
+                    keep.append((prefix, card_after))
+
+        # Hard cap: keep the heaviest prefixes whose continuations fit within max_entries
+        dropped = []
+        for prefix, card in keep:
+            if after + card <= max_entries:
+                after += card
+            else:
+                dropped.append(prefix)
+
+        # Prefixes pruned down to nothing; Redis already removed their empty sets
+        non_empty = {prefix for prefix, _ in keep}
+        dropped += [prefix for prefix in prefixes if prefix not in non_empty]
+
+        pipe = self.redis.pipeline(transaction=False)
+        for start in range(0, len(dropped), chunk_size):
+            chunk = dropped[start:start + chunk_size]
+            pipe.delete(*[self._model_key(name, prefix) for prefix in chunk])
+            pipe.zrem(prefixes_key, *chunk)
+        if decay != 1.0:
+            pipe.zunionstore(prefixes_key, {prefixes_key: decay})
+        pipe.execute()
+
+        return before, after, len(dropped)
+
+    def _compaction_loop(self):
+        """Compact the shared models once per interval across all workers"""
+        while True:
+            try:
+                lock_key = f"{self.namespace}:compaction_lock"
+                if self.redis.set(lock_key, time.time(), nx=True, ex=max(int(self.compaction_interval), 1)):
+                    self.compact_models()
+            except Exception as e:
+                print(f"Error compacting shared predictive models: {e}")
+            time.sleep(min(self.compaction_interval, 300))
+
+    def _get_suggestions(self, username, prefix_words, max_count):
+        """Get word suggestions for a one- or two-word prefix from user and global models"""
+        prefix = ' '.join(prefix_words)
+        user_words, global_words = self._top_many([
+            (self._model_key(username, prefix), max_count),
+            (self._model_key(self.GLOBAL_MODEL, prefix), max_count * 2)
+        ])
+        return self._merge_suggestions(user_words, global_words, max_count)
+
+    def get_bundle_version(self, username):
+        """Version of a user's prediction bundle; changes every few trained messages"""
+        global_updates, user_updates = self._cached(
+            ("updates", username),
+            lambda: self.redis.hmget(self._updates_key(), self.GLOBAL_MODEL, username)
+        ) or (None, None)
+        return (f"{int(global_updates or 0) // self.BUNDLE_GLOBAL_UPDATES}."
+                f"{int(user_updates or 0) // self.BUNDLE_USER_UPDATES}")
+
+    def export_bundle(self, username, max_prefixes=2000, max_user_prefixes=500, max_suggestions=5):
+        """Export a prefix -> suggestions table; see PredictiveText.export_bundle"""
+        version = self.get_bundle_version(username)
+
+        user_prefixes, global_prefixes = self._top_many([
+            (self._prefixes_key(username), max_user_prefixes),
+            (self._prefixes_key(self.GLOBAL_MODEL), max_prefixes)
+        ], use_cache=False)
+        prefixes = list(dict.fromkeys(user_prefixes + global_prefixes))
+
+        requests = []
+        for prefix in prefixes:
+            requests.append((self._model_key(username, prefix), max_suggestions))
+            requests.append((self._model_key(self.GLOBAL_MODEL, prefix), max_suggestions * 2))
+        results = self._top_many(requests, use_cache=False)
+
+        table = {}
+        for i, prefix in enumerate(prefixes):
+            suggestions = self._merge_suggestions(results[2 * i], results[2 * i + 1], max_suggestions)
+            if suggestions:
+                table[prefix] = suggestions
+
+        return {
+            "version": version,
+            "max_suggestions": max_suggestions,
+            "prefixes": table
+        }
+
+    def _merge_suggestions(self, user_words, global_words, max_count):
+        """User suggestions first, then global ones not already suggested"""
+        suggestions = list(user_words[:max_count])
+        for word in global_words:
+            if len(suggestions) >= max_count:
+                break
+            if word not in suggestions:
+                suggestions.append(word)
+        return suggestions
+
+    def _top_many(self, requests, use_cache=True):
+        """
+        Fetch the top members of several sorted sets in one round trip
+
+        Args:
+            requests (list): (key, count) pairs
+            use_cache (bool): Whether to consult and fill the local read cache
+
+        Returns:
+            list: One list of members (as str) per request, highest score first
+        """
+        results = [None] * len(requests)
+        missing = []
+        for i, (key, count) in enumerate(requests):
+            cached = self._cache_get((key, count)) if use_cache else None
+            if cached is None:
+                missing.append(i)
+            else:
+                results[i] = cached
+
+        if missing:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for i in missing:
+                    key, count = requests[i]
+                    pipe.zrevrange(key, 0, count - 1)
+                fetched = pipe.execute()
+            except Exception as e:
+                print(f"Error reading Redis predictive model: {e}")
+                fetched = [[] for _ in missing]
+
+            for i, members in zip(missing, fetched):
+                members = [m.decode('utf-8') if isinstance(m, bytes) else m for m in members]
+                results[i] = members
+                if use_cache:
+                    self._cache_put(requests[i], members)
+
+        return results
+
+    def _cached(self, cache_key, fetch):
+        """Return a cached value or fetch and cache it"""
+        value = self._cache_get(cache_key)
+        if value is None:
+            try:
+                value = fetch()
+            except Exception as e:
+                print(f"Error reading Redis predictive model: {e}")
+                return None
+            self._cache_put(cache_key, value)
+        return value
+
+    def _cache_get(self, cache_key):
+        """Get a fresh entry from the local read cache, or None"""
+        with self._read_cache_lock:
+            entry = self._read_cache.get(cache_key)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            self._read_cache.move_to_end(cache_key)
+            self.hits += 1
+            return entry[1]
+
+    def _cache_put(self, cache_key, value):
+        """Store an entry in the local read cache, evicting the least recently used"""
+        with self._read_cache_lock:
+            self._read_cache[cache_key] = (time.time() + self.read_cache_seconds, value)
+            self._read_cache.move_to_end(cache_key)
+            while len(self._read_cache) > self.read_cache_size:
+                self._read_cache.popitem(last=False)
+
+    def _model_key(self, name, prefix):
+        """Sorted set of next words after prefix in a model"""
+        # Length-prefix the model name so usernames can't run into prefix text
+        return f"{self.namespace}:m:{len(name)}:{name}:{prefix}"
+
+    def _prefixes_key(self, name):
+        """Sorted set of a model's prefixes scored by how often they were seen"""
+        return f"{self.namespace}:p:{name}"
+
+    def _updates_key(self):
+        """Hash of model name -> number of messages trained"""
+        return f"{self.namespace}:updates"
+
+def create_predictive_text():
+    """
+    Create the predictive text model selected by PREDICTIVE_BACKEND
+
+    "redis" shares one model between all workers through Redis; anything
+    else (the default) keeps the models in this process. Falls back to the
+    in-process model if Redis can't be reached.
+    """
+    if os.getenv("PREDICTIVE_BACKEND", "local").lower() == "redis":
+        try:
+            model = RedisPredictiveText()
+            print("Predictive text using shared Redis model")
+            return model
+        except Exception as e:
+            print(f"Redis predictive text backend unavailable: {e}")
+            print("Falling back to in-process predictive text models")
+
+    return PredictiveText()
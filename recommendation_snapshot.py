@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime
+from scipy import sparse
+from sklearn.base import clone
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, training is only serialized per process
+    fcntl = None
+
+# Default location of published recommender snapshots
+SNAPSHOT_DIR = os.path.join('recommendation_data', 'snapshots')
+
+# Bump when the on-disk layout changes so old snapshots are ignored
+SNAPSHOT_FORMAT = 1
+
+# Number of old snapshot versions to keep around after publishing a new one
+KEEP_VERSIONS = 3
+
+# Number of highest-weighted terms kept per room in the term index
+TERMS_PER_ROOM = 200
+
+
+class RecommenderSnapshot:
+    """
+    A complete, read-only set of fitted recommender models
+
+    Snapshots are never modified after they are built. Readers take a single
+    reference to the current snapshot and use it for the whole request, and a
+    newer snapshot is published by replacing that reference, so a request can
+    never see a room table that doesn't match its matrices.
+    """
+
+    def __init__(self, version, created_at, room_names, vectorizer, room_matrix,
+                 count_vectorizer=None, lda_model=None, room_topics=None):
+        self.version = version
+        self.created_at = created_at
+        self.room_names = tuple(room_names)
+        self.room_index = {room: i for i, room in enumerate(self.room_names)}
+        self.vectorizer = vectorizer
+        self.room_matrix = room_matrix
+        self.count_vectorizer = count_vectorizer
+        self.lda_model = lda_model
+        self.room_topics = room_topics
+
+        # Per-room term -> TF-IDF weight index, used to explain recommendations
+        self.analyzer = vectorizer.build_analyzer()
+        self.room_terms = build_term_index(room_matrix, vectorizer.get_feature_names_out())
+
+
+def build_snapshot(room_names, texts, vectorizer, count_vectorizer, lda_model, num_topics=10,
+                   base_dir=SNAPSHOT_DIR):
+    """
+    Fit the recommender models on room texts and publish them as a snapshot
+
+    This is the training entry point; it is normally run in a separate
+    process via train_in_subprocess. The passed estimators are unfitted
+    templates and are cloned before fitting.
+
+    Returns:
+        str: The new snapshot version
+
+    Raises:
+        ValueError: If there is not enough content to fit the models
+    """
+    tfidf = clone(vectorizer)
+    room_matrix = tfidf.fit_transform(texts)
+
+    counts = lda = room_topics = None
+    if len(texts) >= 3:
+        try:
+            counts = clone(count_vectorizer)
+            dtm = counts.fit_transform(texts)
+
+            lda = clone(lda_model).set_params(n_components=min(num_topics, len(texts)))
+            lda.fit(dtm)
+            room_topics = lda.transform(dtm)
+        except ValueError:
+            # Not enough vocabulary for a topic model; publish TF-IDF only
+            counts = lda = room_topics = None
+
+    return save_snapshot(room_names, tfidf, room_matrix, counts, lda, room_topics, base_dir=base_dir)
+
+
+def train_in_subprocess(room_names, texts, vectorizer, count_vectorizer, lda_model, num_topics=10,
+                        base_dir=SNAPSHOT_DIR, timeout=600):
+    """
+    Run build_snapshot in a fresh Python process and return the published version
+
+    Fitting is CPU-bound and would otherwise hold the GIL of the serving
+    worker for its whole duration. The training inputs are handed over
+    through a temporary pickle file.
+
+    Raises:
+        ValueError: If the training process could not build a snapshot
+    """
+    os.makedirs(base_dir, exist_ok=True)
+    fd, job_file = tempfile.mkstemp(prefix=".train-", suffix=".pkl", dir=base_dir)
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({
+                "room_names": list(room_names),
+                "texts": list(texts),
+                "vectorizer": vectorizer,
+                "count_vectorizer": count_vectorizer,
+                "lda_model": lda_model,
+                "num_topics": num_topics,
+                "base_dir": base_dir
+            }, f)
+
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), job_file],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    finally:
+        os.remove(job_file)
+
+    if result.returncode != 0:
+        raise ValueError(f"Training process failed: {result.stderr.strip()[-500:]}")
+
+    return result.stdout.strip().splitlines()[-1]
+
+
+def save_snapshot(room_names, vectorizer, room_matrix, count_vectorizer=None, lda_model=None,
+                  room_topics=None, base_dir=SNAPSHOT_DIR):
+    """
+    Persist fitted recommender artifacts as a new snapshot version
+
+    Arrays are written as individual .npy files so they can be memory-mapped
+    read-only by every worker. The snapshot is built in a temporary directory
+    and only becomes visible once the CURRENT pointer is atomically replaced.
+
+    Args:
+        room_names (list): Room name for each row of room_matrix
+        vectorizer (TfidfVectorizer): Fitted TF-IDF vectorizer
+        room_matrix (scipy.sparse matrix): TF-IDF matrix of room content
+        count_vectorizer (CountVectorizer): Fitted count vectorizer used by the topic model
+        lda_model (LatentDirichletAllocation): Fitted topic model
+        room_topics (numpy.ndarray): Topic distribution for each room
+        base_dir (str): Directory holding snapshot versions
+
+    Returns:
+        str: The new snapshot version
+    """
+    os.makedirs(base_dir, exist_ok=True)
+
+    version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    build_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=base_dir)
+
+    try:
+        room_matrix = sparse.csr_matrix(room_matrix, dtype=np.float32)
+        arrays = {
+            "idf": np.asarray(vectorizer.idf_, dtype=np.float64),
+            "room_data": room_matrix.data,
+            "room_indices": room_matrix.indices,
+            "room_indptr": room_matrix.indptr
+        }
+
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "created_at": datetime.now().isoformat(),
+            "room_names": list(room_names),
+            "room_shape": list(room_matrix.shape),
+            "vocabulary": _ordered_terms(vectorizer.vocabulary_),
+            "has_topics": lda_model is not None and count_vectorizer is not None
+        }
+
+        if meta["has_topics"]:
+            arrays["topic_components"] = np.asarray(lda_model.components_, dtype=np.float64)
+            arrays["topic_exp_dirichlet"] = np.asarray(lda_model.exp_dirichlet_component_, dtype=np.float64)
+            if room_topics is not None:
+                arrays["room_topics"] = np.asarray(room_topics, dtype=np.float64)
+            meta["count_vocabulary"] = _ordered_terms(count_vectorizer.vocabulary_)
+            meta["doc_topic_prior"] = float(lda_model.doc_topic_prior_)
+            meta["lda_params"] = {
+                "n_components": int(lda_model.n_components),
+                "max_doc_update_iter": int(lda_model.max_doc_update_iter),
+                "mean_change_tol": float(lda_model.mean_change_tol)
+            }
+
+        for name, array in arrays.items():
+            np.save(os.path.join(build_dir, f"{name}.npy"), np.ascontiguousarray(array))
+
+        with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        os.replace(build_dir, os.path.join(base_dir, version))
+    except Exception:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    # Publish by atomically swapping the CURRENT pointer
+    pointer_tmp = os.path.join(base_dir, f".CURRENT-{version}")
+    with open(pointer_tmp, 'w') as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(base_dir, 'CURRENT'))
+
+    _prune_old_versions(base_dir, keep=KEEP_VERSIONS)
+
+    return version
+
+
+def current_version(base_dir=SNAPSHOT_DIR):
+    """Return the currently published snapshot version, or None"""
+    try:
+        with open(os.path.join(base_dir, 'CURRENT'), 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_age(base_dir=SNAPSHOT_DIR):
+    """Return the seconds since the current snapshot was published, or None if there is none"""
+    try:
+        return max(0.0, time.time() - os.path.getmtime(os.path.join(base_dir, 'CURRENT')))
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def training_lock(base_dir=SNAPSHOT_DIR, blocking=False):
+    """
+    Hold the lock that allows a single process at a time to train snapshots
+
+    The lock is an advisory lock on a file in the snapshot directory, so it is
+    shared by every worker publishing to that directory and released by the
+    OS if the holder dies.
+
+    Yields:
+        bool: True if the lock is held, False if another process holds it
+    """
+    os.makedirs(base_dir, exist_ok=True)
+
+    with open(os.path.join(base_dir, '.training.lock'), 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_snapshot(vectorizer, count_vectorizer=None, lda_model=None, base_dir=SNAPSHOT_DIR, version=None):
+    """
+    Load a published snapshot with its arrays memory-mapped read-only
+
+    The passed estimators are used as unfitted templates: they are cloned and
+    the clones receive the fitted state, so the originals are left untouched.
+
+    Returns:
+        RecommenderSnapshot: The loaded snapshot, or None if no usable snapshot exists
+    """
+    version = version or current_version(base_dir)
+    if not version:
+        return None
+
+    snapshot_dir = os.path.join(base_dir, version)
+    try:
+        with open(os.path.join(snapshot_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if meta.get("format") != SNAPSHOT_FORMAT:
+        return None
+
+    def load_array(name):
+        return np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode='r')
+
+    # Rebuild the TF-IDF vectorizer from its vocabulary and IDF weights
+    tfidf = clone(vectorizer)
+    tfidf.vocabulary_ = {term: i for i, term in enumerate(meta["vocabulary"])}
+    tfidf.idf_ = load_array("idf")
+
+    room_matrix = sparse.csr_matrix(
+        (load_array("room_data"), load_array("room_indices"), load_array("room_indptr")),
+        shape=tuple(meta["room_shape"]),
+        copy=False
+    )
+
+    counts = lda = room_topics = None
+    if meta.get("has_topics") and count_vectorizer is not None and lda_model is not None:
+        counts = clone(count_vectorizer)
+        counts.vocabulary_ = {term: i for i, term in enumerate(meta["count_vocabulary"])}
+
+        lda = clone(lda_model).set_params(**meta["lda_params"])
+        lda.components_ = load_array("topic_components")
+        lda.exp_dirichlet_component_ = load_array("topic_exp_dirichlet")
+        lda.doc_topic_prior_ = meta["doc_topic_prior"]
+        lda.n_features_in_ = lda.components_.shape[1]
+
+        if os.path.exists(os.path.join(snapshot_dir, 'room_topics.npy')):
+            room_topics = load_array("room_topics")
+
+    return RecommenderSnapshot(
+        meta["version"],
+        meta["created_at"],
+        meta["room_names"],
+        tfidf,
+        room_matrix,
+        count_vectorizer=counts,
+        lda_model=lda,
+        room_topics=room_topics
+    )
+
+
+def build_term_index(room_matrix, feature_names, terms_per_room=TERMS_PER_ROOM):
+    """Map each room row to a dict of its highest-weighted terms and their TF-IDF weights"""
+    room_matrix = sparse.csr_matrix(room_matrix)
+    index = []
+
+    for row in range(room_matrix.shape[0]):
+        start, end = room_matrix.indptr[row], room_matrix.indptr[row + 1]
+        columns = room_matrix.indices[start:end]
+        weights = room_matrix.data[start:end]
+
+        if len(weights) > terms_per_room:
+            keep = np.argpartition(-weights, terms_per_room - 1)[:terms_per_room]
+            columns, weights = columns[keep], weights[keep]
+
+        index.append({str(feature_names[col]): float(weight) for col, weight in zip(columns, weights)})
+
+    return index
+
+
+def _ordered_terms(vocabulary):
+    """Convert a term -> index mapping into a list ordered by index"""
+    terms = [None] * len(vocabulary)
+    for term, index in vocabulary.items():
+        terms[index] = term
+    return terms
+
+
+def _prune_old_versions(base_dir, keep=KEEP_VERSIONS):
+    """Remove all but the newest `keep` snapshot versions"""
+    current = current_version(base_dir)
+    versions = sorted(
+        name for name in os.listdir(base_dir)
+        if not name.startswith('.') and os.path.isdir(os.path.join(base_dir, name))
+    )
+
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # Training process entry point: python recommendation_snapshot.py <job.pkl>
+    with open(sys.argv[1], 'rb') as f:
+        job = pickle.load(f)
+
+    print(build_snapshot(**job))
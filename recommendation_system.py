@@ -4,36 +4,347 @@ from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.decomposition import LatentDirichletAllocation
 import os
 import json
+import atexit
+import threading
+import time
 import matplotlib.pyplot as plt
-from datetime import datetime
+import queue
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
 from Database import Database
+from trending_topics import TrendingTopics
+from recommendation_snapshot import (build_snapshot, current_version, load_snapshot, snapshot_age,
+                                     train_in_subprocess, training_lock)
+
+class RecommendationHistory:
+    """Buffered, append-only store for recommendation events
+
+    Events are queued in memory and flushed in batches by a background thread,
+    either to the database's history collection or, for file-based
+    storage, to an append-only JSON-lines log that is rotated once it grows
+    past `max_log_bytes`.
+    """
+
+    def __init__(self, database, flush_interval=10, max_per_user=100, max_buffer=10000,
+                 max_log_bytes=16 * 1024 * 1024):
+        self.db = database
+        self.flush_interval = flush_interval
+        self.max_per_user = max_per_user
+        self.max_log_bytes = max_log_bytes
+        self.log_file = os.path.join('recommendation_data', 'recommendation_history.jsonl')
+
+        # Use the indexed history collection when the database supports it
+        self.use_db = hasattr(database, 'log_recommendation_events')
+
+        self._buffer = deque(maxlen=max_buffer)
+        self._untrimmed = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def record(self, username, algorithm, recommendations):
+        """Queue a recommendation event for the next flush"""
+        event = {
+            "username": username,
+            "timestamp": datetime.now().isoformat(),
+            "algorithm": algorithm,
+            "recommendations": list(recommendations)
+        }
+
+        with self._lock:
+            self._buffer.append(event)
+
+    def get(self, username, limit=50):
+        """Get the most recent recommendation events for a user (newest first)"""
+        self.flush()
+
+        if self.use_db:
+            return self.db.get_recommendation_history(username, limit)
+
+        # File-based fallback: keep only the last `limit` matching lines while scanning
+        recent = deque(maxlen=limit)
+        for path in (self.log_file + '.1', self.log_file):
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            event = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if event.get("username") == username:
+                            recent.append(event)
+            except FileNotFoundError:
+                continue
+
+        return list(reversed(recent))
+
+    def flush(self):
+        """Write all buffered events to storage, returning the number written"""
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._buffer)
+                self._buffer.clear()
+
+            if not events:
+                return 0
+
+            try:
+                if self.use_db:
+                    self.db.log_recommendation_events(events)
+                    self._apply_retention(events)
+                else:
+                    self._append_to_log(events)
+            except Exception as e:
+                print(f"Error flushing recommendation history: {e}")
+                return 0
+
+            return len(events)
+
+    def _apply_retention(self, events):
+        """Trim per-user history once enough new events have accumulated"""
+        for event in events:
+            self._untrimmed[event["username"]] += 1
+
+        # Trimming costs two queries, so only do it every tenth of the retention limit
+        threshold = max(1, self.max_per_user // 10)
+        for username, count in list(self._untrimmed.items()):
+            if count >= threshold:
+                self.db.trim_recommendation_history(username, self.max_per_user)
+                del self._untrimmed[username]
+
+    def _append_to_log(self, events):
+        """Append events to the JSON-lines log, rotating it when it gets too large"""
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+
+        if os.path.exists(self.log_file) and os.path.getsize(self.log_file) > self.max_log_bytes:
+            os.replace(self.log_file, self.log_file + '.1')
+
+        with open(self.log_file, 'a') as f:
+            f.write("".join(json.dumps(event) + "\n" for event in events))
+
+    def _flush_loop(self):
+        """Periodically flush buffered events in the background"""
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+class UserVectorCache:
+    """
+    LRU cache of user interest vectors bounded by an estimated memory budget
+
+    Each entry records the model version it was computed with, a fingerprint
+    of the interests it was built from, and when it was last refreshed, so
+    refreshes can be debounced and skipped when nothing changed.
+    """
+
+    # Rough per-entry overhead (dict slot, tuple, sparse matrix object) in bytes
+    ENTRY_OVERHEAD = 600
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, username):
+        return username in self._entries
+
+    def get(self, username, model_version=None):
+        """Get a cached vector, or None if missing or built with another model version"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or (model_version is not None and entry["model_version"] != model_version):
+                return None
+            self._entries.move_to_end(username)
+            return entry["vector"]
+
+    def peek(self, username):
+        """Get the raw entry for a user without affecting LRU order"""
+        return self._entries.get(username)
+
+    def put(self, username, vector, fingerprint, model_version):
+        """Store a user's vector, evicting least recently used entries over budget"""
+        size = self.ENTRY_OVERHEAD
+        if vector is not None:
+            size += vector.data.nbytes + vector.indices.nbytes + vector.indptr.nbytes
+
+        with self._lock:
+            old = self._entries.pop(username, None)
+            if old is not None:
+                self.bytes_used -= old["size"]
+
+            self._entries[username] = {
+                "vector": vector,
+                "fingerprint": fingerprint,
+                "model_version": model_version,
+                "refreshed_at": time.time(),
+                "size": size
+            }
+            self.bytes_used += size
+
+            while self.bytes_used > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes_used -= evicted["size"]
+                self.evictions += 1
+
+    def touch(self, username):
+        """Mark a user's entry as freshly checked without recomputing it"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                entry["refreshed_at"] = time.time()
+
+    def claim_refresh(self, username, model_version, interval):
+        """
+        Mark a user's vector as being refreshed, unless a refresh is already
+        pending or the entry was refreshed with this model within interval
+        seconds. Returns True if the caller should schedule the refresh.
+        """
+        with self._lock:
+            if username in self._pending:
+                return False
+            entry = self._entries.get(username)
+            if (entry is not None and model_version is not None and entry["model_version"] == model_version
+                    and time.time() - entry["refreshed_at"] < interval):
+                return False
+            self._pending.add(username)
+            return True
+
+    def release_refresh(self, username):
+        """Clear a user's pending refresh so later messages can schedule another"""
+        with self._lock:
+            self._pending.discard(username)
+
+    def stats(self):
+        """Report size and eviction counters"""
+        return {
+            "users": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
 
 class RoomRecommender:
     def __init__(self, database=None):
         """Initialize the recommendation system with optional database instance"""
         self.db = database if database else Database()
-        self.room_content = {}
-        self.room_vectors = {}
-        self.user_vectors = {}
         self.topic_models = {}
+
+        # User vectors are refreshed off the request path, at most once per interval per user
+        self.user_vectors = UserVectorCache(
+            max_bytes=int(os.getenv("RECOMMENDER_USER_VECTOR_BYTES", 32 * 1024 * 1024))
+        )
+        self.user_vector_interval = int(os.getenv("RECOMMENDER_USER_VECTOR_INTERVAL_SECONDS", 300))
+        self._user_vector_queue = queue.Queue(maxsize=10000)
+        self._user_vector_worker = threading.Thread(target=self._user_vector_loop, daemon=True)
+        self._user_vector_worker.start()
+
+        # Streaming, time-decayed trend detection fed directly by new messages
+        self.trending = TrendingTopics(
+            half_life_hours=float(os.getenv("TRENDING_HALF_LIFE_HOURS", 6))
+        )
+
+        # Top-N lists produced by the last batch_recommend run, keyed by username
+        self.batch_recommendations = {}
+
+        # Unfitted templates; fitted copies live in the current model snapshot
         self.vectorizer = TfidfVectorizer(stop_words='english', min_df=2, max_df=0.95)
         self.count_vectorizer = CountVectorizer(stop_words='english', min_df=2, max_df=0.95)
-        self.lda_model = None
-        self.recommendation_history = {}
+
+        # Current RecommenderSnapshot. Only ever replaced as a whole, never mutated,
+        # so readers should take one reference and use it for the whole request.
+        self.model = None
+        self._training_lock = threading.Lock()
+        self._last_snapshot_check = 0
+        self.snapshot_check_interval = int(os.getenv("RECOMMENDER_SNAPSHOT_CHECK_SECONDS", 30))
+        self.train_out_of_process = os.getenv("RECOMMENDER_TRAIN_IN_PROCESS", "0") != "1"
+        # Forced refreshes reuse a snapshot another worker published within this window
+        self.retrain_interval = int(os.getenv("RECOMMENDER_RETRAIN_SECONDS", 1800))
 
         # Create directories for recommendation data
         os.makedirs('recommendation_data', exist_ok=True)
 
-        # Load cached data if available
-        self._load_cached_data()
+        # Recommendation events are appended in batches rather than rewritten per request
+        self.recommendation_history = RecommendationHistory(
+            self.db,
+            flush_interval=int(os.getenv("RECOMMENDATION_HISTORY_FLUSH_SECONDS", 10)),
+            max_per_user=int(os.getenv("RECOMMENDATION_HISTORY_PER_USER", 100))
+        )
 
     def update_room_content(self, force_refresh=False):
-        """Update room content vectors using the database"""
-        # Check if we need to refresh
-        if self.room_content and not force_refresh:
+        """
+        Make sure a fitted model is available, retraining it when forced
+
+        Training runs in a separate process that publishes a new snapshot.
+        Until it is fully built, the current snapshot keeps being served; the
+        new one is then swapped in with a single reference assignment.
+
+        All workers share the snapshot directory, so only the worker holding
+        its training lock trains, and only if nothing was published within the
+        retrain interval. The other workers just load the published snapshot.
+        """
+        if not force_refresh:
+            if self.model is not None:
+                # Pick up snapshots published by other workers or the trainer
+                self._check_for_new_snapshot()
+                return
+
+            # On first use, load the published snapshot instead of refitting
+            if self._swap_to_snapshot():
+                return
+
+        # Only one training run per worker; if one is already in progress,
+        # keep serving the current model unless there is none yet
+        if not self._training_lock.acquire(blocking=self.model is None):
             return
 
-        self.room_content = {}
+        try:
+            if self.model is not None and not force_refresh:
+                return
+
+            # Without a model, wait for a worker that is already training and use its snapshot
+            with training_lock(blocking=self.model is None) as acquired:
+                if not acquired:
+                    # Another worker is training; its snapshot is picked up once published
+                    return
+
+                if self._use_recent_snapshot():
+                    return
+
+                room_names, content_texts = self._collect_room_texts()
+                if not room_names:
+                    return
+
+                version = self._train(room_names, content_texts)
+                if version:
+                    self._swap_to_snapshot(version)
+        finally:
+            self._training_lock.release()
+
+    def _use_recent_snapshot(self):
+        """Serve a snapshot published within the retrain interval, returning True if there is one"""
+        age = snapshot_age()
+        if age is None or age >= self.retrain_interval:
+            return False
+
+        version = current_version()
+        if self.model is not None and self.model.version == version:
+            return True
+
+        return self._swap_to_snapshot(version)
+
+    def _collect_room_texts(self):
+        """Gather the recent message text of each active room"""
+        room_names = []
+        content_texts = []
 
         # Get active rooms from database
         active_rooms = self.db.get_active_rooms(limit=100)
@@ -45,43 +356,66 @@ class RoomRecommender:
 
             if messages:
                 # Combine all messages into a single text
-                content = " ".join([msg["content"] for msg in messages])
-                self.room_content[room_name] = content
+                room_names.append(room_name)
+                content_texts.append(" ".join([msg["content"] for msg in messages]))
 
-        # Vectorize all room content
-        if self.room_content:
-            room_names = list(self.room_content.keys())
-            content_texts = [self.room_content[room] for room in room_names]
+        return room_names, content_texts
 
-            # TF-IDF vectorization
-            try:
-                self.content_vectors = self.vectorizer.fit_transform(content_texts)
-                self.room_names = room_names
+    def _train(self, room_names, content_texts):
+        """Fit and publish a new snapshot, returning its version (None if there isn't enough data)"""
+        train = train_in_subprocess if self.train_out_of_process else build_snapshot
 
-                # Update room vectors
-                for i, room in enumerate(room_names):
-                    self.room_vectors[room] = self.content_vectors[i]
+        try:
+            return train(room_names, content_texts, self.vectorizer, self.count_vectorizer, self._new_topic_model())
+        except ValueError as e:
+            # Handle case where vectorization fails (e.g., not enough data)
+            print(f"Could not train recommender: {e}")
+            return None
+        except Exception as e:
+            print(f"Error running recommender training process, training in-process instead: {e}")
 
-                # Build topic model
-                self._build_topic_model(content_texts)
+        try:
+            return build_snapshot(room_names, content_texts, self.vectorizer, self.count_vectorizer,
+                                  self._new_topic_model())
+        except ValueError as e:
+            print(f"Could not train recommender: {e}")
+            return None
+
+    def _check_for_new_snapshot(self):
+        """Swap to a newer published snapshot, checking at most once per interval"""
+        now = time.time()
+        if now - self._last_snapshot_check < self.snapshot_check_interval:
+            return
+        self._last_snapshot_check = now
 
-                # Cache the data
-                self._cache_data()
-            except:
-                # Handle case where vectorization fails (e.g., not enough data)
-                self.content_vectors = None
-                self.room_names = []
+        version = current_version()
+        if version and version != self.model.version:
+            self._swap_to_snapshot(version)
 
     def update_user_interest(self, username, message):
-        """Update user interest profile based on their messages using the database"""
-        # Get user interests from database
-        interests = self.db.get_user_interests(username)
+        """Schedule a refresh of the user's interest vector (debounced, done in the background)"""
+        # Extracting keywords from the message is handled by the database's
+        # _update_user_interests method; here we only refresh the user vector
+        model = self.model
+        model_version = model.version if model is not None else None
+        if not self.user_vectors.claim_refresh(username, model_version, self.user_vector_interval):
+            return
 
-        # Extract keywords from message and add to interests
-        # (This is now handled by the database's _update_user_interests method)
+        try:
+            self._user_vector_queue.put_nowait(username)
+        except queue.Full:
+            # Under heavy load just skip this refresh; a later message will retry
+            self.user_vectors.release_refresh(username)
 
-        # Update user vector
-        self._update_user_vector(username)
+    def record_message(self, room_name, message, timestamp=None):
+        """Feed a new chat message into the trending topics model"""
+        self.trending.add_message(message, timestamp)
+
+    def seed_trending_topics(self, rooms=100, messages_per_room=200):
+        """Warm up the trending topics model from recent stored messages"""
+        for room_data in self.db.get_active_rooms(limit=rooms):
+            for msg in self.db.get_room_messages(room_data["name"], limit=messages_per_room):
+                self.trending.add_message(msg["content"], msg.get("timestamp"))
 
     def get_user_recommendations(self, username, top_n=5, algorithm="hybrid"):
         """
@@ -98,7 +432,8 @@ class RoomRecommender:
         # Update room content first
         self.update_room_content()
 
-        if not self.room_content:
+        model = self.model
+        if model is None:
             return ["No active rooms found for recommendations."]
 
         # Get user data
@@ -111,97 +446,223 @@ class RoomRecommender:
         if not interests and not joined_rooms:
             return ["No recommendations available yet. Chat more to get personalized suggestions!"]
 
-        # Track this recommendation request
-        if username not in self.recommendation_history:
-            self.recommendation_history[username] = []
-
-        timestamp = datetime.now().isoformat()
-
         # Choose algorithm
         if algorithm == "content":
-            recommendations = self._content_based_recommendations(username, top_n)
+            recommendations = self._content_based_recommendations(username, top_n, model)
         elif algorithm == "collaborative":
             recommendations = self._collaborative_recommendations(username, top_n)
         elif algorithm == "topic":
-            recommendations = self._topic_based_recommendations(username, top_n)
+            recommendations = self._topic_based_recommendations(username, top_n, model)
         else:  # hybrid
-            recommendations = self._hybrid_recommendations(username, top_n)
+            recommendations = self._hybrid_recommendations(username, top_n, model)
+
+        recommendations = self._finish_recommendations(recommendations, joined_rooms, top_n)
 
+        # Record recommendation (flushed to storage in the background)
+        self.recommendation_history.record(username, algorithm, recommendations)
+
+        return recommendations
+
+    def _finish_recommendations(self, recommendations, joined_rooms, top_n):
+        """Drop rooms the user has joined and top the list up with popular rooms"""
         # Filter out rooms the user has already joined
         recommendations = [r for r in recommendations if r not in joined_rooms][:top_n]
 
         # If we don't have enough recommendations, add popular rooms
         if len(recommendations) < top_n:
-            popular_rooms = self._get_popular_rooms(top_n - len(recommendations))
+            popular_rooms = self._get_popular_rooms(top_n - len(recommendations) + len(joined_rooms))
             for room in popular_rooms:
+                if len(recommendations) >= top_n:
+                    break
                 if room not in recommendations and room not in joined_rooms:
                     recommendations.append(room)
 
-        # Record recommendation
-        self.recommendation_history[username].append({
-            "timestamp": timestamp,
-            "algorithm": algorithm,
-            "recommendations": recommendations
-        })
+        return recommendations
+
+    def get_recommendation_history(self, username, limit=50):
+        """Get the most recent recommendations made to a user (newest first)"""
+        return self.recommendation_history.get(username, limit)
+
+    def batch_recommend(self, usernames=None, top_n=5, active_days=7, chunk_size=5000):
+        """
+        Precompute content-based recommendations for many users at once
+
+        Builds a sparse interest matrix for a chunk of users, scores it against
+        the room matrix with a single sparse product, masks out joined rooms
+        and selects each user's top N rooms with vectorized operations.
+
+        Args:
+            usernames (list): Users to score; defaults to everyone active recently
+            top_n (int): Number of recommendations to keep per user
+            active_days (int): How far back to look for active users when usernames is None
+            chunk_size (int): Number of users scored per matrix product
+
+        Returns:
+            dict: Throughput statistics for the run
+        """
+        start = time.time()
+        self.update_room_content()
+
+        model = self.model
+        if model is None:
+            return {"users": 0, "scored": 0, "seconds": 0.0, "users_per_second": 0.0}
+
+        results = {}
+        users_seen = 0
+        for profiles in self._iter_profile_chunks(usernames, active_days, chunk_size):
+            users_seen += len(profiles)
+            results.update(self._score_profiles(profiles, model, top_n))
+
+        # Replace the whole table at once so readers never see a half-built run
+        self.batch_recommendations = results
+
+        if hasattr(self.db, 'save_batch_recommendations'):
+            try:
+                self.db.save_batch_recommendations(results, model.version)
+            except Exception as e:
+                print(f"Error saving batch recommendations: {e}")
+
+        elapsed = time.time() - start
+        stats = {
+            "users": users_seen,
+            "scored": len(results),
+            "seconds": round(elapsed, 3),
+            "users_per_second": round(users_seen / elapsed, 1) if elapsed > 0 else 0.0
+        }
+        print(f"Batch recommendations: {stats['users']} users in {stats['seconds']}s "
+              f"({stats['users_per_second']} users/sec)")
+
+        return stats
+
+    def get_precomputed_recommendations(self, username, top_n=5):
+        """
+        Get content-based recommendations from the last batch run
+
+        Rooms the user joined since the run are dropped and the list is
+        topped up with popular rooms, the same way as on-demand results.
+
+        Returns:
+            list: Recommended room names, or None if the user wasn't scored
+        """
+        rooms = self.batch_recommendations.get(username)
+
+        if rooms is None and hasattr(self.db, 'get_batch_recommendations'):
+            try:
+                rooms = self.db.get_batch_recommendations(username)
+            except Exception as e:
+                print(f"Error loading batch recommendations: {e}")
+
+        if not rooms:
+            return None
+
+        joined_rooms = self.db.load_user_data(username).get("joined_rooms", [])
+        recommendations = self._finish_recommendations(rooms, joined_rooms, top_n)
 
-        # Save recommendation history
-        self._save_recommendation_history()
+        self.recommendation_history.record(username, "content", recommendations)
 
         return recommendations
 
+    def _iter_profile_chunks(self, usernames, active_days, chunk_size):
+        """Yield lists of user profiles (username, interests, joined_rooms) in chunks"""
+        if hasattr(self.db, 'iter_recommendation_profiles'):
+            active_since = None
+            if usernames is None and active_days:
+                active_since = (datetime.now() - timedelta(days=active_days)).isoformat()
+            profiles = self.db.iter_recommendation_profiles(usernames=usernames, active_since=active_since)
+        else:
+            # Databases without bulk profile access can only score explicit users
+            profiles = (
+                {
+                    "username": username,
+                    "interests": data.get("interests", []),
+                    "joined_rooms": data.get("joined_rooms", [])
+                }
+                for username, data in ((u, self.db.load_user_data(u)) for u in (usernames or []))
+            )
+
+        chunk = []
+        for profile in profiles:
+            if profile["interests"]:
+                chunk.append(profile)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def _score_profiles(self, profiles, model, top_n):
+        """Score a chunk of user profiles against all rooms and return their top N lists"""
+        # Rows of both matrices are L2-normalized, so the product is cosine similarity
+        user_matrix = model.vectorizer.transform([" ".join(p["interests"]) for p in profiles])
+        scores = (user_matrix @ model.room_matrix.T).toarray()
+
+        # Mask joined rooms and rooms with no overlap at all
+        rows, cols = [], []
+        for row, profile in enumerate(profiles):
+            for room in profile["joined_rooms"]:
+                col = model.room_index.get(room)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        scores[rows, cols] = -np.inf
+        scores[scores <= 0] = -np.inf
+
+        # Partial sort per row, then order just the top N
+        k = min(top_n, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        results = {}
+        for row, profile in enumerate(profiles):
+            results[profile["username"]] = [
+                model.room_names[col]
+                for col, score in zip(top[row], top_scores[row])
+                if score != -np.inf
+            ]
+
+        return results
+
     def get_similar_rooms(self, room_name, top_n=5):
         """Find rooms similar to a given room"""
         self.update_room_content()
 
-        if not self.content_vectors or room_name not in self.room_content:
+        model = self.model
+        if model is None:
             return [f"Room '{room_name}' not found."]
 
         # Get index of the target room
-        try:
-            room_idx = self.room_names.index(room_name)
-        except ValueError:
+        room_idx = model.room_index.get(room_name)
+        if room_idx is None:
             return [f"Room '{room_name}' not found in the index."]
 
         # Get similarity scores
-        room_vector = self.content_vectors[room_idx]
-        similarities = cosine_similarity(room_vector, self.content_vectors).flatten()
+        room_vector = model.room_matrix[room_idx]
+        similarities = cosine_similarity(room_vector, model.room_matrix).flatten()
 
         # Get top N similar rooms (excluding the room itself)
         similar_indices = np.argsort(similarities)[::-1]
 
         # Filter out the room itself
-        similar_indices = [idx for idx in similar_indices if self.room_names[idx] != room_name]
+        similar_indices = [idx for idx in similar_indices if idx != room_idx]
 
         # Get top N
         top_indices = similar_indices[:top_n]
-        similar_rooms = [self.room_names[idx] for idx in top_indices]
+        similar_rooms = [model.room_names[idx] for idx in top_indices]
 
         return similar_rooms
 
     def get_trending_topics(self, num_topics=5, num_words=5):
-        """Get trending topics across all rooms"""
-        if not self.lda_model:
-            self.update_room_content(force_refresh=True)
+        """Get trending topics across all rooms from the in-memory streaming model"""
+        topics = self.trending.get_topics(num_topics, num_words)
 
-            if not self.lda_model:
-                return ["Not enough data to identify topics."]
+        if not topics:
+            return ["Not enough data to identify topics."]
 
-        topics = []
-        feature_names = self.count_vectorizer.get_feature_names_out()
-
-        for topic_idx, topic in enumerate(self.lda_model.components_):
-            top_features_idx = topic.argsort()[:-num_words-1:-1]
-            top_features = [feature_names[i] for i in top_features_idx]
-            topics.append({
-                "id": topic_idx,
-                "words": top_features,
-                "weight": float(np.sum(topic))
-            })
-
-        # Sort by weight
-        topics.sort(key=lambda x: x["weight"], reverse=True)
-
-        return topics[:num_topics]
+        return topics
 
     def visualize_user_interests(self, username):
         """Generate visualization of user interests"""
@@ -245,33 +706,64 @@ class RoomRecommender:
 
         return filename
 
-    def get_recommendation_explanation(self, username, room_name):
+    def get_recommendation_evidence(self, username, room_name, interests=None, top_k=5):
+        """
+        Rank the user's interests that appear in a room's content
+
+        Args:
+            username (str): The user the room was recommended to
+            room_name (str): The recommended room
+            interests (list): The user's interests, if already loaded
+            top_k (int): Maximum number of terms to return
+
+        Returns:
+            list: (interest, term, weight) tuples, highest TF-IDF weight first
+        """
+        if interests is None:
+            interests = self.db.load_user_data(username).get("interests", [])
+
+        model = self.model
+        if model is None or not interests:
+            return []
+
+        room_idx = model.room_index.get(room_name)
+        if room_idx is None:
+            return []
+
+        # Interests are analyzed exactly like room content, so matching is a set intersection
+        room_terms = model.room_terms[room_idx]
+        evidence = []
+        for interest in interests:
+            matched = set(model.analyzer(interest)) & room_terms.keys()
+            if matched:
+                term = max(matched, key=room_terms.get)
+                evidence.append((interest, term, room_terms[term]))
+
+        evidence.sort(key=lambda x: x[2], reverse=True)
+
+        return evidence[:top_k]
+
+    def get_recommendation_explanation(self, username, room_name, interests=None, room_metadata=None):
         """Explain why a room was recommended to a user"""
-        user_data = self.db.load_user_data(username)
-        interests = user_data.get("interests", [])
+        if interests is None:
+            user_data = self.db.load_user_data(username)
+            interests = user_data.get("interests", [])
 
         if not interests:
             return "No interest data available to explain recommendations."
 
         # Get room metadata
-        room_metadata = self.db.get_room_metadata(room_name)
+        if room_metadata is None:
+            room_metadata = self.db.get_room_metadata(room_name)
         room_tags = room_metadata.get("tags", [])
 
-        # Get room messages
-        messages = self.db.get_room_messages(room_name, limit=100)
-        room_content = " ".join([msg["content"] for msg in messages])
-
-        # Find matching interests
-        matching_interests = []
-        for interest in interests:
-            if interest.lower() in room_content.lower():
-                matching_interests.append(interest)
+        # Find matching interests, ranked by how prominent they are in the room
+        evidence = self.get_recommendation_evidence(username, room_name, interests)
+        matching_interests = [interest for interest, _, _ in evidence]
 
         # Find matching tags
-        matching_tags = []
-        for tag in room_tags:
-            if tag.lower() in [interest.lower() for interest in interests]:
-                matching_tags.append(tag)
+        interest_set = {interest.lower() for interest in interests}
+        matching_tags = [tag for tag in room_tags if tag.lower() in interest_set]
 
         # Generate explanation
         explanation = f"Room '{room_name}' was recommended because:\n"
@@ -290,29 +782,33 @@ class RoomRecommender:
 
         return explanation
 
-    def _content_based_recommendations(self, username, top_n=5):
+    def _content_based_recommendations(self, username, top_n=5, model=None):
         """Get content-based recommendations using TF-IDF and cosine similarity"""
+        model = model or self.model
+
         # Get user interests
         user_data = self.db.load_user_data(username)
         interests = user_data.get("interests", [])
 
-        if not interests or not self.content_vectors:
+        if not interests or model is None:
             return []
 
-        # Create user vector from interests
-        user_text = " ".join(interests)
-        try:
-            user_vector = self.vectorizer.transform([user_text])
-        except:
-            # If vectorization fails, return empty list
-            return []
+        # Use the cached user vector if it is current, otherwise build one from interests
+        user_vector = self.user_vectors.get(username, model.version)
+        if user_vector is None:
+            user_text = " ".join(interests)
+            try:
+                user_vector = model.vectorizer.transform([user_text])
+            except:
+                # If vectorization fails, return empty list
+                return []
 
         # Calculate similarity with all rooms
-        similarities = cosine_similarity(user_vector, self.content_vectors).flatten()
+        similarities = cosine_similarity(user_vector, model.room_matrix).flatten()
 
         # Get top N recommendations
         top_indices = similarities.argsort()[-top_n*2:][::-1]  # Get more than needed for filtering
-        recommendations = [self.room_names[i] for i in top_indices]
+        recommendations = [model.room_names[i] for i in top_indices]
 
         return recommendations
 
@@ -380,9 +876,10 @@ class RoomRecommender:
 
         return recommendations
 
-    def _topic_based_recommendations(self, username, top_n=5):
+    def _topic_based_recommendations(self, username, top_n=5, model=None):
         """Get recommendations based on topic modeling"""
-        if not self.lda_model:
+        model = model or self.model
+        if model is None or model.lda_model is None or model.room_topics is None:
             return []
 
         # Get user interests
@@ -395,28 +892,14 @@ class RoomRecommender:
         # Create user vector from interests
         user_text = " ".join(interests)
         try:
-            user_count_vector = self.count_vectorizer.transform([user_text])
-            user_topic_dist = self.lda_model.transform(user_count_vector)[0]
+            user_count_vector = model.count_vectorizer.transform([user_text])
+            user_topic_dist = model.lda_model.transform(user_count_vector)[0]
         except:
             return []
 
-        # Get topic distribution for each room
-        room_topic_dists = {}
-        for room_name in self.room_names:
-            room_text = self.room_content[room_name]
-            try:
-                room_count_vector = self.count_vectorizer.transform([room_text])
-                room_topic_dist = self.lda_model.transform(room_count_vector)[0]
-                room_topic_dists[room_name] = room_topic_dist
-            except:
-                continue
-
-        # Calculate similarity between user and room topic distributions
-        room_scores = {}
-        for room_name, room_topic_dist in room_topic_dists.items():
-            # Use Jensen-Shannon divergence
-            similarity = 1.0 - np.sqrt(0.5 * np.sum((user_topic_dist - room_topic_dist)**2))
-            room_scores[room_name] = similarity
+        # Calculate similarity between user and precomputed room topic distributions
+        similarities = 1.0 - np.sqrt(0.5 * np.sum((model.room_topics - user_topic_dist)**2, axis=1))
+        room_scores = dict(zip(model.room_names, similarities))
 
         # Sort rooms by score
         sorted_rooms = sorted(room_scores.items(), key=lambda x: x[1], reverse=True)
@@ -424,12 +907,14 @@ class RoomRecommender:
 
         return recommendations
 
-    def _hybrid_recommendations(self, username, top_n=5):
+    def _hybrid_recommendations(self, username, top_n=5, model=None):
         """Combine multiple recommendation approaches"""
+        model = model or self.model
+
         # Get recommendations from each method
-        content_recs = self._content_based_recommendations(username, top_n)
+        content_recs = self._content_based_recommendations(username, top_n, model)
         collab_recs = self._collaborative_recommendations(username, top_n)
-        topic_recs = self._topic_based_recommendations(username, top_n)
+        topic_recs = self._topic_based_recommendations(username, top_n, model)
 
         # Combine and weight recommendations
         room_scores = {}
@@ -469,71 +954,66 @@ class RoomRecommender:
 
     def _update_user_vector(self, username):
         """Update vector representation of user interests"""
+        model = self.model
+        if model is None:
+            return
+
         # Get user interests
         interests = self.db.get_user_interests(username)
 
         if not interests:
             return
 
+        # Skip the transform when neither the interests nor the model changed
+        fingerprint = hash(tuple(interests))
+        entry = self.user_vectors.peek(username)
+        if entry is not None and entry["fingerprint"] == fingerprint and entry["model_version"] == model.version:
+            self.user_vectors.touch(username)
+            return
+
         # Create vector from interests
         user_text = " ".join(interests)
         try:
-            user_vector = self.vectorizer.transform([user_text])
-            self.user_vectors[username] = user_vector
+            user_vector = model.vectorizer.transform([user_text])
+            self.user_vectors.put(username, user_vector, fingerprint, model.version)
         except:
             pass
 
-    def _build_topic_model(self, texts, num_topics=10):
-        """Build LDA topic model from room content"""
-        if not texts or len(texts) < 3:
-            return
+    def _user_vector_loop(self):
+        """Background worker that refreshes queued user vectors"""
+        while True:
+            username = self._user_vector_queue.get()
+            try:
+                self._update_user_vector(username)
+            except Exception as e:
+                print(f"Error updating user vector for {username}: {e}")
+            finally:
+                self.user_vectors.release_refresh(username)
+
+    def _new_topic_model(self, num_topics=10):
+        """Create an unfitted LDA model with the recommender's settings"""
+        return LatentDirichletAllocation(
+            n_components=num_topics,
+            max_iter=10,
+            learning_method='online',
+            random_state=42,
+            batch_size=128,
+            evaluate_every=-1
+        )
 
+    def _swap_to_snapshot(self, version=None):
+        """Load a published snapshot and make it the current model, returning True on success"""
         try:
-            # Create document-term matrix
-            dtm = self.count_vectorizer.fit_transform(texts)
-
-            # Build LDA model
-            self.lda_model = LatentDirichletAllocation(
-                n_components=min(num_topics, len(texts)),
-                max_iter=10,
-                learning_method='online',
-                random_state=42,
-                batch_size=128,
-                evaluate_every=-1
-            )
-
-            self.lda_model.fit(dtm)
-        except:
-            self.lda_model = None
+            snapshot = load_snapshot(self.vectorizer, self.count_vectorizer, self._new_topic_model(), version=version)
+        except Exception as e:
+            print(f"Error loading recommendation snapshot: {e}")
+            return False
 
-    def _cache_data(self):
-        """Cache vectorizer and other data for faster loading"""
-        try:
-            cache_file = os.path.join('recommendation_data', 'cache_info.json')
-            with open(cache_file, 'w') as f:
-                json.dump({
-                    "timestamp": datetime.now().isoformat(),
-                    "num_rooms": len(self.room_names),
-                    "vectorizer_features": len(self.vectorizer.get_feature_names_out())
-                }, f)
-        except:
-            pass
+        if snapshot is None or not snapshot.room_names:
+            return False
 
-    def _load_cached_data(self):
-        """Load cached recommendation history"""
-        try:
-            history_file = os.path.join('recommendation_data', 'recommendation_history.json')
-            if os.path.exists(history_file):
-                with open(history_file, 'r') as f:
-                    self.recommendation_history = json.load(f)
-        except:
-            self.recommendation_history = {}
+        # Single reference assignment; in-flight requests keep the snapshot they started with
+        self.model = snapshot
+        self._last_snapshot_check = time.time()
 
-    def _save_recommendation_history(self):
-        """Save recommendation history to file"""
-        try:
-            history_file = os.path.join('recommendation_data', 'recommendation_history.json')
-            with open(history_file, 'w') as f:
-                json.dump(self.recommendation_history, f, indent=2)
-        except:
-            pass
\ No newline at end of file
+        return True
@@ -1,47 +1,143 @@
-import nltk
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from nltk.sentiment import SentimentIntensityAnalyzer
-import matplotlib.pyplot as plt
-import pandas as pd
+import nlp_resources
+
+class ScoreCache:
+    """
+    Bounded LRU memo of sentiment scores keyed by a hash of the message text
+
+    Keys are digests of the whitespace-normalized text rather than the text
+    itself, so long messages don't inflate the cache. Only whitespace is
+    normalized: VADER reacts to capitals and punctuation, so "great!!" and
+    "GREAT" must stay distinct entries.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    @staticmethod
+    def key(message):
+        """Hash the whitespace-normalized text of a message"""
+        return hashlib.blake2b(' '.join(message.split()).encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key):
+        """Get a cached score and mark it recently used, or None"""
+        with self._lock:
+            scores = self._scores.get(key)
+            if scores is None:
+                self.misses += 1
+                return None
+            self._scores.move_to_end(key)
+            self.hits += 1
+            return scores
+
+    def put(self, key, scores):
+        """Cache a score, evicting the least recently used one if full"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._scores[key] = scores
+            self._scores.move_to_end(key)
+            if len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def stats(self):
+        """Report size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._scores),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+class SentimentScorer:
+    """
+    Scores messages on a bounded pool of worker threads
+
+    Each scored message is handed to callback(score, *context) on the worker
+    thread. At most max_pending messages wait or run at once; further ones
+    are rejected rather than queued, so a backlog can't grow without bound.
+    """
+
+    def __init__(self, analyzer, callback, workers=2, max_pending=1000):
+        self.analyzer = analyzer
+        self.callback = callback
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sentiment")
+
+    def submit(self, message, *context):
+        """
+        Queue a message for scoring
+
+        Returns:
+            bool: False if the pool is full and the message was not queued
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            return False
+        self._executor.submit(self._score, message, context)
+        return True
+
+    def _score(self, message, context):
+        """Score one message and pass the compound score to the callback"""
+        try:
+            score = self.analyzer.analyze_message(message)['compound']
+            self.callback(score, *context)
+        except Exception as e:
+            print(f"Error scoring message sentiment: {e}")
+        finally:
+            self._slots.release()
 
 class MessageSentimentAnalyzer:
-    def __init__(self):
-        nltk.download('vader_lexicon')
-        self.sia = SentimentIntensityAnalyzer()
+    def __init__(self, cache_size=None):
+        # The VADER lexicon is loaded on first use, not at startup
+        self._sia = None
+        self._sia_lock = threading.Lock()
+
+        # Chat is full of repeated short messages ("ok", "lol", "thanks!"), so scores are memoized
+        if cache_size is None:
+            cache_size = int(os.getenv("SENTIMENT_CACHE_SIZE", 10000))
+        self.cache = ScoreCache(cache_size)
         
+    @property
+    def sia(self):
+        """The VADER analyzer, loading its lexicon from the provisioned NLTK data on first use"""
+        if self._sia is None:
+            with self._sia_lock:
+                if self._sia is None:
+                    nlp_resources.require('vader_lexicon')
+                    self._sia = SentimentIntensityAnalyzer()
+        return self._sia
+
     def analyze_message(self, message):
         """Analyze the sentiment of a single message"""
-        sentiment_score = self.sia.polarity_scores(message)
-        return sentiment_score
+        key = ScoreCache.key(message)
+        sentiment_score = self.cache.get(key)
+        if sentiment_score is None:
+            sentiment_score = self.sia.polarity_scores(message)
+            self.cache.put(key, sentiment_score)
+        # Callers get their own copy so they can't alter the cached scores
+        return dict(sentiment_score)
     
     def analyze_conversation(self, messages):
         """Analyze sentiment trends in a conversation"""
-        sentiment_scores = [self.sia.polarity_scores(msg)['compound'] for msg in messages]
+        sentiment_scores = [self.analyze_message(msg)['compound'] for msg in messages]
         return sentiment_scores
-    
-    def visualize_conversation_sentiment(self, room_name):
-        """Generate visualization of sentiment over time in a conversation"""
-        # Read messages from room
-        messages = self._get_messages_from_room(room_name)
-        sentiment_scores = self.analyze_conversation(messages)
-        
-        # Create visualization
-        df = pd.DataFrame({
-            'Message Index': range(len(sentiment_scores)),
-            'Sentiment': sentiment_scores
-        })
-        plt.figure(figsize=(10, 6))
-        plt.plot(df['Message Index'], df['Sentiment'])
-        plt.title(f'Conversation Sentiment Analysis for Room: {room_name}')
-        plt.xlabel('Message Sequence')
-        plt.ylabel('Sentiment Score')
-        plt.axhline(y=0, color='r', linestyle='-')
-        plt.savefig(f'{room_name}_sentiment.png')
-        return f'{room_name}_sentiment.png'
-    
-    def _get_messages_from_room(self, room_name):
-        """Extract just the message content from a room file"""
-        with open(f"rooms/{room_name}.txt", "r") as f:
-            lines = f.readlines()
-            # Extract just the message part after the username
-            messages = [line.split(':', 1)[1].strip() if ':' in line else line.strip() for line in lines]
-            return messages
\ No newline at end of file
+
+    def get_cache_stats(self):
+        """Report score cache usage"""
+        return self.cache.stats()
@@ -3,6 +3,9 @@ let socket;
 let isConnected = false;
 let typingTimeout;
 let currentRoom = '';
+let roomJoined = false;
+let predictionRequestId = 0;
+let predictionCallback = null;
 
 // Initialize WebSocket connection
 function initWebSocket() {
@@ -18,13 +21,11 @@ function initWebSocket() {
         return;
     }
     
-    // Get the current room name from the URL if in a chat room
+    // Get the current room name from the URL if in a chat room (/chat/<room_name>)
     const urlParts = window.location.pathname.split('/');
-    if (urlParts.includes('chat_room')) {
-        const roomIndex = urlParts.indexOf('chat_room') + 1;
-        if (roomIndex < urlParts.length) {
-            currentRoom = urlParts[roomIndex];
-        }
+    const roomIndex = urlParts.indexOf('chat') + 1;
+    if (roomIndex > 0 && roomIndex < urlParts.length && urlParts[roomIndex]) {
+        currentRoom = decodeURIComponent(urlParts[roomIndex]);
     }
     
     // Initialize Socket.IO connection
@@ -35,20 +36,20 @@ function initWebSocket() {
         console.log('WebSocket connected');
         isConnected = true;
         
-        // Authenticate with the server
+        // Authenticate with the server; the room is joined once that succeeds
         socket.emit('authenticate', { username: username });
-        
-        // Join the current room if in a chat room
-        if (currentRoom) {
-            socket.emit('join_room', { room: currentRoom });
-            console.log(`Joined room: ${currentRoom}`);
-        }
     });
     
     // Disconnection event
     socket.on('disconnect', function() {
         console.log('WebSocket disconnected');
         isConnected = false;
+        
+        // Room events stop arriving until we rejoin after reconnecting
+        if (roomJoined) {
+            roomJoined = false;
+            document.dispatchEvent(new CustomEvent('websocketRoomLeft', { detail: { room: currentRoom } }));
+        }
     });
     
     // Error event
@@ -59,6 +60,20 @@ function initWebSocket() {
     // Authentication response
     socket.on('authenticated', function(data) {
         console.log(`Authenticated as ${data.username}`);
+        
+        // Join the current room if in a chat room
+        if (currentRoom) {
+            socket.emit('join_room', { room: currentRoom });
+        }
+    });
+    
+    // Room join acknowledgement; from now on the room's events are delivered here
+    socket.on('room_joined', function(data) {
+        if (data.room !== currentRoom) return;
+        
+        console.log(`Joined room: ${currentRoom}`);
+        roomJoined = true;
+        document.dispatchEvent(new CustomEvent('websocketRoomJoined', { detail: { room: currentRoom } }));
     });
     
     // New message event
@@ -69,6 +84,16 @@ function initWebSocket() {
         }
     });
     
+    // Sentiment of a message, scored after it was sent
+    socket.on('sentiment_update', function(data) {
+        if (currentRoom !== data.room) return;
+        
+        const indicator = document.querySelector(`[data-message-id="${data.id}"] .message-sentiment`);
+        if (indicator) {
+            indicator.innerHTML = sentimentIconHtml(data.sentiment);
+        }
+    });
+    
     // User joined event
     socket.on('user_joined', function(data) {
         if (currentRoom === data.room) {
@@ -102,23 +127,44 @@ function initWebSocket() {
     socket.on('user_status', function(data) {
         updateUserStatus(data.username, data.status);
     });
+    
+    // Word predictions event
+    socket.on('predictions', function(data) {
+        // Ignore answers to requests superseded by newer keystrokes
+        if (data.id === predictionRequestId && predictionCallback) {
+            predictionCallback(data.predictions);
+        }
+    });
 }
 
-// Send a message via WebSocket
-function sendMessageViaWebSocket(message) {
+// Whether the current room's events (messages, typing, sentiment) arrive over the WebSocket
+function isWebSocketRoomJoined() {
+    return isConnected && roomJoined;
+}
+
+// Request word predictions via WebSocket; only the newest request's answer reaches the callback
+function requestPredictionsViaWebSocket(text, callback) {
     if (!isConnected || !socket) {
-        console.error('WebSocket not connected');
         return false;
     }
     
-    socket.emit('new_message', {
-        room: currentRoom,
-        message: message
+    predictionRequestId += 1;
+    predictionCallback = callback;
+    
+    socket.emit('predict', {
+        id: predictionRequestId,
+        text: text
     });
     
     return true;
 }
 
+// Drop the answer to any outstanding prediction request, e.g. once the text was answered locally
+function cancelPredictionsViaWebSocket() {
+    predictionRequestId += 1;
+    predictionCallback = null;
+}
+
 // Send typing indicator
 function sendTypingIndicator(isTyping) {
     if (!isConnected || !socket || !currentRoom) {
@@ -136,6 +182,9 @@ function addMessageToChat(data) {
     const chatMessages = document.getElementById('chatMessages');
     if (!chatMessages) return;
     
+    // Skip messages that are already shown, e.g. by a reload that raced the broadcast
+    if (data.id && chatMessages.querySelector(`[data-message-id="${data.id}"]`)) return;
+    
     const isCurrentUser = data.username === document.querySelector('.dropdown-toggle').textContent.trim();
     
     const messageElement = document.createElement('div');
@@ -144,16 +193,8 @@ function addMessageToChat(data) {
     // Format timestamp
     const timestamp = data.timestamp || new Date().toLocaleTimeString();
     
-    // Create sentiment indicator if available
-    let sentimentIcon = '';
-    if (data.sentiment !== undefined && data.sentiment !== null) {
-        if (data.sentiment > 0.2) {
-            sentimentIcon = '<i class="bi bi-emoji-smile text-success" title="Positive"></i>';
-        } else if (data.sentiment < -0.2) {
-            sentimentIcon = '<i class="bi bi-emoji-frown text-danger" title="Negative"></i>';
-        } else {
-            sentimentIcon = '<i class="bi bi-emoji-neutral text-muted" title="Neutral"></i>';
-        }
+    if (data.id) {
+        messageElement.dataset.messageId = data.id;
     }
     
     messageElement.innerHTML = `
@@ -163,7 +204,7 @@ function addMessageToChat(data) {
         </div>
         <div class="message-content">
             ${data.message}
-            ${sentimentIcon}
+            <span class="message-sentiment">${sentimentIconHtml(data.sentiment)}</span>
         </div>
     `;
     
@@ -173,6 +214,19 @@ function addMessageToChat(data) {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+// Sentiment indicator icon for a message score, empty while it is unscored
+function sentimentIconHtml(sentiment) {
+    if (sentiment === undefined || sentiment === null) {
+        return '';
+    }
+    if (sentiment > 0.2) {
+        return '<i class="bi bi-emoji-smile text-success" title="Positive"></i>';
+    } else if (sentiment < -0.2) {
+        return '<i class="bi bi-emoji-frown text-danger" title="Negative"></i>';
+    }
+    return '<i class="bi bi-emoji-neutral text-muted" title="Neutral"></i>';
+}
+
 // Add a system message to the chat
 function addSystemMessage(message) {
     const chatMessages = document.getElementById('chatMessages');
@@ -301,17 +355,4 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize WebSocket
     initWebSocket();
-    
-    // Modify the message form to use WebSockets
-    const messageForm = document.getElementById('messageForm');
-    if (messageForm) {
-        messageForm.addEventListener('submit', function(e) {
-            // Don't prevent default - let the form submit normally as fallback
-            // But also try to send via WebSocket
-            const messageInput = document.getElementById('messageInput');
-            if (messageInput && isConnected) {
-                sendMessageViaWebSocket(messageInput.value);
-            }
-        });
-    }
 });
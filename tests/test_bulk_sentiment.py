@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from nltk.sentiment.vader import SentimentIntensityAnalyzer, VaderConstants
+
+from bulk_sentiment import VectorSentimentEngine
+
+# A few lexicon words are enough to exercise every valence rule
+LEXICON = {
+    "good": 1.9, "great": 3.1, "bad": -2.5, "terrible": -2.1, "love": 3.2, "hate": -2.7,
+    "fun": 2.3, "boring": -1.3, "happy": 2.7, "sad": -2.1, "kind": 2.4, "no": -1.2,
+}
+
+TEXTS = [
+    "This is good",
+    "This is GOOD!!!",
+    "not good at all",
+    "The movie was great, but the ending was terrible",
+    "I don't love it",
+    "very very happy",
+    "kind of boring",
+    "It is kind of fun?",
+    "at least it is not bad",
+    "never so happy",
+    "no",
+    "",
+    "the bomb party was fun",
+    "extremely sad :(",
+    "I HATE mondays but love fridays!",
+    "Hmm... fun, I guess",
+    "hardly good",
+    "without doubt good",
+    "cut the mustard, sort of great",
+]
+
+
+def _analyzer(lexicon):
+    sia = SentimentIntensityAnalyzer.__new__(SentimentIntensityAnalyzer)
+    sia.lexicon = lexicon
+    sia.constants = VaderConstants()
+    return sia
+
+
+def _assert_matches_vader(sia, texts):
+    expected = np.array([sia.polarity_scores(text)["compound"] for text in texts])
+    np.testing.assert_allclose(VectorSentimentEngine(sia).score(texts), expected, atol=1e-4)
+
+
+def test_engine_matches_vader_rules():
+    _assert_matches_vader(_analyzer(LEXICON), TEXTS)
+
+
+def test_engine_matches_vader_with_full_lexicon():
+    try:
+        sia = SentimentIntensityAnalyzer()
+    except LookupError:
+        pytest.skip("vader_lexicon is not provisioned")
+
+    _assert_matches_vader(sia, TEXTS + ["I absolutely adore this :)", "Worst. Day. Ever.", "meh, it's OK I guess"])
@@ -0,0 +1,106 @@
+import multiprocessing
+import random
+
+from predictive_text import ModelCache, NGramModel, PredictiveText, prefix_key
+
+
+def _train_and_save(model_dir, username, messages):
+    predictor = PredictiveText(flush_interval=10 ** 9, model_dir=model_dir)
+    for message in messages:
+        predictor.train_on_message(username, message)
+    predictor.save_models()
+
+
+def test_compaction_evicts_down_to_cap_when_counts_tie(tmp_path):
+    predictor = PredictiveText(flush_interval=10 ** 9, model_dir=str(tmp_path))
+    predictor.min_count = 1
+    predictor.max_user_entries = 5000
+
+    rng = random.Random(7)
+    words = [f"word{i}" for i in range(3000)]
+    for _ in range(3000):
+        predictor.train_on_message("amy", " ".join(rng.choice(words) for _ in range(4)))
+
+    model = predictor.user_models.get("amy")
+    assert model.entries > 5000
+
+    predictor._compact_model("amy", model, 1.0, predictor.max_user_entries)
+
+    # Nearly every n-gram was seen once; eviction must stop at the cap, not wipe the ties
+    assert model.entries == 5000
+    assert sum(1 if isinstance(pairs, int) else len(pairs) >> 1 for pairs in model.tables.values()) == 5000
+
+
+def test_eviction_keeps_higher_counts_and_breaks_ties_by_word_id():
+    model = NGramModel()
+    for word_id in range(10):
+        model.add(prefix_key(1), word_id)
+    model.add(prefix_key(2), 5, amount=3)
+
+    min_count, tie_cutoff = model.eviction_cutoff(4)
+    for key in list(model.tables):
+        model.compact_prefix(key, 1.0, min_count, tie_cutoff)
+
+    assert model.entries == 4
+    assert model.most_common(prefix_key(2), 1) == [(5, 3)]
+    assert sorted(word_id for word_id, _ in model.most_common(prefix_key(1), 10)) == [0, 1, 2]
+
+
+def test_model_bytes_round_trip_keeps_counts_and_indexes():
+    model = NGramModel()
+    model.add(prefix_key(1), 7, amount=5)
+    model.add(prefix_key(2), 3)
+    model.add(prefix_key(2), 4, amount=2)
+    for word_id in range(NGramModel.INDEX_THRESHOLD + 5):
+        model.add(prefix_key(3), word_id, amount=word_id + 1)
+    model.updates = 42
+
+    restored = NGramModel.from_bytes(model.to_bytes())
+
+    assert restored.updates == 42
+    assert restored.entries == model.entries
+    assert restored.tables[prefix_key(1)] == model.tables[prefix_key(1)]
+    for key in (prefix_key(1), prefix_key(2), prefix_key(3)):
+        assert restored.most_common(key, 10) == model.most_common(key, 10)
+    assert prefix_key(3) in restored.index and prefix_key(3) in restored.top
+
+    # The rebuilt indexes must keep working for further updates
+    restored.add(prefix_key(3), 0, amount=100)
+    assert restored.most_common(prefix_key(3), 1) == [(0, 101)]
+
+
+def test_workers_sharing_a_store_agree_on_word_ids(tmp_path):
+    model_dir = str(tmp_path)
+    # Both workers start before either saves, so each sees new words the other also interns
+    first = PredictiveText(flush_interval=10 ** 9, model_dir=model_dir)
+    first.train_on_message("amy", "good morning everyone")
+
+    context = multiprocessing.get_context("spawn")
+    worker = context.Process(target=_train_and_save,
+                             args=(model_dir, "bob", ["see you tomorrow", "good night everyone"]))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    first.train_on_message("amy", "see you later")
+    first.save_models()
+
+    # The global model is the first worker's (the last one written); bob's model is the worker's
+    reader = PredictiveText(flush_interval=10 ** 9, model_dir=model_dir)
+    assert reader.predict_next_word("amy", "good") == ["morning"]
+    assert reader.predict_next_word("amy", "see you") == ["later"]
+    assert reader.predict_next_word("bob", "good") == ["night", "morning"]
+    assert reader.predict_next_word("bob", "see you") == ["tomorrow", "later"]
+
+
+def test_released_words_are_reloaded_with_their_models(tmp_path):
+    predictor = PredictiveText(flush_interval=10 ** 9, model_dir=str(tmp_path))
+    predictor.train_on_message("amy", "quiet evening walk")
+    predictor.save_models()
+
+    # Drop every loaded model, as if they had all been evicted
+    predictor.user_models = ModelCache()
+    predictor.global_model = NGramModel()
+    assert predictor._release_unused_words() == 3
+
+    assert predictor.predict_next_word("amy", "quiet evening") == ["walk"]
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+from sklearn.decomposition import LatentDirichletAllocation
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from recommendation_snapshot import (KEEP_VERSIONS, build_snapshot, current_version, load_snapshot,
+                                     training_lock)
+
+ROOMS = ["python", "music", "cooking", "travel"]
+TEXTS = [
+    "python code functions python classes code review bugs",
+    "guitar songs music concert songs band music album",
+    "recipes cooking dinner oven recipes baking bread dinner",
+    "travel flights hotels beaches travel passport flights trip",
+]
+
+
+def _templates():
+    return (TfidfVectorizer(stop_words='english'), CountVectorizer(stop_words='english'),
+            LatentDirichletAllocation(random_state=0))
+
+
+def test_snapshot_round_trip_matches_fitted_models(tmp_path):
+    base_dir = str(tmp_path)
+    version = build_snapshot(ROOMS, TEXTS, *_templates(), num_topics=3, base_dir=base_dir)
+
+    assert current_version(base_dir) == version
+    snapshot = load_snapshot(*_templates(), base_dir=base_dir)
+
+    assert snapshot.version == version
+    assert snapshot.room_names == tuple(ROOMS)
+
+    # The rebuilt vectorizer reproduces the stored room matrix
+    transformed = snapshot.vectorizer.transform(TEXTS).toarray()
+    np.testing.assert_allclose(transformed, snapshot.room_matrix.toarray(), rtol=1e-5, atol=1e-6)
+
+    # The rebuilt topic model reproduces the stored room topics
+    assert snapshot.lda_model.n_components == 3
+    topics = snapshot.lda_model.transform(snapshot.count_vectorizer.transform(TEXTS))
+    np.testing.assert_allclose(topics, snapshot.room_topics, rtol=1e-5, atol=1e-6)
+
+    assert "python" in snapshot.room_terms[0]
+
+
+def test_publishing_keeps_recent_versions_and_ignores_unpublished_ones(tmp_path):
+    base_dir = str(tmp_path)
+    versions = [build_snapshot(ROOMS, TEXTS, *_templates(), num_topics=2, base_dir=base_dir)
+                for _ in range(KEEP_VERSIONS + 2)]
+
+    assert current_version(base_dir) == versions[-1]
+    assert sorted(name for name in os.listdir(base_dir) if not name.startswith('.')
+                  and os.path.isdir(os.path.join(base_dir, name))) == versions[-KEEP_VERSIONS:]
+
+    # An old version can still be loaded explicitly, a missing one can't
+    assert load_snapshot(*_templates(), base_dir=base_dir, version=versions[-2]).version == versions[-2]
+    assert load_snapshot(*_templates(), base_dir=base_dir, version="19700101000000000000") is None
+
+
+def test_only_one_holder_of_the_training_lock(tmp_path):
+    base_dir = str(tmp_path)
+    with training_lock(base_dir) as first:
+        with training_lock(base_dir) as second:
+            assert first and not second
+
+    with training_lock(base_dir) as again:
+        assert again
@@ -0,0 +1,186 @@
+import math
+import re
+import heapq
+import threading
+import time
+from datetime import datetime
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+class TrendingTopics:
+    """
+    Streaming trend detector over chat messages with exponential time decay
+
+    Every term keeps two decayed counts: a recent one (half-life of a few
+    hours) and a long-running background one. A term is trending when its
+    recent count exceeds what its background rate predicts. Terms that keep
+    appearing together in messages are grouped into topics.
+
+    Decay uses forward decay: each occurrence is added with weight
+    exp(rate * (t - landmark)), so updates are O(1) and nothing has to be
+    decayed in place until the landmark is moved forward.
+    """
+
+    def __init__(self, half_life_hours=6, background_half_life_hours=168, max_terms=5000,
+                 max_partners=20, min_count=2, refresh_seconds=30):
+        self.recent_rate = math.log(2) / (half_life_hours * 3600)
+        self.background_rate = math.log(2) / (background_half_life_hours * 3600)
+        self.max_terms = max_terms
+        self.max_partners = max_partners
+        self.min_count = min_count
+        self.refresh_seconds = refresh_seconds
+
+        # term -> [recent forward-decayed count, background forward-decayed count]
+        self.terms = {}
+        # term -> {co-occurring term: recent forward-decayed count}
+        self.partners = {}
+        self.landmark = time.time()
+        self.messages_seen = 0
+
+        self._lock = threading.Lock()
+        self._topics = []
+        self._topics_computed_at = 0
+        # (num_topics, num_words) the cached topics were computed for
+        self._topics_size = (0, 0)
+
+    def add_message(self, message, timestamp=None):
+        """Update term statistics with one message (timestamp defaults to now)"""
+        if isinstance(timestamp, str):
+            timestamp = self._parse_timestamp(timestamp)
+        timestamp = timestamp or time.time()
+
+        words = self._tokenize(message)
+        if not words:
+            return
+
+        with self._lock:
+            self._maybe_move_landmark(timestamp)
+
+            recent_weight = math.exp(self.recent_rate * (timestamp - self.landmark))
+            background_weight = math.exp(self.background_rate * (timestamp - self.landmark))
+
+            for word in words:
+                counts = self.terms.get(word)
+                if counts is None:
+                    self.terms[word] = [recent_weight, background_weight]
+                else:
+                    counts[0] += recent_weight
+                    counts[1] += background_weight
+
+            # Track co-occurrence among (at most 10) distinct words of the message
+            for word in words[:10]:
+                partners = self.partners.setdefault(word, {})
+                for other in words[:10]:
+                    if other != word:
+                        partners[other] = partners.get(other, 0.0) + recent_weight
+                if len(partners) > self.max_partners * 2:
+                    self._prune_partners(partners)
+
+            self.messages_seen += 1
+            if len(self.terms) > self.max_terms * 1.2:
+                self._prune_terms()
+
+    def get_topics(self, num_topics=5, num_words=5):
+        """Get the currently trending topics, recomputed at most every refresh_seconds"""
+        now = time.time()
+        if self._needs_refresh(now, num_topics, num_words):
+            with self._lock:
+                if self._needs_refresh(now, num_topics, num_words):
+                    size = (max(num_topics, 10), max(num_words, 10))
+                    self._topics = self._compute_topics(now, *size)
+                    self._topics_computed_at = now
+                    self._topics_size = size
+
+        return [
+            {"id": topic["id"], "words": topic["words"][:num_words], "weight": topic["weight"]}
+            for topic in self._topics[:num_topics]
+        ]
+
+    def _needs_refresh(self, now, num_topics, num_words):
+        """Whether the cached topics are stale or were computed for a smaller request"""
+        cached_topics, cached_words = self._topics_size
+        return (now - self._topics_computed_at >= self.refresh_seconds
+                or num_topics > cached_topics or num_words > cached_words)
+
+    def _compute_topics(self, now, num_topics, num_words):
+        """Rank terms by burstiness and group them with their co-occurring terms"""
+        recent_scale = math.exp(-self.recent_rate * (now - self.landmark))
+        background_scale = math.exp(-self.background_rate * (now - self.landmark))
+
+        # Under a steady rate, the recent count is this fraction of the background count
+        expected_ratio = self.background_rate / self.recent_rate
+
+        scores = {}
+        for term, (recent, background) in self.terms.items():
+            recent_count = recent * recent_scale
+            excess = recent_count - background * background_scale * expected_ratio
+            if excess > 0 and recent_count >= self.min_count:
+                scores[term] = excess
+
+        topics = []
+        used = set()
+        for term, score in heapq.nlargest(num_topics * 3, scores.items(), key=lambda x: x[1]):
+            if term in used:
+                continue
+
+            partners = self.partners.get(term, {})
+            related = [
+                other for other, _ in sorted(partners.items(), key=lambda x: x[1], reverse=True)
+                if other in scores and other not in used
+            ][:num_words - 1]
+
+            words = [term] + related
+            used.update(words)
+            topics.append({
+                "id": len(topics),
+                "words": words,
+                "weight": float(score + sum(scores[word] for word in related))
+            })
+
+            if len(topics) >= num_topics:
+                break
+
+        topics.sort(key=lambda x: x["weight"], reverse=True)
+        return topics
+
+    def _maybe_move_landmark(self, timestamp):
+        """Rescale all counts to a newer landmark before the weights overflow"""
+        if self.recent_rate * (timestamp - self.landmark) < 50:
+            return
+
+        recent_scale = math.exp(-self.recent_rate * (timestamp - self.landmark))
+        background_scale = math.exp(-self.background_rate * (timestamp - self.landmark))
+
+        for counts in self.terms.values():
+            counts[0] *= recent_scale
+            counts[1] *= background_scale
+        for partners in self.partners.values():
+            for other in partners:
+                partners[other] *= recent_scale
+
+        self.landmark = timestamp
+
+    def _prune_terms(self):
+        """Drop the terms with the lowest background counts to stay within max_terms"""
+        keep = heapq.nlargest(self.max_terms, self.terms.items(), key=lambda x: x[1][1])
+        self.terms = dict(keep)
+        self.partners = {term: partners for term, partners in self.partners.items() if term in self.terms}
+
+    def _prune_partners(self, partners):
+        """Keep only the strongest co-occurring terms of one term"""
+        strongest = heapq.nlargest(self.max_partners, partners.items(), key=lambda x: x[1])
+        partners.clear()
+        partners.update(strongest)
+
+    def _tokenize(self, message):
+        """Extract distinct, non-stopword terms from a message, in order"""
+        words = re.findall(r'\b[a-z]{3,}\b', message.lower())
+        return list(dict.fromkeys(word for word in words if word not in ENGLISH_STOP_WORDS))
+
+    def _parse_timestamp(self, timestamp):
+        """Parse a stored message timestamp into epoch seconds"""
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+            try:
+                return datetime.strptime(timestamp, fmt).timestamp()
+            except ValueError:
+                continue
+        return None
@@ -1,5 +1,7 @@
-from flask_socketio import SocketIO, emit, join_room, leave_room, request
+from flask import request, session
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import json
+import threading
 from datetime import datetime
 
 # Initialize SocketIO
@@ -8,12 +10,30 @@ socketio = SocketIO()
 # Connected users tracking
 connected_users = {}
 
+# Word prediction callable(username, text, max_suggestions), registered by the app
+prediction_provider = None
+
+# Latest unanswered predict request per connection: sid -> (request id, text)
+pending_predictions = {}
+pending_predictions_lock = threading.Lock()
+
+# How long to wait for a fast typist's next keystroke before answering
+PREDICT_COALESCE_SECONDS = 0.02
+
 def init_socketio(app):
     """Initialize SocketIO with the Flask app"""
-    socketio.init_app(app, cors_allowed_origins="*")
+    # Events are emitted from plain threads (sentiment scoring, the bot worker),
+    # which is only reliable in threading mode; eventlet would be picked
+    # whenever it is installed, and the app doesn't monkey-patch for it
+    socketio.init_app(app, cors_allowed_origins="*", async_mode='threading')
     register_handlers()
     return socketio
 
+def set_prediction_provider(provider):
+    """Register the function answering `predict` events"""
+    global prediction_provider
+    prediction_provider = provider
+
 def register_handlers():
     """Register all WebSocket event handlers"""
 
@@ -35,6 +55,8 @@ def register_handlers():
 
             # Remove from connected users
             del connected_users[request.sid]
+            with pending_predictions_lock:
+                pending_predictions.pop(request.sid, None)
 
             # Broadcast user offline status
             socketio.emit('user_status', {
@@ -97,6 +119,9 @@ def register_handlers():
             'timestamp': datetime.now().isoformat()
         }, room=room_name)
 
+        # Tell the client its room events are now delivered over this connection
+        emit('room_joined', {'room': room_name})
+
         print(f"User {username} joined room: {room_name}")
 
     @socketio.on('leave_room')
@@ -116,38 +141,6 @@ def register_handlers():
         # Leave the room
         leave_chat_room(username, room_name)
 
-    @socketio.on('new_message')
-    def handle_new_message(data):
-        """Handle new chat message"""
-        if request.sid not in connected_users:
-            emit('error', {'message': 'Not authenticated'})
-            return
-
-        username = connected_users[request.sid]['username']
-        room_name = data.get('room')
-        message = data.get('message', '').strip()
-
-        if not room_name or not message:
-            emit('error', {'message': 'Room name and message are required'})
-            return
-
-        # Check if user is in the room
-        if room_name not in connected_users[request.sid]['rooms']:
-            emit('error', {'message': 'You are not in this room'})
-            return
-
-        # Update last activity
-        connected_users[request.sid]['last_activity'] = datetime.now().isoformat()
-
-        # Broadcast message to room (will be saved to database by the API endpoint)
-        # This is just for real-time delivery
-        emit('chat_message', {
-            'username': username,
-            'room': room_name,
-            'message': message,
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }, room=room_name)
-
     @socketio.on('typing')
     def handle_typing(data):
         """Handle typing indicator"""
@@ -172,6 +165,51 @@ def register_handlers():
             'typing': is_typing
         }, room=room_name, include_self=False)
 
+    @socketio.on('predict')
+    def handle_predict(data):
+        """Handle a word prediction request for the text being typed"""
+        # Predictions come from the user's own model, so use the logged-in session user
+        username = session.get('username')
+        if not username or request.sid not in connected_users:
+            emit('error', {'message': 'Not authenticated'})
+            return
+
+        if prediction_provider is None:
+            emit('predictions', {'id': data.get('id'), 'predictions': []})
+            return
+
+        # Only the latest request per connection is answered; a request that
+        # arrives before the previous one was picked up simply replaces it
+        sid = request.sid
+        with pending_predictions_lock:
+            already_scheduled = sid in pending_predictions
+            pending_predictions[sid] = (data.get('id'), data.get('text', ''))
+
+        if not already_scheduled:
+            socketio.start_background_task(answer_prediction, sid, username)
+
+def answer_prediction(sid, username):
+    """Answer the latest pending predict request of a connection"""
+    socketio.sleep(PREDICT_COALESCE_SECONDS)
+
+    with pending_predictions_lock:
+        pending = pending_predictions.pop(sid, None)
+    if pending is None:
+        return
+
+    request_id, text = pending
+    try:
+        predictions = prediction_provider(username, text, 5)
+    except Exception as e:
+        print(f"Error predicting words for {username}: {e}")
+        predictions = []
+
+    socketio.emit('predictions', {
+        'id': request_id,
+        'text': text,
+        'predictions': predictions
+    }, room=sid)
+
 def leave_chat_room(username, room_name):
     """Helper function to leave a chat room"""
     # Find user's session ID